@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""Simple keep-alive HTTP load generator for the profiles REST API
+
+Runs a number of client threads against one URL for a fixed time and prints
+the requests per second and latency percentiles of the successful requests
+(and the failed ones by status) as JSON, for example:
+
+    python3 deploy/loadtest.py http://127.0.0.1:9000/api/feed/ \
+        --token <token> --concurrency 32 --duration 30
+
+Only the standard library is used so it runs on the server itself.
+"""
+import argparse
+import http.client
+import json
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+def percentile(values, fraction):
+    """Return the value at the given fraction of the sorted values"""
+    if not values:
+        return None
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+def client(url, headers, deadline, latencies, errors, lock):
+    """Send requests over one keep-alive connection until the deadline"""
+    parts = urlsplit(url)
+    path = parts.path + (f'?{parts.query}' if parts.query else '')
+    connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+    connection = connection_class(parts.netloc, timeout=30)
+    own_latencies, own_errors = [], {}
+
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        try:
+            connection.request('GET', path, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            if response.status >= 400:
+                own_errors[response.status] = own_errors.get(response.status, 0) + 1
+            else:
+                own_latencies.append(time.perf_counter() - started)
+        except (OSError, http.client.HTTPException):
+            own_errors['connection'] = own_errors.get('connection', 0) + 1
+            connection.close()
+            connection = connection_class(parts.netloc, timeout=30)
+
+    connection.close()
+    with lock:
+        latencies.extend(own_latencies)
+        errors.append(own_errors)
+
+
+def run(url, token=None, concurrency=16, duration=10):
+    """Run the load test and return its results as a dictionary"""
+    headers = {'Accept': 'application/json', 'Connection': 'keep-alive'}
+    if token:
+        headers['Authorization'] = f'Token {token}'
+
+    latencies, errors, lock = [], [], threading.Lock()
+    started = time.monotonic()
+    deadline = started + duration
+    threads = [
+        threading.Thread(target=client, args=(url, headers, deadline, latencies, errors, lock))
+        for _ in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    latencies.sort()
+    errors_by_status = {}
+    for own_errors in errors:
+        for status, count in own_errors.items():
+            errors_by_status[str(status)] = errors_by_status.get(str(status), 0) + count
+    return {
+        'url': url,
+        'concurrency': concurrency,
+        'duration': round(elapsed, 3),
+        'requests': len(latencies),
+        'errors': sum(errors_by_status.values()),
+        'errors_by_status': errors_by_status,                                   # 429: the rate limit of the token, not the server, answered
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('url')
+    parser.add_argument('--token', help='API token sent in the Authorization header')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10)
+    args = parser.parse_args()
+    print(json.dumps(run(args.url, args.token, args.concurrency, args.duration), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class ProfilesApiConfig(AppConfig):
     name = 'profiles_api'
+
+    def ready(self):
+        """Connect the signal receivers once the models are loaded"""
+        from profiles_api import signals  # noqa: F401
@@ -0,0 +1,176 @@
+# async versions of the busiest feed and profile handlers... the views of the
+# rest framework are synchronous so every slow database call holds a worker
+# thread, these views run on the event loop of the ASGI server (see
+# profiles_project/asgi.py) and only borrow a thread from a small bounded pool
+# for the moment they talk to the database, so one process can keep thousands
+# of idle keep-alive clients around
+import asyncio
+import contextvars
+import json
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import JsonResponse
+from rest_framework import exceptions, status
+from rest_framework.authentication import get_authorization_header
+from rest_framework.request import Request
+from rest_framework.throttling import BaseThrottle
+
+from profiles_api import authentication
+from profiles_api import models
+from profiles_api import pagination
+from profiles_api import serializers
+from profiles_api import throttling
+from profiles_api import tokens
+
+
+_executor = None
+
+
+def db_executor():
+    """Return the bounded thread pool that runs the database calls"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'ASYNC_DB_WORKERS', 8),
+            thread_name_prefix='async-db',
+        )
+    return _executor
+
+
+def _in_db_thread(func, args, kwargs):
+    close_old_connections()                                                     # respect CONN_MAX_AGE like the request cycle does
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_db(func, *args, **kwargs):
+    """Run a function that touches the database in the bounded pool"""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()                                        # so the queries count towards the request's timings
+    return await loop.run_in_executor(db_executor(), context.run, _in_db_thread, func, args, kwargs)
+
+
+def error_response(detail, status_code):
+    response = JsonResponse({'detail': str(detail)}, status=status_code)
+    if status_code == status.HTTP_401_UNAUTHORIZED:
+        response['WWW-Authenticate'] = 'Token'
+    return response
+
+
+async def authenticate(request):
+    """Return the user of the token in the request, or None when there is none"""
+    auth = get_authorization_header(request).split()
+    if not auth or auth[0].lower() not in (b'token', b'bearer'):
+        return None
+    if len(auth) != 2:
+        raise exceptions.AuthenticationFailed('Invalid token header.')
+    try:
+        key = auth[1].decode()
+    except UnicodeError:
+        raise exceptions.AuthenticationFailed('Invalid token header.')
+
+    if auth[0].lower() == b'bearer':                                            # the signature check is cheap but the revocation list and
+        backend = authentication.SignedTokenAuthentication()                    # the user may need a query now and then
+        user, payload = await run_db(backend.authenticate_credentials, key)
+        if tokens.should_refresh(payload):
+            request.refreshed_token = tokens.issue_token(user)
+        return user
+
+    cached = authentication.token_cache.get(key)                                # a cache hit needs no thread at all
+    if cached is not None and cached[0].is_active and not authentication.token_expired(cached[1]):
+        return cached[0]
+    user, _ = await run_db(authentication.CachedTokenAuthentication().authenticate_credentials, key)
+    return user
+
+
+def throttle_response(request, user=None):
+    """Return a 429 response when the client is over its rate, None otherwise"""
+    if user is not None:
+        wait = throttling.check('user', user.pk)
+    else:
+        wait = throttling.check('anon', BaseThrottle().get_ident(request))
+    if wait is None:
+        return None
+    response = error_response('Request was throttled.', status.HTTP_429_TOO_MANY_REQUESTS)
+    response['Retry-After'] = str(math.ceil(wait))
+    return response
+
+
+def mark_csrf_exempt(view):
+    view.csrf_exempt = True                                                     # token authenticated like the rest framework views, csrf_exempt()
+    return view                                                                 # itself would hide the coroutine function from Django
+
+
+def paginate_feed(paginator, request):
+    """Evaluate and serialize one page of the feed (runs in the pool)"""
+    values_serializer = serializers.ValuesSerializer(serializers.ProfileFeedItemSerializer)
+    queryset = models.ProfileFeedItem.objects.values(*values_serializer.columns)
+    page = paginator.paginate_queryset(queryset, request)
+    return values_serializer.serialize(page), paginator.get_next_link(), paginator.get_previous_link()
+
+
+def create_feed_item(user, validated_data):
+    """Save a new feed item (runs in the pool)"""
+    return models.ProfileFeedItem.objects.create_for_user(user, **validated_data)
+
+
+@mark_csrf_exempt
+async def feed(request):
+    """List the feed (GET) or post a new status (POST) for the logged in user"""
+    if request.method not in ('GET', 'POST'):
+        return error_response(f'Method "{request.method}" not allowed.', status.HTTP_405_METHOD_NOT_ALLOWED)
+    try:
+        user = await authenticate(request)
+    except exceptions.AuthenticationFailed as error:
+        return error_response(error.detail, status.HTTP_401_UNAUTHORIZED)
+    if user is None:
+        return error_response('Authentication credentials were not provided.', status.HTTP_401_UNAUTHORIZED)
+    throttled = throttle_response(request, user)
+    if throttled is not None:
+        return throttled
+
+    if request.method == 'GET':
+        paginator = pagination.FeedCursorPagination()
+        try:
+            page, next_link, previous_link = await run_db(paginate_feed, paginator, Request(request))
+        except exceptions.NotFound as error:
+            return error_response(error.detail, status.HTTP_404_NOT_FOUND)
+        return JsonResponse({
+            'next': next_link,
+            'previous': previous_link,
+            'results': page,
+        })
+
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        return error_response('JSON parse error.', status.HTTP_400_BAD_REQUEST)
+    serializer = serializers.ProfileFeedItemSerializer(data=data)
+    if not serializer.is_valid():                                               # validating a feed item doesn't touch the database
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    if getattr(settings, 'FEED_WRITE_QUEUE', False):                            # the write queue already has its own thread, we just await it
+        from profiles_api import writequeue                                     # only imported when it's switched on
+        future = writequeue.get_write_queue().submit(user, **serializer.validated_data)
+        item = await asyncio.wrap_future(future)
+    else:
+        item = await run_db(create_feed_item, user, serializer.validated_data)
+    return JsonResponse(serializers.ProfileFeedItemSerializer(item).data, status=status.HTTP_201_CREATED)
+
+
+async def profile_detail(request, pk):
+    """Return a single user profile"""
+    if request.method != 'GET':
+        return error_response(f'Method "{request.method}" not allowed.', status.HTTP_405_METHOD_NOT_ALLOWED)
+    throttled = throttle_response(request)
+    if throttled is not None:
+        return throttled
+    profile = await run_db(models.UserProfile.objects.filter(pk=pk).first)
+    if profile is None:
+        return error_response('Not found.', status.HTTP_404_NOT_FOUND)
+    return JsonResponse(serializers.UserProfileSerializer(profile).data)
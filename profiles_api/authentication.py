@@ -0,0 +1,240 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.core.cache import caches
+from django.utils import timezone
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication, TokenAuthentication, get_authorization_header
+
+from profiles_api import tokens
+
+
+# every authenticated request used to look up the token and its user with a
+# join on authtoken_token and UserProfile... the lookups below keep the result
+# in a small LRU inside the process (and optionally in a shared cache) so a
+# busy client only costs one query per TTL instead of one query per request
+#
+# the signals (see signals.py) drop a changed or deleted user from the LRU of
+# the process that changed it and from the shared cache, the LRUs of the other
+# processes never hear about it... so with a shared cache (TOKEN_CACHE_ALIAS)
+# the LRU only keeps an entry for TOKEN_CACHE_LOCAL_TTL seconds, which is how
+# long another worker may still accept a deleted token or deactivated user
+
+
+class TokenCache:
+    """Bounded LRU of token key -> (user, token) with a TTL per entry"""
+
+    def __init__(self, max_size=10000, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()                                           # key -> (expires_at, user, token), oldest first
+        self._keys_by_user = {}                                                 # user id -> set of keys so a user can be dropped in one go
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached (user, token) for key or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, user, token = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return user, token
+
+    def set(self, key, user, token, ttl=None):
+        """Store (user, token) for key, evicting the least recently used entry"""
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), user, token)
+            self._keys_by_user.setdefault(user.pk, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def delete(self, key):
+        """Forget a single token"""
+        with self._lock:
+            self._remove(key)
+
+    def delete_user(self, user_id):
+        """Forget every token that belongs to the user"""
+        with self._lock:
+            for key in list(self._keys_by_user.get(user_id, ())):
+                self._remove(key)
+
+    def clear(self):
+        """Forget everything"""
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_user.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        user_id = entry[1].pk
+        keys = self._keys_by_user.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_user[user_id]
+
+
+token_cache = TokenCache(
+    max_size=getattr(settings, 'TOKEN_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'TOKEN_CACHE_TTL', 60),
+)
+
+
+def shared_cache():
+    """Return the shared cache tier or None when it's not configured"""
+    alias = getattr(settings, 'TOKEN_CACHE_ALIAS', None)
+    if not alias:
+        return None
+    return caches[alias]
+
+
+def shared_cache_key(key):
+    digest = hashlib.sha256(str(key).encode()).hexdigest()                      # memcached keys have no spaces and at most 250 characters,
+    return f'profiles_api:token:{digest}'                                       # the signed tokens can be longer
+
+
+def local_ttl():
+    """Return how long a lookup stays in the LRU of this process"""
+    if shared_cache() is None:                                                  # a single process, the signals reach its LRU
+        return token_cache.ttl
+    return getattr(settings, 'TOKEN_CACHE_LOCAL_TTL', 5)
+
+
+def remember(key, user, token):
+    """Keep a lookup in the LRU and in the shared cache"""
+    token_cache.set(key, user, token, local_ttl())
+    cache = shared_cache()
+    if cache is not None:
+        cache.set(shared_cache_key(key), (user, token), token_cache.ttl)
+
+
+def recall(key):
+    """Return the (user, token) remembered for key, from the LRU or the shared cache"""
+    cached = token_cache.get(key)
+    if cached is None:
+        cache = shared_cache()
+        if cache is not None:
+            cached = cache.get(shared_cache_key(key))
+            if cached is not None:
+                token_cache.set(key, *cached, local_ttl())
+    return cached
+
+
+def invalidate_token(key):
+    """Drop a token from every cache tier"""
+    token_cache.delete(key)
+    cache = shared_cache()
+    if cache is not None:
+        cache.delete(shared_cache_key(key))
+
+
+def invalidate_user(user_id, keys=()):
+    """Drop every cached token of a user from every cache tier"""
+    token_cache.delete_user(user_id)
+    cache = shared_cache()
+    if cache is not None:
+        cache.delete_many([shared_cache_key(key) for key in (f'user:{user_id}', *keys)])
+
+
+def token_expired(token):
+    """Whether a rest framework token is older than AUTH_TOKEN_TTL"""
+    ttl = getattr(settings, 'AUTH_TOKEN_TTL', None)
+    return bool(ttl) and token.created < timezone.now() - timedelta(seconds=ttl)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Token authentication that remembers recent token -> user lookups"""
+
+    def authenticate_credentials(self, key):
+        user, token = self.lookup_credentials(key)
+        if token_expired(token):                                                # the age is checked on every request, cached or not
+            raise exceptions.AuthenticationFailed('Token has expired.')
+        return user, token
+
+    def lookup_credentials(self, key):
+        """Check the LRU, then the shared cache and only then the database"""
+        cached = recall(key)
+        if cached is None:
+            user, token = super().authenticate_credentials(key)                 # the normal lookup raises for unknown keys and inactive users
+            remember(key, user, token)
+            return user, token
+
+        user, token = cached
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+        return user, token
+
+
+def cached_user(pk):
+    """Return the user with the ID, from the LRU or the shared cache when it's there"""
+    key = f'user:{pk}'                                                          # the entries are dropped with the user's tokens (see signals.py)
+    cached = recall(key)
+    if cached is not None:
+        return cached[0]
+    user = get_user_model()._default_manager.filter(pk=pk).first()
+    if user is not None:
+        remember(key, user, None)
+    return user
+
+
+class SignedTokenAuthentication(BaseAuthentication):
+    """Authentication with the signed, expiring tokens of profiles_api.tokens
+
+    Clients send "Authorization: Bearer <token>". The token is checked with an
+    HMAC, its user comes from the LRU, so most requests don't touch the
+    database at all. Once a token is past half of its lifetime a fresh one is
+    handed back in the X-Refreshed-Token header (see middleware.py).
+    """
+    keyword = 'Bearer'
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed('Invalid token header.')
+        try:
+            token = auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed('Invalid token header.')
+
+        user, payload = self.authenticate_credentials(token)
+        if tokens.should_refresh(payload):                                      # sliding session: the Django request carries the new token
+            request._request.refreshed_token = tokens.issue_token(user)         # to the middleware that puts it in the response
+        return user, payload
+
+    def authenticate_credentials(self, token):
+        try:
+            payload = tokens.read_token(token)
+        except signing.SignatureExpired:
+            raise exceptions.AuthenticationFailed('Token has expired.')
+        except (signing.BadSignature, KeyError, TypeError):
+            raise exceptions.AuthenticationFailed('Invalid token.')
+
+        user = cached_user(payload['u'])
+        if user is None or not user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+        if not tokens.is_current(payload, user):
+            raise exceptions.AuthenticationFailed('Token has been revoked.')
+        return user, payload
+
+    def authenticate_header(self, request):
+        return self.keyword
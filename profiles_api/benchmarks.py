@@ -0,0 +1,227 @@
+# the benchmark suite of the profiles API ("python manage.py bench_api")...
+# it seeds a scratch database with the factories, times the building blocks
+# (micro benchmarks) and then runs in-process load tests against the API
+# through the whole middleware stack but without a network in between
+#
+# every result has a "value" where lower is better (seconds per operation or
+# per request), compare() checks a run against an earlier one and reports
+# everything that got slower by more than the threshold... a load test that
+# got error responses measured the errors, compare_errors() finds those
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import django
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIRequestFactory
+
+from profiles_api import factories
+from profiles_api import models
+from profiles_api import permissions
+from profiles_api import serializers
+
+
+LOGIN_EMAIL = 'bench-login@example.com'
+LOGIN_PASSWORD = 'bench-password'
+
+
+@contextmanager
+def scratch_database():
+    """Run the block on a fresh, migrated SQLite database in a temporary directory"""
+    directory = tempfile.mkdtemp()
+    connection.settings_dict['TEST']['NAME'] = os.path.join(directory, 'bench.sqlite3')
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connections.close_all()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        connection.settings_dict['TEST']['NAME'] = None
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def time_operation(operation, number, repeat):
+    """Return the best and median seconds per call of operation"""
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            operation()
+        runs.append((time.perf_counter() - started) / number)
+    return {'value': min(runs), 'median': statistics.median(runs), 'unit': 's/op', 'number': number}
+
+
+def percentile(values, fraction):
+    last = len(values) - 1
+    return values[min(last, int(round(fraction * last)))]
+
+
+def load_test(method, path, clients, requests, headers=None, data=None):
+    """Send requests from clients threads through the whole Django stack
+
+    Every thread has its own test client (and database connection), the
+    result holds the throughput and the latency percentiles.
+    """
+    latencies, errors = [], []
+    lock = threading.Lock()
+    per_client = max(1, requests // clients)
+
+    def run_client():
+        client = Client(**(headers or {}))
+        own_latencies, own_errors = [], 0
+        for _ in range(per_client):
+            started = time.perf_counter()
+            response = getattr(client, method)(path, data) if data is not None else getattr(client, method)(path)
+            if response.status_code >= 400:
+                own_errors += 1
+            own_latencies.append(time.perf_counter() - started)
+        connections.close_all()
+        with lock:
+            latencies.extend(own_latencies)
+            errors.append(own_errors)
+
+    threads = [threading.Thread(target=run_client) for _ in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    total = len(latencies)
+    return {
+        'value': elapsed / total,
+        'unit': 's/request',
+        'requests': total,
+        'clients': clients,
+        'errors': sum(errors),
+        'requests_per_second': round(total / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+def micro_benchmarks(repeat):
+    """Time the model, serializer and permission building blocks"""
+    user = models.UserProfile.objects.get(email=LOGIN_EMAIL)
+    items = list(models.ProfileFeedItem.objects.order_by('-id').only(*serializers.ProfileFeedItemSerializer.Meta.fields)[:100])
+    values_serializer = serializers.ValuesSerializer(serializers.ProfileFeedItemSerializer)
+    rows = list(models.ProfileFeedItem.objects.order_by('-id').values(*values_serializer.columns)[:100])
+    profiles = list(models.UserProfile.objects.order_by('id')[:100])
+
+    request = APIRequestFactory().patch('/api/feed/1/')
+    request.user = user
+    permission = permissions.UpdateOwnStatud()
+    created = iter(range(10 ** 9))
+
+    return {
+        'create_user': time_operation(                                          # mostly the password hasher, on purpose: it's what a signup costs
+            lambda: models.UserProfile.objects.create_user(f'bench-new{next(created)}@example.com', 'New', 'password'),
+            number=3, repeat=repeat,
+        ),
+        'feed_serializer_100': time_operation(
+            lambda: serializers.ProfileFeedItemSerializer(items, many=True).data, number=20, repeat=repeat,
+        ),
+        'feed_values_serializer_100': time_operation(
+            lambda: values_serializer.serialize(rows), number=200, repeat=repeat,
+        ),
+        'profile_serializer_100': time_operation(
+            lambda: serializers.UserProfileSerializer(profiles, many=True).data, number=20, repeat=repeat,
+        ),
+        'feed_permission': time_operation(
+            lambda: [permission.has_object_permission(request, None, item) for item in items], number=200, repeat=repeat,
+        ),
+    }
+
+
+def load_benchmarks(clients, requests):
+    """Run the load tests against the feed, the profile search and the login"""
+    user = models.UserProfile.objects.get(email=LOGIN_EMAIL)
+    token = Token.objects.get_or_create(user=user)[0]
+    auth = {'HTTP_AUTHORIZATION': f'Token {token.key}'}
+    search_term = factories.LAST_NAMES[0]
+    connections.close_all()                                                     # every thread opens its own connection
+
+    with override_settings(ALLOWED_HOSTS=['testserver'], THROTTLE_ENABLED=False):  # one client sends everything, the limits would measure themselves
+        with override_settings(RESPONSE_CACHE_ENABLED=False):                   # what the API itself costs, not the cache in front of it
+            results = {
+                'load_feed': load_test('get', '/api/feed/', clients, requests, auth),
+                'load_profile_search': load_test('get', f'/api/profile/?search={search_term}', clients, requests, auth),
+            }
+        results['load_feed_cached'] = load_test('get', '/api/feed/', clients, requests, auth)
+        results['load_login'] = load_test(                                      # every login hashes a password, so far fewer of them
+            'post', '/api/login/', clients, max(clients, requests // 20),
+            data={'username': LOGIN_EMAIL, 'password': LOGIN_PASSWORD},
+        )
+    return results
+
+
+def run_suite(users=1000, items=10000, clients=8, requests=800, repeat=5, micro=True, load=True):
+    """Seed a scratch database, run the benchmarks and return the report"""
+    with scratch_database():
+        started = time.perf_counter()
+        user_ids = factories.seed_users(users)
+        models.UserProfile.objects.create_user(LOGIN_EMAIL, 'Bench Login', LOGIN_PASSWORD)
+        factories.seed_feed(user_ids, items)
+        seed_seconds = time.perf_counter() - started
+
+        results = {}
+        if micro:
+            results.update(micro_benchmarks(repeat))
+        if load:
+            results.update(load_benchmarks(clients, requests))
+
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'cpus': os.cpu_count(),
+        },
+        'dataset': {'users': users, 'items': items, 'seed_seconds': round(seed_seconds, 2)},
+        'results': results,
+    }
+
+
+def compare(baseline, current, threshold):
+    """Return the results that got slower than the baseline by more than threshold
+
+    Each entry is (name, baseline value, current value, change) with change
+    as a fraction, 0.25 means 25% slower.
+    """
+    regressions = []
+    for name, result in current['results'].items():
+        old = baseline.get('results', {}).get(name)
+        if not old or not old.get('value'):
+            continue
+        change = result['value'] / old['value'] - 1
+        if change > threshold:
+            regressions.append((name, old['value'], result['value'], change))
+    return regressions
+
+
+def compare_errors(baseline, current):
+    """Return the load tests that got error responses in either run
+
+    Each entry is (name, baseline errors, current errors), the timings of
+    those tests can't be compared: a 4xx or 5xx is answered much faster (or
+    slower) than the real thing.
+    """
+    failed = []
+    for name, result in current['results'].items():
+        old = baseline.get('results', {}).get(name) or {}
+        old_errors, new_errors = old.get('errors', 0), result.get('errors', 0)
+        if old_errors or new_errors:
+            failed.append((name, old_errors, new_errors))
+    return failed
@@ -0,0 +1,173 @@
+# reads of the feed and the profiles outnumber writes by far, so the rendered
+# responses of list and retrieve are kept in the cache... every cache key has
+# a version in it which is bumped by the save and delete signals of the model
+# (see signals.py), a list page uses the version of the whole model and a
+# single object uses its own version so readers never get a stale page...
+# the versions are the time of the write, so a page read from a replica
+# (see routers.py) in the first REPLICA_STICKY_SECONDS after it isn't cached,
+# the replica may not have the write yet and the stale page would go out
+# under the new version to everyone, the writer pinned to the primary too
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+from rest_framework.response import Response
+
+from profiles_api import performance
+from profiles_api import routers
+
+
+def response_cache():
+    return caches[getattr(settings, 'RESPONSE_CACHE_ALIAS', 'default')]
+
+
+def model_version_key(model):
+    return f'profiles_api:version:{model._meta.label_lower}'
+
+
+def object_version_key(model, pk):
+    return f'profiles_api:version:{model._meta.label_lower}:{pk}'
+
+
+def invalidate(model, pk=None):
+    """Bump the versions so every cached page of the model (or object) is dropped"""
+    version = time.time_ns()
+    keys = {model_version_key(model): version}
+    if pk is not None:
+        keys[object_version_key(model, pk)] = version
+    response_cache().set_many(keys, timeout=None)
+
+
+def current_version(key):
+    """Return the version stored under key, starting a new one if it's missing"""
+    cache = response_cache()
+    version = cache.get(key)
+    if version is None:                                                         # a version that was evicted must never fall back to an old value,
+        cache.add(key, time.time_ns(), timeout=None)                            # otherwise pages cached under that value would come back to life
+        version = cache.get(key)
+    return version
+
+
+def replica_may_lag(version):
+    """Check whether a replica may still miss the write that started version"""
+    if version is None or not routers.reads_from_replica():
+        return False
+    return time.time_ns() - version < getattr(settings, 'REPLICA_STICKY_SECONDS', 5) * 10 ** 9
+
+
+def etag_matches(request, etag):
+    """Check the If-None-Match header of the request against an ETag"""
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    etags = parse_etags(header)
+    return '*' in etags or etag.strip('"') in [tag.strip('"').replace('W/', '') for tag in etags]
+
+
+def modified_since(request, last_modified):
+    """Check the If-Modified-Since header of the request against a modification time"""
+    header = request.META.get('HTTP_IF_MODIFIED_SINCE')
+    since = parse_http_date_safe(header) if header else None
+    if since is None or last_modified is None:
+        return True
+    return int(last_modified.timestamp()) > since
+
+
+def set_last_modified(response, last_modified):
+    """Add the Last-Modified header, unless more changes can still come in the same second"""
+    if last_modified is None:
+        return
+    seconds = int(last_modified.timestamp())
+    if seconds < int(time.time()):                                              # HTTP dates have whole seconds, a client holding the current
+        response['Last-Modified'] = http_date(seconds)                          # second would miss what changes in the rest of it
+
+
+def not_modified(last_modified):
+    response = HttpResponseNotModified()
+    set_last_modified(response, last_modified)
+    return response
+
+
+class CachedResponseMixin:
+    """Cache the rendered list and retrieve responses of a model view set"""
+
+    uncached_formats = ('api',)                                                 # the browsable API renders forms for the current user so it's never shared
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def get_response_cache_key(self, request):
+        """Return the cache key of the response or None if it must not be cached"""
+        renderer = request.accepted_renderer
+        if renderer.format in self.uncached_formats:
+            return None
+
+        model = self.get_queryset().model
+        lookup = self.kwargs.get(self.lookup_url_kwarg or self.lookup_field)
+        if lookup is None:
+            version = current_version(model_version_key(model))
+        else:
+            try:                                                                # the signals bump the version of the pk itself, so "01" and
+                lookup = model._meta.pk.to_python(lookup)                       # " 1" must use the version of 1
+            except ValidationError:
+                return None                                                     # not a pk at all, the handler answers 404
+            version = current_version(object_version_key(model, lookup))
+        if replica_may_lag(version):
+            return None
+
+        url = hashlib.md5(request.build_absolute_uri().encode('utf-8')).hexdigest()
+        return f'profiles_api:response:{model._meta.label_lower}:{version}:{renderer.media_type}:{url}'
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        """Answer from the cache or call the handler and remember its response"""
+        self.response_cache_key = None
+        if not getattr(settings, 'RESPONSE_CACHE_ENABLED', True):
+            return handler(request, *args, **kwargs)
+
+        key = self.get_response_cache_key(request)
+        if key is not None:
+            cached = response_cache().get(key)
+            if cached is not None:
+                content, content_type, etag = cached
+                if etag_matches(request, etag):
+                    response = HttpResponseNotModified()
+                else:
+                    response = HttpResponse(content, content_type=content_type)
+                response['ETag'] = etag
+                patch_vary_headers(response, ('Accept',))
+                return response
+
+        self.response_cache_key = key
+        return handler(request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        """Render successful responses right away so they can be cached"""
+        response = super().finalize_response(request, response, *args, **kwargs)
+        key = getattr(self, 'response_cache_key', None)
+        if key is None or not isinstance(response, Response) or response.status_code != 200:
+            return response
+
+        with performance.timed_render():                                        # rendered here instead of in the handler
+            response.render()
+        etag = quote_etag(hashlib.md5(response.content).hexdigest())
+        response_cache().set(
+            key,
+            (response.content, response['Content-Type'], etag),
+            getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 300),
+        )
+        response['ETag'] = etag
+        patch_vary_headers(response, ('Accept',))
+        if etag_matches(request, etag):
+            not_modified = HttpResponseNotModified()
+            not_modified['ETag'] = etag
+            patch_vary_headers(not_modified, ('Accept',))
+            return not_modified
+        return response
@@ -0,0 +1,51 @@
+# export of the whole feed table... the rows are read from the database in
+# chunks with values_list() (no model instances) and every row is turned into
+# a line of output as soon as it's read, so the memory we use stays the same
+# no matter how many feed items there are
+import csv
+import json
+
+from profiles_api import models
+
+
+FIELDS = ('id', 'user_profile', 'status_text', 'created_on')                    # the names we output, the same as the feed API uses
+COLUMNS = ('id', 'user_profile_id', 'status_text', 'created_on')                # the columns we read them from
+
+
+def feed_rows(chunk_size=2000):
+    """Yield every feed item as a tuple of COLUMNS, oldest first"""
+    queryset = models.ProfileFeedItem.objects.order_by('id').values_list(*COLUMNS)
+    for row in queryset.iterator(chunk_size=chunk_size):
+        yield row[:3] + (row[3].isoformat(),)
+
+
+def ndjson_lines(rows):
+    """Turn rows into lines of newline delimited JSON"""
+    for row in rows:
+        yield json.dumps(dict(zip(FIELDS, row)), ensure_ascii=False) + '\n'
+
+
+class Echo:
+    """File-like object that hands back what's written to it"""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    """Turn rows into CSV lines with a header"""
+    writer = csv.writer(Echo())
+    yield writer.writerow(FIELDS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+WRITERS = {
+    'ndjson': ndjson_lines,
+    'csv': csv_lines,
+}
+
+
+def export_lines(output_format, chunk_size=2000):
+    """Yield the lines of the feed export in the given format"""
+    return WRITERS[output_format](feed_rows(chunk_size))
@@ -0,0 +1,58 @@
+# factories for benchmark (and test) data... everything is generated from a
+# seeded random number generator so the same arguments always give the same
+# users and feed items, which is what makes two benchmark runs comparable
+import random
+
+from profiles_api import models
+
+
+FIRST_NAMES = (
+    'Anna', 'Piotr', 'Maria', 'Jan', 'Ewa', 'Tomasz', 'Olga', 'Marek',
+    'Lena', 'Adam', 'Zofia', 'Pawel', 'Ida', 'Karol', 'Nina', 'Igor',
+)
+LAST_NAMES = (
+    'Nowak', 'Kowalski', 'Wisniewska', 'Lewandowski', 'Zielinska', 'Szymanski',
+    'Wozniak', 'Dabrowska', 'Kaminski', 'Kowalczyk', 'Mazur', 'Krawczyk',
+)
+WORDS = (
+    'coffee', 'morning', 'deploy', 'django', 'weekend', 'running', 'release',
+    'python', 'holiday', 'meeting', 'database', 'music', 'rain', 'lunch',
+)
+
+
+def user_rows(count, password=None, start=0, seed=0):
+    """Yield count rows for UserProfileManager.bulk_create_users"""
+    rng = random.Random(seed)
+    for number in range(start, start + count):
+        yield {
+            'email': f'user{number}@example.com',
+            'name': f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+            'password': password,                                               # None gives an unusable password, which costs no hashing
+        }
+
+
+def status_text(rng):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 12)))
+
+
+def seed_users(count, password=None, start=0, seed=0):
+    """Create count users and return their IDs"""
+    rows = list(user_rows(count, password, start, seed))
+    models.UserProfile.objects.bulk_create_users(rows, workers=1 if password is None else None)
+    return list(
+        models.UserProfile.objects.filter(email__in=[row['email'] for row in rows])
+        .order_by('id').values_list('id', flat=True)
+    )
+
+
+def seed_feed(user_ids, count, seed=0, batch_size=1000):
+    """Create count feed items spread over the users, return how many were made"""
+    rng = random.Random(seed)
+    per_user = {}
+    for _ in range(count):
+        per_user.setdefault(rng.choice(user_ids), []).append({'status_text': status_text(rng)})
+    for user_id, items in per_user.items():
+        models.ProfileFeedItem.objects.bulk_create_for_user(
+            models.UserProfile(pk=user_id), items, batch_size=batch_size
+        )
+    return count
@@ -0,0 +1,70 @@
+# sparse fieldsets... ?fields=id,status_text limits both the columns that are
+# read from the database (only() and values()) and the keys of the response,
+# and the list pages skip the model serializer altogether: their rows are read
+# with values() and turned into dictionaries by serializers.ValuesSerializer
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+from profiles_api import serializers
+
+
+class SparseFieldsetMixin:
+    """Add ?fields= and the values() list to a model view set"""
+
+    fields_query_param = 'fields'
+    sparse_actions = ('list', 'retrieve')
+    always_load = ()                                                            # columns the view needs even when they're not rendered
+
+    def get_sparse_fields(self):
+        """Return the requested field names (in serializer order) or None for all"""
+        if self.action not in self.sparse_actions:
+            return None
+        raw = self.request.query_params.get(self.fields_query_param)
+        if not raw:
+            return None
+
+        readable = [
+            name for name, field in self.get_serializer_class()().fields.items()
+            if not field.write_only
+        ]
+        requested = {name.strip() for name in raw.split(',') if name.strip()}
+        unknown = requested.difference(readable)
+        if unknown:
+            raise ValidationError({self.fields_query_param: f'Unknown fields: {", ".join(sorted(unknown))}'})
+        return tuple(name for name in readable if name in requested)
+
+    def get_values_serializer(self):
+        if getattr(self, '_values_serializer', None) is None:                  # the view set lives for one request, so the fields are worked out once
+            self._values_serializer = serializers.ValuesSerializer(
+                self.get_serializer_class(), self.get_sparse_fields()
+            )
+        return self._values_serializer
+
+    def get_load_columns(self):
+        """The columns to read, the rendered ones and always_load"""
+        columns = self.get_values_serializer().columns
+        return columns + [column for column in self.always_load if column not in columns]
+
+    def get_serializer(self, *args, **kwargs):
+        fields = self.get_sparse_fields()
+        if fields is not None:
+            kwargs.setdefault('fields', fields)
+        return super().get_serializer(*args, **kwargs)
+
+    def get_queryset(self):
+        """Only load the columns the serializer renders"""
+        queryset = super().get_queryset()
+        if self.action in self.sparse_actions:                                  # a foreign key rendered as a primary key is read from its _id column,
+            queryset = queryset.only(*self.get_load_columns())                  # so the related rows are never joined or loaded
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        """List the rows as dictionaries from values() instead of model instances"""
+        values_serializer = self.get_values_serializer()
+        queryset = self.filter_queryset(self.get_queryset())
+        rows = queryset.values(*self.get_load_columns())
+
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(values_serializer.serialize(page))
+        return Response(values_serializer.serialize(rows))
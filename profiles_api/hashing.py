@@ -0,0 +1,111 @@
+# password hashing for the bulk user import and the login... PBKDF2 is meant
+# to be slow, so the import spreads the hashing over a pool of processes (one
+# per core) and the login runs it in a bounded pool of threads, in both cases
+# only the database work happens in the calling thread
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, get_hasher, identify_hasher, make_password
+
+from profiles_api.exceptions import ServiceUnavailable
+
+
+def init_worker():
+    """Set up Django in a worker that was spawned instead of forked"""
+    if not settings.configured:
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'profiles_project.settings')
+        django.setup()
+
+
+def hash_password(password):
+    """Hash one password with the preferred hasher (runs in a worker)"""
+    return make_password(password)
+
+
+def password_pool(workers):
+    """Return a process pool for hashing passwords"""
+    from concurrent.futures import ProcessPoolExecutor                          # pulls in multiprocessing, which only the bulk import needs
+
+    return ProcessPoolExecutor(max_workers=workers, initializer=init_worker)
+
+
+def hash_passwords(pool, workers, passwords):
+    """Hash the passwords in the pool and return the hashes in the same order"""
+    passwords = list(passwords)
+    chunksize = max(1, len(passwords) // (workers * 4))                         # a few chunks per worker keeps all of them busy without much overhead
+    return list(pool.map(hash_password, passwords, chunksize=chunksize))
+
+
+def verify_password(password, encoded):
+    """Check a password against its hash without saving anything
+
+    Returns (correct, new_hash) where new_hash is the password hashed with the
+    preferred hasher when the stored hash uses another hasher or other
+    parameters, or None when the stored hash is up to date.
+    """
+    if encoded is None:                                                         # unknown user: hash once anyway so the answer takes as long
+        make_password(password)
+        return False, None
+
+    correct = check_password(password, encoded)
+    if not correct:
+        return False, None
+    try:
+        hasher = identify_hasher(encoded)
+    except ValueError:
+        return correct, None
+    preferred = get_hasher('default')
+    if hasher.algorithm != preferred.algorithm or preferred.must_update(encoded):
+        return True, make_password(password)
+    return True, None
+
+
+class BoundedHashPool:
+    """Thread pool for password checks that refuses work when it's full
+
+    workers checks run at a time and up to queue_size more wait for a free
+    worker, anything beyond that is turned away with a 503 straight away
+    instead of piling up and making every login slow.
+    """
+
+    def __init__(self, workers, queue_size, timeout):
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='login-hash')
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+
+    def run(self, func, *args):
+        """Run func in the pool and return its result"""
+        if not self._slots.acquire(blocking=False):
+            raise ServiceUnavailable('Too many logins at once, try again shortly.')
+        try:
+            future = self._executor.submit(func, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            raise ServiceUnavailable('Login timed out, try again shortly.')
+
+
+_login_pool = None
+_login_pool_lock = threading.Lock()
+
+
+def login_pool():
+    """Return the process wide pool for login password checks"""
+    global _login_pool
+    if _login_pool is None:
+        with _login_pool_lock:
+            if _login_pool is None:
+                _login_pool = BoundedHashPool(
+                    workers=getattr(settings, 'LOGIN_HASH_WORKERS', None) or os.cpu_count() or 1,
+                    queue_size=getattr(settings, 'LOGIN_HASH_QUEUE', 32),
+                    timeout=getattr(settings, 'LOGIN_HASH_TIMEOUT', 10),
+                )
+    return _login_pool
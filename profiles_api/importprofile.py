@@ -0,0 +1,86 @@
+# import profile of the API... "python manage.py importtime" runs this in a
+# fresh interpreter (python -m profiles_api.importprofile <module>...), it
+# imports the modules the way a new worker does and writes the time and the
+# resident memory every imported module took to stdout as JSON
+#
+# the hook has to be in place before anything else is imported, so this only
+# uses the standard library... built-in and frozen modules are loaded by
+# shared classes instead of one loader per module and are not measured
+import importlib
+import json
+import os
+import sys
+import time
+
+
+def resident_bytes():
+    """Return the resident memory of this process"""
+    try:
+        with open('/proc/self/statm') as statm:                                 # Linux: the current RSS, in pages
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        import resource                                                         # elsewhere only the peak is known, which for a
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss               # process that only imports is nearly the same
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class ImportProfiler:
+    """Meta path finder that times the execution of every module it finds a loader for"""
+
+    def __init__(self):
+        self.modules = {}                                                       # name -> (self s, cumulative s, self bytes, cumulative bytes)
+        self._stack = []                                                        # [time, bytes] of the children of the modules being executed
+
+    def find_spec(self, name, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        loader = spec.loader
+        if loader is not None and not isinstance(loader, type) and hasattr(loader, 'exec_module'):
+            loader.exec_module = self.measured(name, loader.exec_module)       # the loader belongs to this module only
+        return spec
+
+    def measured(self, name, exec_module):
+        def measured_exec_module(module):
+            self._stack.append([0.0, 0])
+            started, rss = time.perf_counter(), resident_bytes()
+            try:
+                exec_module(module)
+            finally:
+                seconds, size = time.perf_counter() - started, resident_bytes() - rss
+                child_seconds, child_size = self._stack.pop()
+                self.modules[name] = (seconds - child_seconds, seconds, size - child_size, size)
+                if self._stack:
+                    self._stack[-1][0] += seconds
+                    self._stack[-1][1] += size
+        return measured_exec_module
+
+
+def main(targets):
+    profiler = ImportProfiler()
+    sys.meta_path.insert(0, profiler)
+    start_rss, started = resident_bytes(), time.perf_counter()
+    for target in targets:
+        importlib.import_module(target)
+    seconds, end_rss = time.perf_counter() - started, resident_bytes()
+    sys.meta_path.remove(profiler)
+
+    json.dump({
+        'targets': targets,
+        'seconds': seconds,
+        'start_rss': start_rss,
+        'end_rss': end_rss,
+        'modules': [
+            {'name': name, 'self_seconds': own, 'seconds': total, 'self_bytes': own_size, 'bytes': size}
+            for name, (own, total, own_size, size) in profiler.modules.items()
+        ],
+    }, sys.stdout)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from profiles_api import retention
+from profiles_api import sync
+
+
+class Command(BaseCommand):
+    help = 'Move feed items older than the retention period into the archive table or NDJSON files and purge old tombstones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help='keep this many days in the live feed (default FEED_RETENTION_DAYS)')
+        parser.add_argument('--to', choices=('table', 'files'), default=None, help='where to move them (default FEED_ARCHIVE_TARGET)')
+        parser.add_argument('--output-dir', default=None, help='directory of the files (default FEED_ARCHIVE_DIR)')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='feed items moved per transaction')
+
+    def handle(self, *args, **options):
+        purged = sync.purge_tombstones()                                        # the tombstones of the delta sync have a retention of their own
+        self.stdout.write(f'Purged {purged} tombstones older than FEED_TOMBSTONE_DAYS')
+
+        cutoff = retention.retention_cutoff(options['days'])
+        if cutoff is None:
+            self.stdout.write('No retention period set, nothing to archive')
+            return
+
+        to = options['to'] or getattr(settings, 'FEED_ARCHIVE_TARGET', 'table')
+        moved = 0
+        for count in retention.archive_feed(cutoff, to, options['output_dir'], options['chunk_size']):
+            moved += count
+            if options['verbosity'] > 1:
+                self.stderr.write(f'{moved} feed items archived')
+        self.stdout.write(f'Archived {moved} feed items created before {cutoff.isoformat()} to {to}')
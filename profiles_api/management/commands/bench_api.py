@@ -0,0 +1,62 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from profiles_api import benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        'Run the benchmark suite (micro benchmarks and in-process load tests) '
+        'on a scratch database and optionally compare it with an earlier run'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='users to seed')
+        parser.add_argument('--items', type=int, default=10000, help='feed items to seed')
+        parser.add_argument('--clients', type=int, default=8, help='concurrent clients of the load tests')
+        parser.add_argument('--requests', type=int, default=800, help='requests per load test')
+        parser.add_argument('--repeat', type=int, default=5, help='runs per micro benchmark, the best one counts')
+        parser.add_argument('--skip-micro', action='store_true', help="don't run the micro benchmarks")
+        parser.add_argument('--skip-load', action='store_true', help="don't run the load tests")
+        parser.add_argument('--output', help='write the JSON report to this file as well')
+        parser.add_argument('--compare', help='JSON report of an earlier run to compare with')
+        parser.add_argument('--threshold', type=float, default=0.2, help='slowdown that counts as a regression (0.2 = 20%%)')
+
+    def handle(self, *args, **options):
+        report = benchmarks.run_suite(
+            users=options['users'],
+            items=options['items'],
+            clients=options['clients'],
+            requests=options['requests'],
+            repeat=options['repeat'],
+            micro=not options['skip_micro'],
+            load=not options['skip_load'],
+        )
+        output = json.dumps(report, indent=2)
+        self.stdout.write(output)
+        if options['output']:
+            with open(options['output'], 'w') as stream:
+                stream.write(output + '\n')
+
+        baseline = {}
+        if options['compare']:
+            with open(options['compare']) as stream:
+                baseline = json.load(stream)
+        failed = benchmarks.compare_errors(baseline, report)
+        for name, old_errors, new_errors in failed:
+            self.stderr.write(f'{name}: {old_errors} errors in the baseline, {new_errors} now')
+        if not options['compare']:
+            if failed:
+                raise CommandError(f'{len(failed)} load tests got error responses')
+            return
+
+        regressions = benchmarks.compare(baseline, report, options['threshold'])
+        for name, old, new, change in regressions:
+            self.stderr.write(f'{name}: {old * 1000:.3f} ms -> {new * 1000:.3f} ms ({change:+.0%})')
+        if failed or regressions:
+            raise CommandError(
+                f'{len(regressions)} benchmarks are slower than the baseline by more than {options["threshold"]:.0%}, '
+                f'{len(failed)} load tests got error responses'
+            )
+        self.stderr.write(f'No regressions over {options["threshold"]:.0%}')
@@ -0,0 +1,88 @@
+import json
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection, connections
+from django.test.utils import override_settings
+
+from profiles_api import benchmarks
+from profiles_api import models
+from profiles_api import writequeue
+
+
+ROLLBACK_PRAGMAS = {'journal_mode': 'DELETE', 'synchronous': 'FULL'}            # the plain SQLite defaults
+
+
+def post_directly(user, text):
+    return models.ProfileFeedItem.objects.create(user_profile=user, status_text=text)
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure concurrent feed post throughput on a scratch SQLite database '
+        'with the default journal, with the SQLITE_PRAGMAS and with the write queue'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16, help='concurrent writers')
+        parser.add_argument('--posts', type=int, default=200, help='feed posts per writer')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            self.stderr.write('This benchmark is for SQLite only')
+            return
+
+        from django.conf import settings
+        tuned = getattr(settings, 'SQLITE_PRAGMAS', None) or {}
+        runs = [
+            ('rollback journal', ROLLBACK_PRAGMAS, False),
+            ('tuned pragmas', tuned, False),
+            ('tuned pragmas + write queue', tuned, True),
+        ]
+        results = []
+        for name, pragmas, use_queue in runs:
+            with override_settings(SQLITE_PRAGMAS=pragmas):
+                result = self.run_once(options['threads'], options['posts'], use_queue)
+            result['name'] = name
+            results.append(result)
+            self.stderr.write(f"{name}: {result['posts_per_second']} posts/s, {result['errors']} errors")
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def run_once(self, thread_count, posts, use_queue):
+        """Post from many threads into a fresh scratch database"""
+        with benchmarks.scratch_database():
+            user = models.UserProfile.objects.create_user('bench@example.com', 'Bench', None)
+            connection.close()                                                  # make every thread open its own tuned connection
+            write_queue = writequeue.FeedWriteQueue() if use_queue else None
+            errors = []
+
+            def writer(number):
+                for post in range(posts):
+                    text = f'writer {number} post {post}'
+                    try:
+                        if write_queue is not None:
+                            write_queue.submit(user, status_text=text).result(timeout=60)
+                        else:
+                            post_directly(user, text)
+                    except OperationalError as error:
+                        errors.append(str(error))
+                connections.close_all()
+
+            threads = [threading.Thread(target=writer, args=(number,)) for number in range(thread_count)]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+
+            saved = models.ProfileFeedItem.objects.count()
+            return {
+                'threads': thread_count,
+                'posts': thread_count * posts,
+                'saved': saved,
+                'errors': len(errors),
+                'seconds': round(elapsed, 3),
+                'posts_per_second': round(saved / elapsed, 1),
+            }
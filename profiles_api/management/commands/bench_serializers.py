@@ -0,0 +1,75 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from profiles_api import benchmarks
+from profiles_api import models
+from profiles_api import serializers
+
+
+SPARSE_FIELDS = ('id', 'status_text')
+
+
+def model_serializer(queryset, fields):
+    columns = fields or serializers.ProfileFeedItemSerializer.Meta.fields
+    rows = list(queryset.only(*columns))
+    started = time.perf_counter()
+    serializers.ProfileFeedItemSerializer(rows, many=True, fields=fields).data
+    return started
+
+
+def values_serializer(queryset, fields):
+    values = serializers.ValuesSerializer(serializers.ProfileFeedItemSerializer, fields)
+    rows = list(queryset.values(*values.columns))
+    started = time.perf_counter()
+    values.serialize(rows)
+    return started
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the time the model serializer and the values() serializer take '
+        'for the feed, with every field and with ?fields=id,status_text'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000, help='feed items to serialize')
+        parser.add_argument('--repeat', type=int, default=5, help='runs per case, the best one counts')
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        runs = [
+            ('model serializer', model_serializer, None),
+            ('model serializer, sparse', model_serializer, SPARSE_FIELDS),
+            ('values serializer', values_serializer, None),
+            ('values serializer, sparse', values_serializer, SPARSE_FIELDS),
+        ]
+        results = []
+        with benchmarks.scratch_database():                                     # the rows only exist for the benchmark, never in the real database
+            user = models.UserProfile.objects.create_user('bench-serializers@example.com', 'Bench', None)
+            models.ProfileFeedItem.objects.bulk_create_for_user(
+                user, [{'status_text': f'status {number}'} for number in range(rows)]
+            )
+            queryset = models.ProfileFeedItem.objects.filter(user_profile=user).order_by('-created_on', '-id')
+
+            for name, run, fields in runs:
+                total, serialize = [], []
+                for _ in range(options['repeat']):
+                    started = time.perf_counter()
+                    serialize_started = run(queryset, fields)
+                    finished = time.perf_counter()
+                    total.append(finished - started)
+                    serialize.append(finished - serialize_started)
+                result = {
+                    'name': name,
+                    'rows': rows,
+                    'serialize_ms_per_10k': round(min(serialize) * 1000 * 10000 / rows, 1),
+                    'total_ms_per_10k': round(min(total) * 1000 * 10000 / rows, 1),   # with the query and building the rows
+                }
+                results.append(result)
+                self.stderr.write(
+                    f"{name}: {result['serialize_ms_per_10k']} ms to serialize, "
+                    f"{result['total_ms_per_10k']} ms with the query (per 10k rows)"
+                )
+        self.stdout.write(json.dumps(results, indent=2))
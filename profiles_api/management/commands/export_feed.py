@@ -0,0 +1,24 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from profiles_api import export
+
+
+class Command(BaseCommand):
+    help = 'Export every profile feed item as NDJSON or CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(export.WRITERS), default='ndjson', help='output format')
+        parser.add_argument('--output', default='-', help='file to write, - for standard output')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='rows fetched from the database at a time')
+
+    def handle(self, *args, **options):
+        path = options['output']
+        stream = sys.stdout if path == '-' else open(path, 'w', newline='', encoding='utf-8')
+        try:
+            for line in export.export_lines(options['format'], options['chunk_size']):
+                stream.write(line)
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
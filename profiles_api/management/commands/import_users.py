@@ -0,0 +1,90 @@
+import csv
+import json
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+
+from profiles_api import models
+
+
+def read_csv(stream):
+    """Yield one dict per CSV row, the header names the fields"""
+    yield from csv.DictReader(stream)
+
+
+def read_jsonl(stream):
+    """Yield one dict per non-empty JSON line"""
+    for number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as error:
+            raise CommandError(f'Line {number} is not valid JSON: {error}')
+
+
+READERS = {
+    'csv': read_csv,
+    'jsonl': read_jsonl,
+}
+
+
+class Command(BaseCommand):
+    help = 'Import user profiles from a CSV or JSONL file with email, name and password'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='file to import, use - to read standard input')
+        parser.add_argument('--format', choices=sorted(READERS), help='input format (guessed from the file name by default)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='users hashed and inserted per batch')
+        parser.add_argument('--workers', type=int, default=None, help='password hashing processes (one per core by default)')
+        parser.add_argument('--ignore-conflicts', action='store_true', help='skip users whose email already exists')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        input_format = options['format']
+        if input_format is None:
+            if path.endswith('.csv'):
+                input_format = 'csv'
+            elif path.endswith(('.jsonl', '.ndjson')):
+                input_format = 'jsonl'
+            else:
+                raise CommandError('Cannot guess the input format, pass --format')
+
+        started = time.monotonic()
+        counts = {'read': 0, 'created': 0}
+
+        def progress(read, created):
+            counts.update(read=read, created=created)
+            elapsed = time.monotonic() - started
+            self.stdout.write(f'{read} rows read, {created} users imported ({created / elapsed:.1f} users/s)')
+
+        stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        try:
+            created = models.UserProfile.objects.bulk_create_users(
+                READERS[input_format](stream),
+                batch_size=options['batch_size'],
+                workers=options['workers'],
+                ignore_conflicts=options['ignore_conflicts'],
+                progress=progress,
+            )
+        except ValueError as error:
+            raise CommandError(f'{error} (after {counts["created"]} users were imported)')
+        except IntegrityError as error:                                         # the batches before it are saved, run it again with
+            raise CommandError(                                                 # --ignore-conflicts to skip the users that exist
+                f'A batch after row {counts["read"]} conflicts with existing users ({error}), '
+                f'{counts["created"]} users were imported before it. '
+                f'Pass --ignore-conflicts to skip the users that already exist.'
+            )
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        elapsed = time.monotonic() - started
+        skipped = counts['read'] - created
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {created} users in {elapsed:.1f}s ({created / max(elapsed, 1e-9):.1f} users/s)'
+            + (f', skipped {skipped} that already exist' if skipped else '')
+        ))
@@ -0,0 +1,84 @@
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+SORT_KEYS = {
+    'cumulative': 'seconds',
+    'self': 'self_seconds',
+    'rss': 'self_bytes',
+}
+
+
+def profile_imports(targets):
+    """Import the targets in a fresh interpreter and return its import profile"""
+    process = subprocess.run(                                                   # a fresh interpreter, here everything is already imported
+        [sys.executable, '-m', 'profiles_api.importprofile', *targets],
+        cwd=settings.BASE_DIR, env=os.environ.copy(), capture_output=True, text=True,
+    )
+    if process.returncode:
+        raise CommandError(f'Importing {", ".join(targets)} failed:\n{process.stderr}')
+    return json.loads(process.stdout)
+
+
+def by_package(modules):
+    """Add up the self time and memory of the modules per top level package"""
+    packages = defaultdict(lambda: {'self_seconds': 0.0, 'self_bytes': 0, 'modules': 0})
+    for module in modules:
+        package = packages[module['name'].split('.')[0]]
+        package['self_seconds'] += module['self_seconds']
+        package['self_bytes'] += module['self_bytes']
+        package['modules'] += 1
+    return [
+        {'name': name, 'seconds': package['self_seconds'], 'bytes': package['self_bytes'], **package}
+        for name, package in packages.items()
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        'Import the WSGI application and the URLconf in a fresh interpreter, like a '
+        'new worker, and report the import time and resident memory per module'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--module', action='append', dest='modules',
+            help='module to import, can be repeated (default the WSGI application and ROOT_URLCONF)',
+        )
+        parser.add_argument('--sort', choices=SORT_KEYS, default='cumulative', help='order of the modules')
+        parser.add_argument('--limit', type=int, default=30, help='how many modules to list')
+        parser.add_argument('--packages', action='store_true', help='add up the modules per top level package')
+        parser.add_argument('--json', action='store_true', help='print the whole profile as JSON')
+
+    def handle(self, *args, **options):
+        targets = options['modules'] or [
+            settings.WSGI_APPLICATION.rsplit('.', 1)[0],                         # what uWSGI imports when it starts
+            settings.ROOT_URLCONF,                                              # and what the first request imports (the views)
+        ]
+        profile = profile_imports(targets)
+        if options['json']:
+            self.stdout.write(json.dumps(profile, indent=2))
+            return
+
+        rows = by_package(profile['modules']) if options['packages'] else profile['modules']
+        key = 'self_bytes' if options['sort'] == 'rss' else SORT_KEYS[options['sort']]
+        rows = sorted(rows, key=lambda row: row[key], reverse=True)[:options['limit']]
+
+        self.stdout.write(f'{"self ms":>9} {"cumul. ms":>9} {"self KiB":>9} {"cumul. KiB":>10}  module')
+        for row in rows:
+            self.stdout.write(
+                f'{row["self_seconds"] * 1000:9.1f} {row["seconds"] * 1000:9.1f} '
+                f'{row["self_bytes"] / 1024:9.0f} {row["bytes"] / 1024:10.0f}  {row["name"]}'
+            )
+        self.stdout.write(
+            f'\nImported {len(profile["modules"])} modules for {", ".join(targets)} in '
+            f'{profile["seconds"] * 1000:.0f} ms, resident memory '
+            f'{profile["start_rss"] / 2 ** 20:.1f} MiB -> {profile["end_rss"] / 2 ** 20:.1f} MiB '
+            f'(settings {os.environ.get("DJANGO_SETTINGS_MODULE")})'
+        )
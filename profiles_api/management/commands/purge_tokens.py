@@ -0,0 +1,39 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from profiles_api import models
+
+
+def purge(queryset, batch_size):
+    """Delete the rows of the queryset a batch of primary keys at a time"""
+    deleted = 0
+    while True:
+        pks = list(queryset.values_list('pk', flat=True)[:batch_size])          # short transactions, so logins and posts aren't
+        if not pks:                                                             # locked out while a big backlog is deleted
+            return deleted
+        deleted += queryset.model.objects.filter(pk__in=pks).delete()[0]
+
+
+class Command(BaseCommand):
+    help = 'Delete expired database tokens and revocations of expired signed tokens'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='rows deleted per query')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        batch_size = options['batch_size']
+
+        revoked = purge(models.RevokedToken.objects.filter(expires_on__lte=now), batch_size)
+        self.stdout.write(f'Deleted {revoked} expired revocations')
+
+        ttl = getattr(settings, 'AUTH_TOKEN_TTL', None)
+        if not ttl:
+            self.stdout.write('AUTH_TOKEN_TTL is 0, database tokens never expire')
+            return
+        expired = purge(Token.objects.filter(created__lt=now - timedelta(seconds=ttl)), batch_size)
+        self.stdout.write(f'Deleted {expired} expired tokens')
@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from profiles_api import models
+
+
+class Command(BaseCommand):
+    help = 'Recompute feed_count, last_status and last_posted_on of every profile from the feed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='profiles recomputed per grouped query')
+
+    def handle(self, *args, **options):
+        if getattr(settings, 'FEED_ARCHIVE_TARGET', 'table') == 'files':
+            self.stderr.write('FEED_ARCHIVE_TARGET is "files": items archived to files are no longer counted')
+        repaired = models.UserProfile.objects.repair_feed_counters(
+            batch_size=options['batch_size'],
+            progress=lambda done: self.stdout.write(f'{done} profiles checked'),
+        )
+        self.stdout.write(f'Repaired {repaired} profiles')
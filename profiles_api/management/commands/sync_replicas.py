@@ -0,0 +1,30 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from profiles_api import routers
+
+
+class Command(BaseCommand):
+    help = 'Copy the primary SQLite database over every read replica (local stand-in for replication)'
+
+    def handle(self, *args, **options):
+        aliases = routers.replicas()
+        if not aliases:
+            raise CommandError('No replicas configured, set DB_REPLICAS to a comma separated list of SQLite files')
+        primary = settings.DATABASES[routers.PRIMARY]
+        if primary['ENGINE'] != 'django.db.backends.sqlite3':
+            raise CommandError('sync_replicas only copies SQLite databases, use the replication of your database')
+
+        source = sqlite3.connect(str(primary['NAME']))
+        try:
+            for alias in aliases:
+                target = sqlite3.connect(str(settings.DATABASES[alias]['NAME']))
+                try:
+                    source.backup(target)                                       # a consistent snapshot, even while the API writes
+                finally:
+                    target.close()
+                self.stdout.write(f'Copied {primary["NAME"]} to {alias} ({settings.DATABASES[alias]["NAME"]})')
+        finally:
+            source.close()
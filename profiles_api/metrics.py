@@ -0,0 +1,281 @@
+# small in-process metrics: counters and latency histograms over a rolling
+# window of the latest samples, so percentiles always describe recent traffic
+#
+# every process has its own metrics, render_prometheus() turns them into the
+# Prometheus text format that /metrics serves (see views.py)... a scrape only
+# reaches one of the workers though, so with METRICS_DIR set every process
+# writes a snapshot of its metrics to a file of its own there every
+# METRICS_SNAPSHOT_INTERVAL seconds and /metrics adds up the files of all of them
+import atexit
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+
+class Counter:
+    """A number that only goes up"""
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Histogram:
+    """Rolling window of the latest samples with running totals"""
+
+    def __init__(self, window=10000):                                           # None keeps every sample
+        self._samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self._samples.append(value)
+            self.count += 1
+            self.total += value
+
+    def percentiles(self, *fractions):
+        """Return {fraction: value} for the samples in the window"""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return {fraction: None for fraction in fractions}
+        last = len(samples) - 1
+        return {fraction: samples[min(last, int(round(fraction * last)))] for fraction in fractions}
+
+
+_registry = {}
+_registry_lock = threading.Lock()
+_snapshot_pid = None
+_snapshot_path = None
+_retired = {}                                                                   # (kind, name, labels) -> totals of the workers that are gone
+
+
+def _get(kind, name, labels):
+    if _snapshot_pid != os.getpid():
+        _start_snapshots()
+    key = (name, tuple(sorted(labels.items())))
+    metric = _registry.get(key)
+    if metric is None:
+        with _registry_lock:
+            metric = _registry.setdefault(key, kind())
+    return metric
+
+
+def counter(name, **labels):
+    """Return the counter called name (with the labels), creating it on first use"""
+    return _get(Counter, name, labels)
+
+
+def histogram(name, **labels):
+    """Return the histogram called name (with the labels), creating it on first use"""
+    return _get(Histogram, name, labels)
+
+
+def metrics_dir():
+    return getattr(settings, 'METRICS_DIR', None)
+
+
+def _start_snapshots():
+    """Start writing the snapshots of this process, once per process"""
+    global _snapshot_pid, _snapshot_path
+    with _registry_lock:
+        if _snapshot_pid == os.getpid():
+            return
+        if _snapshot_pid is not None:                                           # a forked worker starts from nothing, the parent reports its
+            _registry.clear()                                                   # own metrics
+            _retired.clear()
+        _snapshot_pid = os.getpid()
+        directory = metrics_dir()
+        if directory is None:
+            return
+        os.makedirs(directory, exist_ok=True)
+        _snapshot_path = os.path.join(directory, f'{_snapshot_pid}-{time.time_ns()}.json')   # pids come back, the time makes it unique
+    interval = getattr(settings, 'METRICS_SNAPSHOT_INTERVAL', 5)
+    threading.Thread(target=_write_snapshots, args=(interval,), name='metrics-snapshots', daemon=True).start()
+    atexit.register(write_snapshot)
+
+
+def _write_snapshots(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            write_snapshot()
+        except OSError:
+            pass
+
+
+def snapshot(samples=1000):
+    """Return the metrics of this process as plain data, with the latest samples of every histogram"""
+    with _registry_lock:
+        items = list(_registry.items())
+    counters = []
+    histograms = []
+    for (name, labels), metric in items:
+        if isinstance(metric, Counter):
+            counters.append([name, labels, metric.value])
+            continue
+        with metric._lock:
+            window = list(metric._samples)[-samples:]
+            histograms.append([name, labels, metric.count, metric.total, window])
+    with _registry_lock:
+        retired = list(_retired.items())
+    for (kind, name, labels), totals in retired:
+        if kind == 'counter':
+            counters.append([name, labels, totals])
+        else:
+            histograms.append([name, labels, *totals, []])
+    return {'counters': counters, 'histograms': histograms}
+
+
+def write_snapshot():
+    """Write the snapshot of this process to its file in METRICS_DIR"""
+    if _snapshot_path is None:
+        return
+    directory = os.path.dirname(_snapshot_path)
+    fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as stream:
+            json.dump(snapshot(), stream)
+        os.replace(temp_path, _snapshot_path)                                   # a scrape never reads a half written file
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def clear_snapshots():
+    """Remove the snapshots of earlier runs, call it before the workers start"""
+    directory = metrics_dir()
+    if directory is not None:
+        for path in glob.glob(os.path.join(directory, '*.json*')):              # with the ones left half retired
+            os.remove(path)
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)                                                         # signal 0 only checks that the process is there
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _retire_snapshots(directory):
+    """Take over the totals of the snapshots whose process is gone
+
+    Every restarted worker leaves its file behind, so without this the
+    directory would grow until the next deploy. The totals move into the
+    snapshot of this process, the caller removes the returned files once
+    that's written.
+    """
+    claimed = []
+    for path in glob.glob(os.path.join(directory, '*.json')):
+        try:
+            pid = int(os.path.basename(path).split('-', 1)[0])
+        except ValueError:
+            continue
+        if path == _snapshot_path or (pid != os.getpid() and _is_running(pid)):
+            continue
+        retiring = f'{path}.{os.getpid()}.retiring'
+        try:
+            os.rename(path, retiring)                                           # when two workers scrape at once only one of them
+        except OSError:                                                         # gets the file
+            continue
+        claimed.append(retiring)
+        try:
+            with open(retiring) as stream:
+                data = json.load(stream)
+        except (OSError, ValueError):
+            continue
+        with _registry_lock:
+            for name, labels, value in data['counters']:
+                key = ('counter', name, tuple(map(tuple, labels)))
+                _retired[key] = _retired.get(key, 0) + value
+            for name, labels, count, total, samples in data['histograms']:     # the samples are old news, only the totals stay
+                key = ('histogram', name, tuple(map(tuple, labels)))
+                old_count, old_total = _retired.get(key, (0, 0))
+                _retired[key] = (old_count + count, old_total + total)
+    return claimed
+
+
+def collect():
+    """Return the metrics of this process, or of every process with METRICS_DIR"""
+    if _snapshot_path is None:
+        with _registry_lock:
+            return sorted(_registry.items(), key=lambda item: item[0])
+
+    claimed = _retire_snapshots(os.path.dirname(_snapshot_path))
+    write_snapshot()                                                            # our own file is up to date
+    for path in claimed:
+        os.remove(path)
+    merged = {}
+    recent = time.time() - getattr(settings, 'METRICS_SAMPLE_MAX_AGE', 300)
+    for path in glob.glob(os.path.join(os.path.dirname(_snapshot_path), '*.json')):
+        try:
+            with open(path) as stream:
+                data = json.load(stream)
+            written_at = os.path.getmtime(path)
+        except (OSError, ValueError):
+            continue
+        for name, labels, value in data['counters']:                           # the counters of the workers that are gone still count
+            merged.setdefault((name, tuple(map(tuple, labels))), Counter()).inc(value)
+        for name, labels, count, total, samples in data['histograms']:
+            histogram = merged.setdefault((name, tuple(map(tuple, labels))), Histogram(window=None))
+            histogram.count += count
+            histogram.total += total
+            if written_at > recent:                                             # but only recent samples go into the percentiles
+                histogram._samples.extend(samples)
+    return sorted(merged.items(), key=lambda item: item[0])
+
+
+def _label_text(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ''
+    escaped = (
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in pairs
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+def render_prometheus(prefix='profiles_api_', quantiles=(0.5, 0.95, 0.99)):
+    """Return every metric in the Prometheus text exposition format
+
+    Counters become "<name>_total" and histograms become summaries with the
+    quantiles of their rolling window.
+    """
+    metrics = collect()
+    lines = []
+    typed = set()
+    for (name, labels), metric in metrics:
+        if isinstance(metric, Counter):
+            full_name = f'{prefix}{name}_total'
+            if full_name not in typed:
+                lines.append(f'# TYPE {full_name} counter')
+                typed.add(full_name)
+            lines.append(f'{full_name}{_label_text(labels)} {metric.value}')
+            continue
+
+        full_name = f'{prefix}{name}'
+        if full_name not in typed:
+            lines.append(f'# TYPE {full_name} summary')
+            typed.add(full_name)
+        for quantile, value in metric.percentiles(*quantiles).items():
+            value = 'NaN' if value is None else repr(float(value))
+            lines.append(f'{full_name}{_label_text(labels, quantile=quantile)} {value}')
+        lines.append(f'{full_name}_sum{_label_text(labels)} {float(metric.total)!r}')
+        lines.append(f'{full_name}_count{_label_text(labels)} {metric.count}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,234 @@
+# middleware of the profiles API, it's added to MIDDLEWARE in settings.py
+#
+# all of it works in both the WSGI and the ASGI stack, a middleware that is
+# only synchronous would make Django run the async views (see async_views.py)
+# in a thread and they'd lose what they're there for
+import asyncio
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import JsonResponse
+from rest_framework.permissions import SAFE_METHODS
+
+from profiles_api import metrics
+from profiles_api import performance
+from profiles_api import routers
+
+
+class BaseMiddleware:
+    """Middleware that calls process(request, response) in either mode"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            self._is_coroutine = asyncio.coroutines._is_coroutine               # how Django's own MiddlewareMixin tells the handler to await us
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        return self.process(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.process(request, await self.get_response(request))
+
+    def process(self, request, response):
+        return response
+
+
+class RefreshedTokenMiddleware(BaseMiddleware):
+    """Hand the sliding session token to the client in X-Refreshed-Token
+
+    SignedTokenAuthentication leaves a new token on the request when the one
+    it checked is getting old, the client swaps it in for the next requests.
+    """
+
+    def process(self, request, response):
+        token = getattr(request, 'refreshed_token', None)
+        if token is not None and response.status_code < 400:
+            response['X-Refreshed-Token'] = token
+        return response
+
+
+class PerformanceMiddleware(BaseMiddleware):
+    """Time every request, add a Server-Timing header and record the metrics
+
+    It should be the first MIDDLEWARE so the time of all the others counts.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PERFORMANCE_METRICS', True):
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        timings = performance.RequestTimings()
+        reset = performance.current_timings.set(timings)
+        try:
+            response = self.get_response(request)
+        finally:
+            performance.current_timings.reset(reset)
+        return self.finish(request, response, timings)
+
+    async def __acall__(self, request):
+        timings = performance.RequestTimings()
+        reset = performance.current_timings.set(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            performance.current_timings.reset(reset)
+        return self.finish(request, response, timings)
+
+    def process_template_response(self, request, response):
+        """Time the rendering of rest framework responses"""
+        timings = performance.current_timings.get()
+        if timings is not None and not response.is_rendered:
+            started = time.perf_counter()
+
+            def rendered(response):
+                timings.render_seconds += time.perf_counter() - started
+            response.add_post_render_callback(rendered)
+        return response
+
+    def finish(self, request, response, timings):
+        total = timings.elapsed()                                               # for a streaming response this is the time to the first byte
+        size = None if response.streaming else len(response.content)
+        performance.observe(performance.view_name(request), response.status_code, timings, total, size)
+        if getattr(settings, 'SERVER_TIMING', True):
+            response['Server-Timing'] = performance.server_timing(timings, total)
+        return response
+
+
+class AdmissionControlMiddleware(BaseMiddleware):
+    """Turn requests away early once the process is saturated
+
+    At most ADMISSION_MAX_CONCURRENCY requests are worked on at a time and at
+    most ADMISSION_MAX_QUEUE more wait (up to ADMISSION_QUEUE_TIMEOUT seconds)
+    for their turn, anything beyond that gets a 503 with Retry-After before
+    any session, authentication or database work was done for it.
+    """
+
+    def __init__(self, get_response):
+        self.max_concurrency = getattr(settings, 'ADMISSION_MAX_CONCURRENCY', 0)
+        if not self.max_concurrency:
+            raise MiddlewareNotUsed
+        self.max_queue = getattr(settings, 'ADMISSION_MAX_QUEUE', 0)
+        self.timeout = getattr(settings, 'ADMISSION_QUEUE_TIMEOUT', 1)
+        self.exempt_paths = tuple(getattr(settings, 'ADMISSION_EXEMPT_PATHS', ()))
+        self.running = 0
+        self.waiting = 0
+        self._condition = threading.Condition()                                 # WSGI: the requests run in threads
+        self._async_condition = None                                            # ASGI: the middleware runs on the event loop
+        super().__init__(get_response)
+
+    def has_room(self):
+        return self.running < self.max_concurrency
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if request.path.startswith(self.exempt_paths):
+            return self.get_response(request)
+
+        with self._condition:
+            admitted = self.has_room()
+            if not admitted and self.waiting < self.max_queue:
+                self.waiting += 1
+                try:
+                    admitted = self._condition.wait_for(self.has_room, self.timeout)
+                finally:
+                    self.waiting -= 1
+            if not admitted:
+                return self.reject()
+            self.running += 1
+        try:
+            return self.get_response(request)
+        finally:
+            with self._condition:
+                self.running -= 1
+                self._condition.notify()
+
+    async def __acall__(self, request):
+        if request.path.startswith(self.exempt_paths):
+            return await self.get_response(request)
+        if self._async_condition is None:
+            self._async_condition = asyncio.Condition()
+
+        condition = self._async_condition
+        async with condition:
+            admitted = self.has_room()
+            if not admitted and self.waiting < self.max_queue:
+                self.waiting += 1
+                try:
+                    admitted = await asyncio.wait_for(condition.wait_for(self.has_room), self.timeout)
+                except asyncio.TimeoutError:
+                    admitted = False
+                finally:
+                    self.waiting -= 1
+            if not admitted:
+                return self.reject()
+            self.running += 1
+        try:
+            return await self.get_response(request)
+        finally:
+            async with condition:
+                self.running -= 1
+                condition.notify()
+
+    def reject(self):
+        metrics.counter('admission_rejected').inc()
+        response = JsonResponse({'detail': 'Server is busy, try again later.'}, status=503)
+        response['Retry-After'] = str(max(1, math.ceil(self.timeout)))
+        return response
+
+
+class ReplicaRoutingMiddleware(BaseMiddleware):
+    """Route the reads of safe requests to a read replica (see routers.py)
+
+    A request that writes (or any POST, PUT, PATCH or DELETE) pins its client
+    to the primary for REPLICA_STICKY_SECONDS, so the client reads its own
+    writes while the replicas catch up.
+    """
+
+    def __init__(self, get_response):
+        if not routers.replicas():
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    def route(self, request):
+        if request.method in SAFE_METHODS and not routers.is_pinned(request):
+            return routers.Route(routers.pick_replica())
+        return routers.Route()
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        route = self.route(request)
+        reset = routers.current_route.set(route)
+        try:
+            response = self.get_response(request)
+        finally:
+            routers.current_route.reset(reset)
+        return self.finish(request, response, route)
+
+    async def __acall__(self, request):
+        route = self.route(request)
+        reset = routers.current_route.set(route)
+        try:
+            response = await self.get_response(request)
+        finally:
+            routers.current_route.reset(reset)
+        return self.finish(request, response, route)
+
+    def finish(self, request, response, route):
+        if route.wrote or request.method not in SAFE_METHODS:                  # the write queue saves in its own thread, so the method counts too
+            routers.pin(request)
+        return response
@@ -0,0 +1,17 @@
+# Generated by Django 3.1.5 on 2026-10-18 07:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles_api', '0003_auto_20210311_0900'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='profilefeeditem',
+            index=models.Index(fields=['-created_on', '-id'], name='feed_created_on_id_idx'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Search index for the profile search, see profiles_api/search.py
+
+from django.db import migrations
+
+
+FTS_TABLE = 'profiles_api_userprofile_fts'
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(name, email)'
+        )
+        schema_editor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, email) '
+            f'SELECT id, name, email FROM profiles_api_userprofile'
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS profile_name_trgm_idx '
+            'ON profiles_api_userprofile USING gin (name gin_trgm_ops)'
+        )
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS profile_email_trgm_idx '
+            'ON profiles_api_userprofile USING gin (email gin_trgm_ops)'
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+    elif vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS profile_name_trgm_idx')
+        schema_editor.execute('DROP INDEX IF EXISTS profile_email_trgm_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles_api', '0004_profilefeeditem_created_on_id_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.1.5 on 2026-10-18 07:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles_api', '0005_userprofile_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='profilefeeditem',
+            index=models.Index(fields=['user_profile', '-created_on', '-id'], name='feed_user_created_on_id_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.1.5 on 2026-10-18 07:25
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles_api', '0007_revokedtoken'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedFeedItem',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('status_text', models.CharField(max_length=255)),
+                ('created_on', models.DateTimeField()),
+                ('bucket', models.CharField(db_index=True, max_length=7)),
+                ('user_profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_feed_items', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='archivedfeeditem',
+            index=models.Index(fields=['-created_on', '-id'], name='archive_created_on_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedfeeditem',
+            index=models.Index(fields=['user_profile', '-created_on', '-id'], name='archive_user_created_on_id_idx'),
+        ),
+    ]
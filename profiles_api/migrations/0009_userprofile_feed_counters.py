@@ -0,0 +1,52 @@
+# Generated by Django 3.1.5 on 2026-10-18 07:33
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_feed_counters(apps, schema_editor):
+    """Count the existing feed of every profile with one UPDATE"""
+    UserProfile = apps.get_model('profiles_api', 'UserProfile')
+    feed_models = (apps.get_model('profiles_api', 'ProfileFeedItem'), apps.get_model('profiles_api', 'ArchivedFeedItem'))
+
+    def count(model):
+        rows = model.objects.filter(user_profile=OuterRef('pk')).order_by().values('user_profile')
+        return Coalesce(Subquery(rows.annotate(count=Count('id')).values('count')), Value(0))
+
+    def latest(model, column):                                                  # the live feed always holds the newer items, so it's asked first
+        rows = model.objects.filter(user_profile=OuterRef('pk')).order_by('-created_on', '-id')
+        return Subquery(rows.values(column)[:1])
+
+    live, archived = feed_models
+    UserProfile.objects.update(
+        feed_count=count(live) + count(archived),
+        last_status=Coalesce(latest(live, 'status_text'), latest(archived, 'status_text'), Value('')),
+        last_posted_on=Coalesce(latest(live, 'created_on'), latest(archived, 'created_on')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles_api', '0008_archivedfeeditem'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='feed_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='last_posted_on',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='last_status',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.RunPython(fill_feed_counters, migrations.RunPython.noop),
+    ]
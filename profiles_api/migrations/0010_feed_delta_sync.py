@@ -0,0 +1,41 @@
+# Generated by Django 3.1.5 on 2026-10-18 07:40
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def copy_created_on(apps, schema_editor):
+    """The existing items were last changed when they were created, as far as we know"""
+    ProfileFeedItem = apps.get_model('profiles_api', 'ProfileFeedItem')
+    ProfileFeedItem.objects.update(updated_on=F('created_on'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles_api', '0009_userprofile_feed_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeletedFeedItem',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('deleted_on', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='profilefeeditem',
+            name='updated_on',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(copy_created_on, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='profilefeeditem',
+            index=models.Index(fields=['updated_on', 'id'], name='feed_updated_on_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='deletedfeeditem',
+            index=models.Index(fields=['deleted_on', 'id'], name='tombstone_deleted_on_id_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.5 on 2026-10-18 09:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles_api', '0010_feed_delta_sync'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='token_generation',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
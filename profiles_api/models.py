@@ -1,10 +1,32 @@
 from django.db import models                                                    # created by default, modify to add user model profile
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, Max, Q, Value, When
 from django.contrib.auth.models import AbstractBaseUser                         # adding abstract made user
 from django.contrib.auth.models import PermissionsMixin                         # adding permissions mixin
 from django.contrib.auth.models import BaseUserManager                          # default manager module that comes with django
 # these are standard base classes that we neet to use when overwriting or
 # costumizing the default django module
+import os
+from itertools import islice
 from django.conf import settings                                                # this is used to retrieve settings from our settings.py
+from django.utils import timezone
+from django.dispatch import Signal
+
+bulk_created = Signal()                                                         # bulk_create doesn't send post_save, so our bulk methods send this signal
+                                                                                # with sender=<model> and objs=<the created objects> instead
+feed_counters_changed = Signal()                                                # the feed counters of profiles are changed with update() which doesn't
+                                                                                # send post_save either, this is sent with sender=UserProfile and pks=<IDs>
+
+
+def chunked(iterable, size):
+    """Yield lists of up to size items from any iterable without loading all of it"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
 
 class UserProfileManager(BaseUserManager):                                      # we create manager to let the django know how to work with custom made user model in django commandline tools (such as superuser command)
     """Manager for user profiles"""                                             # because we customized our user model we need to tell django how to interact with this user model in order to create users
@@ -22,6 +44,152 @@ class UserProfileManager(BaseUserManager):
         return user
 
 
+    def bulk_create_users(self, rows, batch_size=1000, workers=None,
+                          ignore_conflicts=False, progress=None):
+        """Create users from an iterable of dicts with email, name and password
+
+        The rows are consumed in batches, the passwords of a batch are hashed
+        in a pool of processes and the batch is saved with one bulk insert.
+        A batch with an email that is already taken raises IntegrityError
+        (the batches before it stay saved), with ignore_conflicts it's saved
+        row by row instead and the rows that are taken are skipped.
+        progress (if given) is called with the number of rows read and the
+        number of users created so far. Returns the number of users created.
+        """
+        from profiles_api import hashing                                        # imported here so the pool isn't pulled in for the normal create_user
+
+        workers = workers or os.cpu_count() or 1
+        read = created = 0
+        with hashing.password_pool(workers) as pool:
+            for batch in chunked(rows, batch_size):
+                for row in batch:
+                    if not row.get('email'):
+                        raise ValueError('Users must have a email address')
+                hashes = hashing.hash_passwords(pool, workers, [row.get('password') for row in batch])
+                users = [
+                    self.model(
+                        email=self.normalize_email(row['email']),
+                        name=row.get('name', ''),
+                        password=password_hash,                                 # the hash goes straight in, set_password would hash it again
+                    )
+                    for row, password_hash in zip(batch, hashes)
+                ]
+                users = self.save_batch(users, ignore_conflicts)
+                if users:
+                    bulk_created.send(sender=self.model, objs=users)
+                read += len(batch)
+                created += len(users)
+                if progress is not None:
+                    progress(read, created)
+        return created
+
+    def save_batch(self, users, ignore_conflicts=False):
+        """Insert a batch of users at once, or row by row when one of them conflicts
+
+        Returns the users that were saved.
+        """
+        try:
+            with transaction.atomic(using=self.db):
+                self.bulk_create(users)
+            return users
+        except IntegrityError:
+            if not ignore_conflicts:
+                raise
+        saved = []
+        for user in users:                                                      # bulk_create of one row, save() would send post_save as well
+            try:                                                                # as the bulk_created sent for the batch
+                with transaction.atomic(using=self.db):
+                    self.bulk_create([user])
+            except IntegrityError:
+                continue
+            saved.append(user)
+        return saved
+
+    def add_posts(self, user_profile_id, items):
+        """Count new feed items of a user and remember the newest as the last status
+
+        Call it in the transaction that saved the items: the counter is added
+        to in the database (F expression) so two posts at once can't lose one.
+        """
+        if not items:
+            return
+        newest = max(items, key=lambda item: (item.created_on, item.pk or 0))
+        is_newer = Q(last_posted_on__isnull=True) | Q(last_posted_on__lte=newest.created_on)
+        self.filter(pk=user_profile_id).update(
+            feed_count=F('feed_count') + len(items),
+            last_status=Case(
+                When(is_newer, then=Value(newest.status_text, output_field=models.CharField())),
+                default=F('last_status'),
+            ),
+            last_posted_on=Case(                                                # with the output field the backend stores it exactly like
+                When(is_newer, then=Value(newest.created_on, output_field=models.DateTimeField())),
+                default=F('last_posted_on'),                                    # created_on, so remove_post() can compare the two
+            ),
+        )
+        feed_counters_changed.send(sender=self.model, pks=[user_profile_id])
+
+    def remove_post(self, item):
+        """Uncount a deleted feed item, call it in the transaction that deleted it"""
+        profiles = self.filter(pk=item.user_profile_id)
+        profiles.update(feed_count=Case(                                        # never below zero, even if the counter was already off
+            When(feed_count__gt=0, then=F('feed_count') - 1), default=Value(0),
+        ))
+        if profiles.filter(last_posted_on=item.created_on).exists():            # it was the last status, the one before it takes its place
+            profiles.update(**self.latest_status(item.user_profile_id))
+        feed_counters_changed.send(sender=self.model, pks=[item.user_profile_id])
+
+    def latest_status(self, user_profile_id):
+        """Return last_status and last_posted_on of the newest live or archived feed item"""
+        for model in (ProfileFeedItem, ArchivedFeedItem):
+            latest = (
+                model.objects.filter(user_profile_id=user_profile_id)           # one read of the (user_profile, created_on, id) index
+                .order_by('-created_on', '-id').values('status_text', 'created_on').first()
+            )
+            if latest is not None:
+                return {'last_status': latest['status_text'], 'last_posted_on': latest['created_on']}
+        return {'last_status': '', 'last_posted_on': None}
+
+    def repair_feed_counters(self, batch_size=1000, progress=None):
+        """Recompute feed_count, last_status and last_posted_on of every profile
+
+        The live feed and the archive table are counted with one grouped
+        query per batch of profiles, only the profiles that were off are
+        written. Returns the number of profiles that were repaired.
+        """
+        repaired = done = 0
+        last_pk = 0
+        while True:
+            batch = list(                                                       # batches by primary key, so no cursor stays open while we write
+                self.filter(pk__gt=last_pk).order_by('pk')
+                .values_list('pk', 'feed_count', 'last_posted_on')[:batch_size]
+            )
+            if not batch:
+                return repaired
+            last_pk = batch[-1][0]
+            pks = [pk for pk, _, _ in batch]
+            counted = {pk: [0, None] for pk in pks}
+            for model in (ProfileFeedItem, ArchivedFeedItem):
+                rows = (
+                    model.objects.filter(user_profile_id__in=pks).values('user_profile_id')
+                    .annotate(count=Count('id'), latest=Max('created_on')).order_by()
+                )
+                for row in rows:
+                    entry = counted[row['user_profile_id']]
+                    entry[0] += row['count']
+                    if entry[1] is None or row['latest'] > entry[1]:
+                        entry[1] = row['latest']
+
+            stale = [pk for pk, feed_count, last_posted_on in batch if counted[pk] != [feed_count, last_posted_on]]
+            with transaction.atomic(using=self.db):
+                for pk in stale:
+                    self.filter(pk=pk).update(feed_count=counted[pk][0], **self.latest_status(pk))
+            if stale:
+                feed_counters_changed.send(sender=self.model, pks=stale)
+            repaired += len(stale)
+            done += len(batch)
+            if progress is not None:
+                progress(done)
+
     def create_superuser(self,email,name,password):                             # function that allows django to create superuser account
         """Create and save a new super user with given details"""
         user = self.create_user(email,name,password)
@@ -40,6 +208,12 @@ class UserProfile(AbstractBaseUser,PermissionsMixin):
     name = models.CharField(max_length=255)                                     # to store a name
     is_active = models.BooleanField(default=True)                               # to determine if a user's profile is activated or not (we set them activated by default) BooleanField is used to hold True or False value
     is_staff = models.BooleanField(default=False)                               # it determines if the user is a staff user (if user is permitted to acces django admin etc.)
+    feed_count = models.PositiveIntegerField(default=0)                         # the feed items of the user (live and archived) and the newest of
+    last_status = models.CharField(max_length=255, blank=True, default='')      # them, kept up to date by every write of the feed so showing a
+    last_posted_on = models.DateTimeField(null=True, blank=True)                # profile never counts the feed... "manage.py repair_feed_counters"
+                                                                                # recomputes them if they ever drift
+    token_generation = models.PositiveIntegerField(default=0)                   # every signed token carries it, bumping it logs the user out of
+                                                                                # every device at once (see profiles_api/tokens.py)
 
 
 # now we have to specify model manager that we're gonna use for the objects and
@@ -75,6 +249,42 @@ class UserProfile(AbstractBaseUser,PermissionsMixin):
         return self.email                                                       # it is recommended for all django models
 
 
+class ProfileFeedItemManager(models.Manager):                                   # manager for the feed items so we can create many of them at once
+    """Manager for profile feed items"""
+
+    def bulk_create_for_user(self, user_profile, items, batch_size=None):
+        """Create many feed items for one user in a single transaction"""
+        objs = [self.model(user_profile=user_profile, **item) for item in items]
+        with transaction.atomic(using=self.db):                                 # one transaction means one commit (and one fsync) for the whole batch
+            self.bulk_create(objs, batch_size=batch_size)
+            if objs and objs[0].pk is None:                                     # some backends (SQLite) can't return the IDs of bulk inserted rows
+                ids = list(                                                     # but we still hold the write lock of the transaction so the newest
+                    self.filter(user_profile=user_profile)                      # rows of this user are exactly the ones we've just inserted
+                    .order_by('-id')
+                    .values_list('id', flat=True)[:len(objs)]
+                )
+                for obj, pk in zip(objs, reversed(ids)):
+                    obj.pk = pk
+            UserProfile.objects.add_posts(user_profile.pk, objs)
+        bulk_created.send(sender=self.model, objs=objs)
+        return objs
+
+    def create_for_user(self, user_profile, **fields):
+        """Create one feed item and count it on the profile in one transaction"""
+        with transaction.atomic(using=self.db):
+            item = self.create(user_profile=user_profile, **fields)
+            UserProfile.objects.add_posts(user_profile.pk, [item])
+        return item
+
+    def delete_item(self, item):
+        """Delete a feed item and uncount it on the profile in one transaction"""
+        with transaction.atomic(using=self.db):
+            pk = item.pk
+            item.delete()
+            UserProfile.objects.remove_post(item)
+            DeletedFeedItem.objects.record([pk])
+
+
 class ProfileFeedItem(models.Model):                                            # this is going to be the model we use to allow users to
     """Profiles status update"""                                                # store status updates in the system so every time they create a new update it's
                                                                                 # going to create a new profile feed item object and associate that object with
@@ -104,7 +314,92 @@ class ProfileFeedItem(models.Model):
     created_on = models.DateTimeField(auto_now_add=True)                        # every time we create a new feed item automatically add the date time stamp that the item was
                                                                                 # created so we don't need to manually set this when we're creating the item it will
                                                                                 # automatically be set to the current time because of this auto now add parameter
+    updated_on = models.DateTimeField(auto_now=True)                            # set on every save, the delta sync of the feed (see profiles_api/sync.py)
+                                                                                # asks for the items changed after a point in time with it
+
+    objects = ProfileFeedItemManager()
+
     def __str__(self):
         """Return the model as a string"""                                      # string representation of our model so that is
                                                                                 # to tell Python what to do when we convert a model instance into a string
         return self.status_text
+
+    class Meta:
+        indexes = [
+            models.Index(                                                       # this index supports the keyset pagination of the feed, so
+                fields=['-created_on', '-id'],                                  # every page is one range read ordered newest first
+                name='feed_created_on_id_idx',
+            ),
+            models.Index(                                                       # and this one the timeline of a single user, so reading the
+                fields=['user_profile', '-created_on', '-id'],                  # latest posts of a user is one range read as well
+                name='feed_user_created_on_id_idx',
+            ),
+            models.Index(                                                       # the changes after a sync cursor are one range read
+                fields=['updated_on', 'id'],
+                name='feed_updated_on_id_idx',
+            ),
+        ]
+
+
+class ArchivedFeedItem(models.Model):                                           # feed items older than the retention period are moved here by
+    """Profile feed item moved out of the live feed"""                          # "python manage.py archive_feed" (see profiles_api/retention.py)
+                                                                                # so the live feed table only holds the recent, busy rows
+    id = models.IntegerField(primary_key=True)                                  # the ID it had in the live feed, so links and cursors still work
+    user_profile = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='archived_feed_items',
+    )
+    status_text = models.CharField(max_length=255)
+    created_on = models.DateTimeField()
+    bucket = models.CharField(max_length=7, db_index=True)                      # the month of created_on ("2021-03"), a whole month can be read
+                                                                                # or dropped with one indexed lookup
+
+    def __str__(self):
+        """Return the model as a string"""
+        return self.status_text
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_on', '-id'], name='archive_created_on_id_idx'),
+            models.Index(fields=['user_profile', '-created_on', '-id'], name='archive_user_created_on_id_idx'),
+        ]
+
+
+class DeletedFeedItemManager(models.Manager):
+    """Manager for the tombstones of the feed"""
+
+    def record(self, ids):
+        """Leave a tombstone for every feed item ID that left the live feed"""
+        now = timezone.now()
+        self.bulk_create([self.model(id=pk, deleted_on=now) for pk in ids], ignore_conflicts=True)
+
+
+class DeletedFeedItem(models.Model):                                            # a feed item that was deleted (or archived) leaves no row behind,
+    """Tombstone of a feed item that left the live feed"""                     # so for a while we keep its ID here and the delta sync tells the
+                                                                                # clients to drop it (see profiles_api/sync.py)
+    id = models.IntegerField(primary_key=True)                                  # the ID the item had, IDs of the feed are never reused
+    deleted_on = models.DateTimeField()
+
+    objects = DeletedFeedItemManager()
+
+    def __str__(self):
+        """Return the model as a string"""
+        return str(self.id)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['deleted_on', 'id'], name='tombstone_deleted_on_id_idx'),
+        ]
+
+
+class RevokedToken(models.Model):                                               # signed tokens are checked without the database, so to log one
+    """Signed token that was revoked before it expired"""                      # out before it expires we remember its ID here until it would have
+                                                                                # expired anyway (see profiles_api/tokens.py)
+    jti = models.CharField(max_length=32, unique=True)
+    expires_on = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        """Return the model as a string"""
+        return self.jti
+
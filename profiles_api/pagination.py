@@ -0,0 +1,155 @@
+from base64 import b64decode, b64encode
+from urllib import parse
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+# keyset (cursor) pagination never asks the database to skip rows with OFFSET,
+# instead the cursor remembers the (created_on, id) of the last row that the
+# client has seen and the next page starts right after it... this way every
+# page is a single range read on the (created_on, id) index no matter how deep
+# the client has scrolled
+
+
+def encode_cursor(created_on, pk, reverse=False):
+    """Encode a position in the feed as an opaque cursor string"""
+    raw = f'{int(reverse)}|{created_on.isoformat()}|{pk}'
+    return b64encode(raw.encode('ascii')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Decode a cursor string into a (created_on, id, reverse) tuple"""
+    try:
+        reverse, created_on, pk = b64decode(cursor.encode('ascii')).decode('ascii').split('|')
+        position = (parse_datetime(created_on), int(pk), bool(int(reverse)))
+    except (TypeError, ValueError, UnicodeError):
+        raise NotFound('Invalid cursor')
+    if position[0] is None:
+        raise NotFound('Invalid cursor')
+    return position
+
+
+def row_value(row, name):
+    """Read a field from a model instance or from a values() dictionary"""
+    if isinstance(row, dict):
+        return row[name]
+    return getattr(row, name)
+
+
+def keyset_page(queryset, created_on=None, pk=None, reverse=False, size=20):
+    """Return one page of rows (newest first) after or before the position
+
+    The queryset is ordered by (-created_on, -id) and filtered with a row
+    comparison, the reverse direction is read ascending and flipped back so
+    callers always get the rows newest first. One extra row is fetched to know
+    whether there is anything beyond the page.
+    """
+    if created_on is not None:
+        if reverse:
+            queryset = queryset.filter(
+                Q(created_on__gt=created_on) | Q(created_on=created_on, id__gt=pk)
+            )
+        else:
+            queryset = queryset.filter(
+                Q(created_on__lt=created_on) | Q(created_on=created_on, id__lt=pk)
+            )
+
+    if reverse:
+        queryset = queryset.order_by('created_on', 'id')
+    else:
+        queryset = queryset.order_by('-created_on', '-id')
+
+    rows = list(queryset[:size + 1])
+    has_more = len(rows) > size
+    rows = rows[:size]
+    if reverse:
+        rows.reverse()
+    return rows, has_more
+
+
+class FeedCursorPagination(BasePagination):
+    """Keyset pagination for feed items ordered by (created_on, id)"""
+
+    cursor_query_param = 'cursor'
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """Return a single page of feed items for the request"""
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            created_on, pk, reverse = decode_cursor(parse.unquote(cursor))
+        else:
+            created_on, pk, reverse = None, None, False
+
+        self.page, has_more = keyset_page(
+            queryset, created_on, pk, reverse, self.page_size
+        )
+
+        # when we walk forwards there is something before us as soon as we
+        # got here through a cursor, when we walk backwards it's the other way
+        # round so the flags swap
+        if reverse:
+            self.has_next, self.has_previous = cursor is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+
+        return self.page
+
+    def get_page_size(self, request):
+        """Read the requested page size but never go above the maximum"""
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def get_next_link(self):
+        """Link to the page of older items"""
+        if not self.has_next or not self.page:
+            return None
+        last = self.page[-1]
+        cursor = encode_cursor(row_value(last, 'created_on'), row_value(last, 'id'))
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def get_previous_link(self):
+        """Link to the page of newer items"""
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        first = self.page[0]
+        cursor = encode_cursor(
+            row_value(first, 'created_on'), row_value(first, 'id'), reverse=True
+        )
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        """Wrap the page with the links to its neighbours"""
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
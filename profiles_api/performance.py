@@ -0,0 +1,86 @@
+# where the time of a request goes... PerformanceMiddleware (see middleware.py)
+# starts a RequestTimings for every request, every database query adds its
+# time to it through the execute wrapper that signals.py installs on each new
+# connection and the rendering of the response adds the serialization time,
+# at the end the middleware puts it in the Server-Timing header and in the
+# per view histograms of metrics.py
+import contextvars
+import time
+from contextlib import contextmanager
+
+from profiles_api import metrics
+
+
+current_timings = contextvars.ContextVar('profiles_api_request_timings', default=None)   # a context variable follows the request into
+                                                                                          # the threads of the async views (see async_views.run_db)
+
+
+class RequestTimings:
+    """Database and rendering time spent on one request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.render_seconds = 0.0
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+def record_query(execute, sql, params, many, context):
+    """Execute wrapper that adds the time of every query to the current request"""
+    timings = current_timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.queries += 1
+        timings.db_seconds += time.perf_counter() - started
+
+
+@contextmanager
+def timed_render():
+    """Count the time of the block as serialization time of the current request"""
+    timings = current_timings.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings.render_seconds += time.perf_counter() - started
+
+
+def view_name(request):
+    """Return the name the metrics of the request are recorded under"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    func = match.func
+    cls = getattr(func, 'cls', None)                                            # the as_view() of the rest framework remembers its class
+    if cls is None:
+        return func.__name__
+    action = (getattr(func, 'actions', None) or {}).get(request.method.lower())  # and a view set the action of every HTTP method
+    return f'{cls.__name__}.{action}' if action else cls.__name__
+
+
+def server_timing(timings, total):
+    """Return the value of the Server-Timing header"""
+    return (
+        f'app;dur={total * 1000:.1f}, '
+        f'db;dur={timings.db_seconds * 1000:.1f};desc="{timings.queries} queries", '
+        f'render;dur={timings.render_seconds * 1000:.1f}'
+    )
+
+
+def observe(view, status_code, timings, total, size):
+    """Add one request to the metrics of its view"""
+    metrics.counter('requests', view=view, status=f'{status_code // 100}xx').inc()
+    metrics.histogram('request_seconds', view=view).observe(total)
+    metrics.histogram('db_seconds', view=view).observe(timings.db_seconds)
+    metrics.histogram('db_queries', view=view).observe(timings.queries)
+    metrics.histogram('render_seconds', view=view).observe(timings.render_seconds)
+    if size is not None:
+        metrics.histogram('response_bytes', view=view).observe(size)
@@ -45,5 +45,7 @@ class UpdateOwnStatud (permissions.BasePermission):
         if request.method in permissions.SAFE_METHODS:                          # if the object that is being
             return True                                                         # modified has a user profile.ID the same as the request.user.ID then
                                                                                 # this will return true and it will allow the permission through otherwise it will
-        return obj.user_profile.id == request.user.id                           # return false and it will block the request being made
+        return obj.user_profile_id == request.user.id                           # return false and it will block the request being made
+                                                                                # we read user_profile_id which is already on the feed item row, going
+                                                                                # through obj.user_profile would load the whole user just to read its ID
             
@@ -0,0 +1,181 @@
+# publish/subscribe of new feed items... every feed item is published once
+# it's committed (see signals.py) and the long-poll and server-sent events
+# endpoints wait on the broker instead of polling the database, so an idle
+# client costs no queries at all
+#
+# the InProcessBroker only sees the feed items created by its own process,
+# when the API runs in more than one process FEED_PUBSUB_BROKER must name a
+# broker that is shared between them, the CacheBroker over the shared cache
+# (the production settings use it) or a subclass of Broker over Redis for
+# example
+import asyncio
+import threading
+import time
+from collections import deque
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+
+class Broker:
+    """Interface of the feed brokers"""
+
+    poll_interval = 0.5                                                         # how often wait_async() looks again
+
+    def publish(self, item_id, payload):
+        """Hand a new feed item (its ID and serialized data) to the waiters"""
+        raise NotImplementedError
+
+    def wait(self, since, timeout):
+        """Return the payloads of items newer than since, waiting up to timeout
+
+        Returns an empty list when nothing new came in time and None when the
+        broker can't tell what happened after since, then the caller has to
+        read the database instead.
+        """
+        raise NotImplementedError
+
+    def cover(self, since):
+        """Tell the broker the database has nothing newer than since"""
+
+    def last_id(self):
+        """Return the newest ID the broker knows, or None"""
+        return None
+
+    async def wait_async(self, since, timeout):
+        """Like wait(), but on the event loop without holding a thread"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            events = await self.check_async(since)
+            remaining = deadline - loop.time()
+            if events != [] or remaining <= 0:
+                return events
+            await asyncio.sleep(min(self.poll_interval, remaining))
+
+    async def check_async(self, since):
+        """Return what wait() returns right away, for wait_async()"""
+        return self.wait(since, 0)
+
+
+class InProcessBroker(Broker):
+    """Ring buffer of the latest feed items with a condition to wait on"""
+
+    def __init__(self, size=1000):
+        self._events = deque()
+        self._size = size
+        self._floor = None                                                      # everything newer than this is in the buffer
+        self._condition = threading.Condition()
+
+    def publish(self, item_id, payload):
+        with self._condition:
+            self._events.append((item_id, payload))
+            while len(self._events) > self._size:
+                dropped_id, _ = self._events.popleft()                          # once an item falls out of the buffer anyone who
+                if self._floor is None or dropped_id > self._floor:             # hasn't seen it has to read the database
+                    self._floor = dropped_id
+            self._condition.notify_all()
+
+    def cover(self, since):
+        with self._condition:
+            if self._floor is None or since < self._floor:
+                self._floor = since
+
+    def last_id(self):
+        with self._condition:
+            if self._events:
+                return max(item_id for item_id, _ in self._events)
+            return self._floor
+
+    def _newer(self, since):
+        return [payload for item_id, payload in self._events if item_id > since]
+
+    def wait(self, since, timeout):
+        with self._condition:
+            if self._floor is None or since < self._floor:
+                return None
+            events = self._newer(since)
+            if not events and timeout > 0:
+                self._condition.wait(timeout)
+                if since < self._floor:
+                    return None
+                events = self._newer(since)
+            return sorted(events, key=lambda payload: payload['id'])
+
+
+class CacheBroker(Broker):
+    """Broker over a cache that all the processes share
+
+    Every item is kept under its ID in FEED_PUBSUB_CACHE_ALIAS for
+    FEED_PUBSUB_CACHE_TIMEOUT seconds next to the newest ID, and the waiters
+    look at the cache every poll_interval. When an ID between since and the
+    newest one isn't there (it expired or the cache culled it) the broker can't
+    tell and the caller reads the database.
+    """
+
+    GAP = False                                                                 # stands for an ID that has no feed item (a rolled back insert)
+    last_key = 'feed-pubsub:last'
+
+    def __init__(self, alias=None, timeout=None, size=1000):
+        self.cache = caches[alias or getattr(settings, 'FEED_PUBSUB_CACHE_ALIAS', 'default')]
+        self.timeout = timeout or getattr(settings, 'FEED_PUBSUB_CACHE_TIMEOUT', 3600)
+        self.size = size
+
+    def key(self, item_id):
+        return f'feed-pubsub:{item_id}'
+
+    def publish(self, item_id, payload):
+        self.cache.set(self.key(item_id), payload, self.timeout)
+        last = self.cache.get(self.last_key)
+        if last is None or item_id > last:                                      # two processes publishing at once can leave the smaller ID
+            self.cache.set(self.last_key, item_id, self.timeout)                # here, the next publish fixes it
+
+    def cover(self, since):
+        last = self.cache.get(self.last_key)
+        if last is None:
+            self.cache.add(self.last_key, since, self.timeout)
+            return
+        for item_id in range(since + 1, last + 1):                              # the database has none of these, add() doesn't overwrite an
+            self.cache.add(self.key(item_id), self.GAP, self.timeout)           # item published in the meantime
+
+    def last_id(self):
+        return self.cache.get(self.last_key)
+
+    def check(self, since):
+        """Return the payloads newer than since that are in the cache now"""
+        last = self.cache.get(self.last_key)
+        if last is None or since < last - self.size:
+            return None
+        if last <= since:
+            return []
+        keys = [self.key(item_id) for item_id in range(since + 1, last + 1)]
+        found = self.cache.get_many(keys)
+        if len(found) < len(keys):
+            return None
+        return [found[key] for key in keys if found[key] is not self.GAP]
+
+    def wait(self, since, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            events = self.check(since)
+            remaining = deadline - time.monotonic()
+            if events != [] or remaining <= 0:
+                return events
+            time.sleep(min(self.poll_interval, remaining))
+
+    async def check_async(self, since):
+        return await sync_to_async(self.check, thread_sensitive=False)(since)   # the cache may read files or the network
+
+
+_broker = None
+
+
+def get_broker():
+    """Return the process wide feed broker"""
+    global _broker
+    if _broker is None:
+        path = getattr(settings, 'FEED_PUBSUB_BROKER', None)
+        _broker = import_string(path)() if path else InProcessBroker()
+    return _broker
@@ -0,0 +1,130 @@
+import csv
+import io
+import json
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser, JSONParser
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:                                                             # both packages are optional, without orjson the JSON renderer
+    orjson = None                                                               # and parser fall back to the json module
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+# encoding JSON is a big part of the time of every response, orjson does it in
+# native code... the MessagePack format is smaller still and quicker to
+# decode for clients that understand it, they ask for it with
+# "Accept: application/msgpack" (settings.py only lists it when msgpack is
+# installed)
+
+
+_encoder = JSONEncoder()                                                        # the rest framework's encoder knows the types orjson doesn't (lazy strings, Decimal...)
+
+
+def encode_default(obj):
+    return _encoder.default(obj)
+
+
+class ORJSONRenderer(JSONRenderer):
+    """JSON renderer that encodes with orjson when it's installed"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}):        # orjson can only indent by 2, the browsable API and clients that
+            return super().render(data, accepted_media_type, renderer_context)  # ask for "indent=4" get the output of the json module
+        return orjson.dumps(data, default=encode_default, option=orjson.OPT_UTC_Z)
+
+
+class ORJSONParser(JSONParser):
+    """JSON parser that decodes with orjson when it's installed"""
+    renderer_class = ORJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if orjson is None:
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as error:
+            raise ParseError(f'JSON parse error - {error}')
+
+
+class MessagePackRenderer(BaseRenderer):
+    """MessagePack, a binary JSON"""
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=encode_default, use_bin_type=True)
+
+
+class MessagePackParser(BaseParser):
+    """MessagePack request bodies"""
+    media_type = 'application/msgpack'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False)
+        except (ValueError, msgpack.UnpackException) as error:
+            raise ParseError(f'MessagePack parse error - {error}')
+
+
+# the export and the event stream of the feed write their own output, these
+# renderers are there so the content negotiation of the rest framework knows
+# the formats (by the Accept header or by ?format=ndjson / ?format=csv)... the
+# rest framework still renders the errors of those views with them, a 401 or a
+# 406 for example, so they render a single record in their format
+
+
+class NDJSONRenderer(BaseRenderer):
+    """Newline delimited JSON"""
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return json.dumps(data, cls=JSONEncoder, ensure_ascii=False).encode('utf-8') + b'\n'
+
+
+class CSVRenderer(BaseRenderer):
+    """Comma separated values"""
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if not isinstance(data, dict):
+            data = {'detail': data}
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(data.keys())                                            # a header and one row, like the export
+        writer.writerow(data.values())
+        return output.getvalue().encode('utf-8')
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Server-sent events"""
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        data = json.dumps(data, cls=JSONEncoder, ensure_ascii=False)            # an "error" event, the browser closes the stream on the status
+        return f'event: error\ndata: {data}\n\n'.encode('utf-8')
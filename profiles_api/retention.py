@@ -0,0 +1,118 @@
+# retention of the feed... the live ProfileFeedItem table only keeps the
+# posts of the last FEED_RETENTION_DAYS so the busy queries (the feed pages,
+# the timelines, the long-poll catch up) only ever walk recent rows, older
+# posts are moved out in chunks by "python manage.py archive_feed" either into
+# the ArchivedFeedItem table, which the API still reads with ?archived=1, or
+# into gzip compressed NDJSON files, one per chunk and month named after the
+# month ("zcat feed-2021-03.*" reads a whole month)
+import gzip
+import os
+import tempfile
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from profiles_api import export
+from profiles_api import models
+
+
+def retention_cutoff(days=None):
+    """Return the time before which feed items are archived, None keeps them all"""
+    if days is None:
+        days = getattr(settings, 'FEED_RETENTION_DAYS', 0)
+    if not days:
+        return None
+    return timezone.now() - timedelta(days=days)
+
+
+def month_bucket(created_on):
+    """Return the month ("2021-03") a feed item is stored under"""
+    return created_on.astimezone(timezone.utc).strftime('%Y-%m')
+
+
+def archive_to_table(rows):
+    """Copy rows of export.COLUMNS into the ArchivedFeedItem table"""
+    objs = [
+        models.ArchivedFeedItem(
+            id=pk,
+            user_profile_id=user_profile_id,
+            status_text=status_text,
+            created_on=created_on,
+            bucket=month_bucket(created_on),
+        )
+        for pk, user_profile_id, status_text, created_on in rows
+    ]
+    models.ArchivedFeedItem.objects.bulk_create(objs, ignore_conflicts=True)   # a chunk that was copied before a crash is simply skipped
+    models.bulk_created.send(sender=models.ArchivedFeedItem, objs=objs)
+
+
+def archive_to_files(rows, directory):
+    """Write rows of export.COLUMNS to a new NDJSON file per month
+
+    The files are written under temporary names and only get their real names
+    once the transaction that deletes the rows commits, so a chunk that is
+    rolled back never shows up in the archive. Returns the temporary paths.
+    """
+    os.makedirs(directory, exist_ok=True)
+    by_month = defaultdict(list)
+    for pk, user_profile_id, status_text, created_on in rows:
+        by_month[month_bucket(created_on)].append((pk, user_profile_id, status_text, created_on.isoformat()))
+
+    renames = []
+    try:
+        for bucket, month_rows in by_month.items():
+            path = os.path.join(directory, f'feed-{bucket}.{month_rows[0][0]:010d}.ndjson.gz')   # the month and the first ID
+            fd, temp_path = tempfile.mkstemp(prefix=f'.feed-{bucket}.', suffix='.tmp', dir=directory)   # the same directory, so the rename is atomic
+            renames.append((temp_path, path))
+            with os.fdopen(fd, 'wb') as raw, gzip.open(raw, 'wt', encoding='utf-8') as stream:
+                stream.writelines(export.ndjson_lines(month_rows))
+    except BaseException:
+        remove_files(temp_path for temp_path, _ in renames)
+        raise
+
+    def rename():
+        for temp_path, path in renames:
+            os.replace(temp_path, path)
+
+    transaction.on_commit(rename)
+    return [temp_path for temp_path, _ in renames]
+
+
+def remove_files(paths):
+    """Remove the files that are still there"""
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def archive_feed(cutoff, to='table', directory=None, chunk_size=1000):
+    """Move the feed items created before cutoff out of the live feed
+
+    Every chunk is copied and deleted in its own short transaction, so posting
+    keeps working while a long backlog is archived. Yields the number of items
+    moved per chunk.
+    """
+    queryset = models.ProfileFeedItem.objects.filter(created_on__lt=cutoff).order_by('id')
+    while True:
+        temp_paths = []
+        try:
+            with transaction.atomic():
+                rows = list(queryset.values_list(*export.COLUMNS)[:chunk_size])
+                if not rows:
+                    return
+                if to == 'files':
+                    temp_paths = archive_to_files(rows, directory or settings.FEED_ARCHIVE_DIR)
+                else:
+                    archive_to_table(rows)
+                ids = [row[0] for row in rows]
+                models.ProfileFeedItem.objects.filter(pk__in=ids).delete()     # the delete signals drop the cached pages
+                models.DeletedFeedItem.objects.record(ids)                      # and the tombstones take them out of the synced clients
+        except BaseException:
+            remove_files(temp_paths)                                            # rolled back, the rows are still in the live feed
+            raise
+        yield len(rows)
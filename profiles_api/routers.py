@@ -0,0 +1,106 @@
+# read replicas... the reads of GET, HEAD and OPTIONS requests go to one of
+# the DATABASE_REPLICAS and everything else to the primary ('default'), so
+# adding a replica adds read capacity
+#
+# ReplicaRoutingMiddleware (see middleware.py) starts a Route for every request
+# and ReplicaRouter (in DATABASE_ROUTERS) reads it, outside of a request (the
+# shell, management commands) there is no route and everything uses the
+# primary... a replica lags behind the primary, so a client that has just
+# written is pinned to the primary for REPLICA_STICKY_SECONDS and reads its
+# own writes
+import contextvars
+import hashlib
+import random
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import BaseThrottle
+
+
+PRIMARY = 'default'
+
+current_route = contextvars.ContextVar('profiles_api_db_route', default=None)   # copied into the threads of the async views like the timings
+
+
+class Route:
+    """Where the reads of one request go"""
+
+    def __init__(self, replica=None):
+        self.replica = replica                                                  # None reads from the primary
+        self.wrote = False
+
+    def read_alias(self):
+        if self.wrote or self.replica is None:                                  # after a write in this request, later reads must see it
+            return PRIMARY
+        return self.replica
+
+
+def replicas():
+    return list(getattr(settings, 'DATABASE_REPLICAS', ()))
+
+
+def pick_replica():
+    """Return the replica the reads of a new request go to"""
+    aliases = replicas()
+    return random.choice(aliases) if aliases else None                          # one per request, so a request never mixes two replicas
+
+
+def pin_cache():
+    return caches[getattr(settings, 'REPLICA_PIN_CACHE_ALIAS', 'default')]
+
+
+def client_keys(request):
+    """Return the cache keys that pin the client of the request to the primary
+
+    Routing happens before authentication, so the client is known by its
+    Authorization header (hashed, tokens don't belong in cache keys) and by
+    its address, which also covers the first requests after a login.
+    """
+    keys = [f'profiles_api:db_pin:ip:{BaseThrottle().get_ident(request)}']
+    authorization = request.META.get('HTTP_AUTHORIZATION')
+    if authorization:
+        digest = hashlib.sha256(authorization.encode()).hexdigest()[:32]
+        keys.append(f'profiles_api:db_pin:auth:{digest}')
+    return keys
+
+
+def reads_from_replica():
+    """Check whether the reads of the current request go to a replica"""
+    route = current_route.get()
+    return route is not None and route.read_alias() != PRIMARY
+
+
+def is_pinned(request):
+    return bool(pin_cache().get_many(client_keys(request)))
+
+
+def pin(request):
+    """Read from the primary for the next REPLICA_STICKY_SECONDS"""
+    seconds = getattr(settings, 'REPLICA_STICKY_SECONDS', 5)
+    if seconds:
+        pin_cache().set_many(dict.fromkeys(client_keys(request), True), timeout=seconds)
+
+
+class ReplicaRouter:
+    """Send the reads of safe requests to a replica and every write to the primary"""
+
+    def db_for_read(self, model, **hints):
+        route = current_route.get()
+        return PRIMARY if route is None else route.read_alias()
+
+    def db_for_write(self, model, **hints):
+        route = current_route.get()
+        if route is not None:
+            route.wrote = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {PRIMARY, *replicas()}                                        # they all hold the same data
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in replicas():                                                    # replicas get their schema from the primary
+            return False
+        return None
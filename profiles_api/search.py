@@ -0,0 +1,178 @@
+# the search of the profile view set used to be a "LIKE '%x%'" over the name
+# and email columns which scans the whole table... here we keep a proper search
+# index instead: an FTS5 table on SQLite and trigram indexes on Postgres, the
+# backend is picked from the PROFILE_SEARCH_BACKEND setting or from the
+# database engine that is in use
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+from rest_framework import filters
+
+
+FTS_TABLE = 'profiles_api_userprofile_fts'
+
+
+class SearchBackend:
+    """Base class for the profile search backends"""
+
+    max_results = 1000
+
+    def index(self, profile):
+        """Add or refresh a profile in the search index"""
+
+    def index_many(self, profiles):
+        """Add or refresh many profiles in the search index"""
+        for profile in profiles:
+            self.index(profile)
+
+    def remove(self, pk):
+        """Drop a profile from the search index"""
+
+    def search(self, queryset, terms):
+        """Return the queryset narrowed to the terms, best matches first"""
+        raise NotImplementedError
+
+    def autocomplete(self, queryset, prefix, limit=10):
+        """Return up to limit profiles whose name or email starts with prefix"""
+        return self.search(queryset, [prefix])[:limit]
+
+
+class SimpleSearchBackend(SearchBackend):
+    """The plain icontains search, used when there is no better index"""
+
+    def search(self, queryset, terms):
+        for term in terms:
+            queryset = queryset.filter(Q(name__icontains=term) | Q(email__icontains=term))
+        return queryset
+
+    def autocomplete(self, queryset, prefix, limit=10):
+        return queryset.filter(
+            Q(name__istartswith=prefix) | Q(email__istartswith=prefix)
+        ).order_by('name')[:limit]
+
+
+class SQLiteFTSSearchBackend(SearchBackend):
+    """Ranked prefix search on a denormalized SQLite FTS5 table
+
+    The FTS table holds a copy of the name and email of every profile under
+    the profile ID as its rowid, it's created by migration 0005 and kept in
+    sync by the UserProfile save and delete signals.
+    """
+
+    def index(self, profile):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [profile.pk])
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, email) VALUES (%s, %s, %s)',
+                [profile.pk, profile.name, profile.email],
+            )
+
+    def index_many(self, profiles):
+        rows = [(profile.pk, profile.name, profile.email) for profile in profiles]
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [row[:1] for row in rows])
+            cursor.executemany(f'INSERT INTO {FTS_TABLE} (rowid, name, email) VALUES (%s, %s, %s)', rows)
+
+    def remove(self, pk):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [pk])
+
+    def match_expression(self, terms):
+        """Turn the search terms into an FTS5 query of quoted prefix tokens"""
+        tokens = []
+        for term in terms:
+            term = term.replace('"', ' ').strip()                               # quoting every term keeps FTS5 operators in the input harmless
+            if term:
+                tokens.append(f'"{term}"*')
+        return ' '.join(tokens)
+
+    def ranked(self, queryset, terms, limit):
+        """Narrow the queryset to the best limit matches, best first
+
+        The matches stay in the database (a subquery on the FTS table) instead
+        of coming back as a list of IDs, so a search with many hits doesn't run
+        into the limit of bound parameters of older SQLite versions (999).
+        """
+        expression = self.match_expression(terms)
+        if not expression:
+            return queryset.none()
+        table = queryset.model._meta.db_table
+        matches = RawSQL(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s ORDER BY bm25({FTS_TABLE}) LIMIT %s',
+            [expression, limit],
+        )
+        rank = RawSQL(                                                          # looks up one row of the index by its rowid for every match
+            f'SELECT bm25({FTS_TABLE}) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s AND rowid = "{table}"."id"',
+            [expression],
+        )
+        return queryset.filter(pk__in=matches).annotate(search_rank=rank).order_by('search_rank', 'pk')
+
+    def search(self, queryset, terms):
+        return self.ranked(queryset, terms, self.max_results)
+
+    def autocomplete(self, queryset, prefix, limit=10):
+        return self.ranked(queryset, [prefix], limit)
+
+
+class PostgresSearchBackend(SearchBackend):
+    """Trigram similarity search backed by the pg_trgm GIN indexes
+
+    The indexes are on the user profile table itself (see migration 0005) so
+    there is nothing to keep in sync on save or delete.
+    """
+
+    def search(self, queryset, terms):
+        from django.contrib.postgres.search import TrigramSimilarity
+        from django.db.models.functions import Greatest
+
+        query = ' '.join(terms)
+        return queryset.annotate(
+            search_rank=Greatest(
+                TrigramSimilarity('name', query),
+                TrigramSimilarity('email', query),
+            )
+        ).filter(
+            Q(name__trigram_similar=query)
+            | Q(email__trigram_similar=query)
+            | Q(name__icontains=query)                                          # the trigram indexes serve icontains too
+            | Q(email__icontains=query)
+        ).order_by('-search_rank')
+
+    def autocomplete(self, queryset, prefix, limit=10):
+        return self.search(
+            queryset.filter(Q(name__istartswith=prefix) | Q(email__istartswith=prefix)),
+            [prefix],
+        )[:limit]
+
+
+VENDOR_BACKENDS = {
+    'sqlite': SQLiteFTSSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+_backend = None
+
+
+def get_backend():
+    """Return the configured search backend instance"""
+    global _backend
+    if _backend is None:
+        path = getattr(settings, 'PROFILE_SEARCH_BACKEND', None)
+        if path:
+            backend_class = import_string(path)
+        else:
+            backend_class = VENDOR_BACKENDS.get(connection.vendor, SimpleSearchBackend)
+        _backend = backend_class()
+    return _backend
+
+
+class ProfileSearchFilter(filters.SearchFilter):
+    """The search filter of the rest framework running on the search backend"""
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+        return get_backend().search(queryset, terms)
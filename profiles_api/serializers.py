@@ -1,18 +1,99 @@
 # all we do is we define the serializer and then we secify the fields that we want to accept in our serializer input
-from rest_framework import serializers
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
+from rest_framework.authtoken.serializers import AuthTokenSerializer
 
 from profiles_api import models                                                 # this allows us to access our user profile model that we previously created
+from profiles_api import tokens
 
 class HelloSerializer(serializers.Serializer):                                  # we create a simple serializer that accepts a name input and the we're going to add it to our API view
     """serializes a name field for testing our APIView"""                       # and then we're going to use it to test the post functionality of our API view
                                                                                 # here we create a field (in this case called name) and this is value that can be passed into the request that will be validated by the serializer
     name = serializers.CharField(max_length=10)                                 # we create a character field (called name) on our serializers
 
-class UserProfileSerializer(serializers.ModelSerializer):                        # we use a meta class to configure the serializer to point to a specific model in our project
+class SparseFieldsMixin:
+    """Let the serializer render a subset of its fields, picked with fields=(...)"""
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+def datetime_converter(field):
+    """Return a faster to_representation for a DateTimeField rendered as ISO 8601"""
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    if output_format is None or output_format.lower() != ISO_8601:
+        return field.to_representation
+    field_timezone = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+
+    def convert(value):
+        if value.tzinfo is not field_timezone:                                  # the database already gives us the current time zone most of
+            return field.to_representation(value)                               # the time, then converting it again is wasted work
+        value = value.isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+    return convert
+
+
+class ValuesSerializer:
+    """Read only serializer for the dictionaries of QuerySet.values()
+
+    It gives the same output as the model serializer it's built from, but the
+    field objects are set up once per page instead of once per row and the
+    values that are already JSON friendly are copied as they are.
+    """
+
+    plain_fields = (                                                            # to_representation of these only repeats what the database gave us
+        serializers.CharField,
+        serializers.IntegerField,
+        serializers.BooleanField,
+        serializers.PrimaryKeyRelatedField,
+    )
+
+    def __init__(self, serializer_class, fields=None):
+        self.fields = []                                                        # (name, column, converter or None)
+        for name, field in serializer_class(fields=fields).fields.items():
+            if field.write_only:
+                continue
+            if isinstance(field, self.plain_fields):
+                convert = None
+            elif isinstance(field, serializers.DateTimeField):
+                convert = datetime_converter(field)
+            else:
+                convert = field.to_representation
+            self.fields.append((name, field.source, convert))
+
+    @property
+    def columns(self):
+        """The columns to pass to values()"""
+        return [column for name, column, convert in self.fields]
+
+    def serialize(self, rows):
+        """Return the list of output dictionaries for the rows"""
+        fields = self.fields
+        data = []
+        for row in rows:
+            item = {}
+            for name, column, convert in fields:
+                value = row[column]
+                if convert is not None and value is not None:
+                    value = convert(value)
+                item[name] = value
+            data.append(item)
+        return data
+
+
+class UserProfileSerializer(SparseFieldsMixin, serializers.ModelSerializer):     # we use a meta class to configure the serializer to point to a specific model in our project
     """Serializes a user profile object"""
     class Meta:
         model = models.UserProfile                                              # this sets our serializer up to point to our user profile model
-        fields = ('id', 'email', 'name', 'password')                            # so this is the list of fields that we want to work with
+        fields = ('id', 'email', 'name', 'password',                            # so this is the list of fields that we want to work with
+                  'feed_count', 'last_status', 'last_posted_on')
+        read_only_fields = ('feed_count', 'last_status', 'last_posted_on')      # the counters are kept by the feed, clients only read them
         extra_kwargs = {                                                        # we want to make this password field write only
             'password': {                                                       # the keys of the dictionary are the fields that we want to add the custom configuration
                 'write_only': True,
@@ -53,11 +134,14 @@ class UserProfileSerializer(serializers.ModelSerializer):
 # Bug fix:
     def update(self, instance, validated_data):
         """Handle updating user account"""
-        if 'password' in validated_data:
-            password = validated_data.pop('password')
+        password = validated_data.pop('password', None)
+        if password is not None:
             instance.set_password(password)
 
-        return super().update(instance, validated_data)
+        instance = super().update(instance, validated_data)
+        if password is not None:
+            tokens.revoke_user(instance)                                        # a new password logs the user out everywhere
+        return instance
 # Explanation:
 # The default update logic for the Django REST Framework (DRF) ModelSerializer
 # code will take whatever fields are provided (in our case: email, name, password)
@@ -75,7 +159,7 @@ class UserProfileSerializer(serializers.ModelSerializer):
 
 
 
-class ProfileFeedItemSerializer(serializers.ModelSerializer):
+class ProfileFeedItemSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializes profile feed items"""
 
     # we're going to set our model serializer to our
@@ -90,3 +174,40 @@ class ProfileFeedItemSerializer(serializers.ModelSerializer):
         fields = ('id','user_profile','status_text','created_on')               # we need to make these fields available through our serializer
         extra_kwargs = {'user_profile': {'read_only': True}}                    # we don't want one user to be able to
                                                                                 # create a new profile feed item and assign that to another user
+
+
+class LoginSerializer(AuthTokenSerializer):
+    """Checks login credentials with the password check in the login pool"""
+
+    # the serializer of the rest framework calls authenticate() which hashes
+    # the password in the request thread, here we look the user up ourselves
+    # and only send the hashing to the bounded login pool, if the stored hash
+    # is out of date (another hasher or other parameters) we save the new one
+
+    def validate(self, attrs):
+        from profiles_api import hashing                                        # imported on the first login, the signals import this module
+                                                                                # at startup in every process, also the ones that never log in
+        username = attrs.get('username')
+        password = attrs.get('password')
+        if not username or not password:
+            raise serializers.ValidationError(
+                'Must include "username" and "password".', code='authorization'
+            )
+
+        user = models.UserProfile.objects.filter(
+            **{models.UserProfile.USERNAME_FIELD: username}
+        ).first()
+        correct, new_hash = hashing.login_pool().run(
+            hashing.verify_password, password, user.password if user else None
+        )
+        if not correct or not user.is_active:
+            raise serializers.ValidationError(
+                'Unable to log in with provided credentials.', code='authorization'
+            )
+
+        if new_hash is not None:                                                # transparent rehash on login, this is the only write of a login
+            user.password = new_hash
+            user.save(update_fields=['password'])
+
+        attrs['user'] = user
+        return attrs
@@ -0,0 +1,135 @@
+# signal receivers that keep the caches and the search index of the profiles
+# API in step with the database, they are connected when the app is ready (see apps.py)
+from django.conf import settings
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from profiles_api import authentication
+from profiles_api import caching
+from profiles_api import models
+from profiles_api import performance
+from profiles_api import search
+from profiles_api import sqlite
+from profiles_api import pubsub
+from profiles_api import serializers
+
+
+@receiver(post_delete, sender=Token)
+def forget_deleted_token(sender, instance, **kwargs):
+    """Stop accepting a token as soon as it's deleted"""
+    authentication.invalidate_token(instance.key)
+
+
+@receiver(post_save, sender=models.UserProfile)
+@receiver(post_delete, sender=models.UserProfile)
+def forget_user_tokens(sender, instance, **kwargs):
+    """Drop cached tokens of a user that was saved, deactivated or deleted"""
+    keys = ()
+    if authentication.shared_cache() is not None:
+        keys = Token.objects.filter(user_id=instance.pk).values_list('key', flat=True)
+    authentication.invalidate_user(instance.pk, list(keys))
+
+
+@receiver(post_save, sender=models.UserProfile)
+def index_profile(sender, instance, raw=False, **kwargs):
+    """Keep the search index in step with the saved profile"""
+    if not raw:
+        search.get_backend().index(instance)
+
+
+@receiver(post_delete, sender=models.UserProfile)
+def unindex_profile(sender, instance, **kwargs):
+    """Drop a deleted profile from the search index"""
+    search.get_backend().remove(instance.pk)
+
+
+@receiver(models.bulk_created, sender=models.UserProfile)
+def index_bulk_created_profiles(sender, objs, **kwargs):
+    """Add profiles created with bulk_create to the search index"""
+    emails = [obj.email for obj in objs]                                        # SQLite doesn't give us the IDs of bulk created rows
+    for start in range(0, len(emails), 500):                                    # older SQLite takes at most 999 parameters per query
+        profiles = sender.objects.filter(email__in=emails[start:start + 500])
+        search.get_backend().index_many(profiles.only('id', 'name', 'email'))
+
+
+@receiver(pre_delete, sender=models.UserProfile)
+def tombstone_profile_feed(sender, instance, **kwargs):
+    """Leave tombstones for the feed items a deleted profile takes with it"""
+    models.DeletedFeedItem.objects.record(
+        models.ProfileFeedItem.objects.filter(user_profile=instance).values_list('id', flat=True)
+    )
+
+
+def invalidate_responses(model, pk=None):
+    """Drop the cached responses now and once more after the commit"""
+    caching.invalidate(model, pk)                                               # the second bump makes sure no reader that ran before the commit
+    transaction.on_commit(lambda: caching.invalidate(model, pk))                # cached the old rows under the new version
+
+
+@receiver(post_save, sender=models.UserProfile)
+@receiver(post_delete, sender=models.UserProfile)
+@receiver(post_save, sender=models.ProfileFeedItem)
+@receiver(post_delete, sender=models.ProfileFeedItem)
+@receiver(post_save, sender=models.ArchivedFeedItem)
+@receiver(post_delete, sender=models.ArchivedFeedItem)
+def invalidate_cached_responses(sender, instance, **kwargs):
+    """Drop the cached pages that may contain the saved or deleted object"""
+    invalidate_responses(sender, instance.pk)
+
+
+@receiver(models.bulk_created, sender=models.UserProfile)
+@receiver(models.bulk_created, sender=models.ProfileFeedItem)
+@receiver(models.bulk_created, sender=models.ArchivedFeedItem)
+def invalidate_bulk_cached_responses(sender, objs, **kwargs):
+    """Drop the cached lists after a bulk insert"""
+    invalidate_responses(sender)
+
+
+@receiver(models.feed_counters_changed, sender=models.UserProfile)
+def invalidate_counted_profiles(sender, pks, **kwargs):
+    """Drop the cached profiles whose feed counters changed"""
+    for pk in pks:
+        invalidate_responses(sender, pk)
+
+
+@receiver(connection_created)
+def tune_sqlite_connection(sender, connection, **kwargs):
+    """Apply the SQLITE_PRAGMAS to every new SQLite connection"""
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', None)
+    if connection.vendor == 'sqlite' and pragmas:
+        sqlite.apply_pragmas(connection, pragmas)
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    """Time every query of the connection for the request it runs in"""
+    if getattr(settings, 'PERFORMANCE_METRICS', True):                         # connected after the pragmas so those don't count
+        connection.execute_wrappers.append(performance.record_query)
+
+
+def publish_feed_items(items):
+    """Publish new feed items to the waiting clients once they're committed"""
+    payloads = [(item.pk, dict(serializers.ProfileFeedItemSerializer(item).data)) for item in items]
+
+    def publish():
+        broker = pubsub.get_broker()
+        for item_id, payload in payloads:
+            broker.publish(item_id, payload)
+
+    transaction.on_commit(publish)
+
+
+@receiver(post_save, sender=models.ProfileFeedItem)
+def publish_created_feed_item(sender, instance, created, raw=False, **kwargs):
+    """Publish a feed item when it's created"""
+    if created and not raw:
+        publish_feed_items([instance])
+
+
+@receiver(models.bulk_created, sender=models.ProfileFeedItem)
+def publish_bulk_created_feed_items(sender, objs, **kwargs):
+    """Publish feed items created in bulk"""
+    publish_feed_items(objs)
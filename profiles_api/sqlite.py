@@ -0,0 +1,11 @@
+# SQLite tuning... in the default rollback journal mode a writer blocks every
+# reader until it commits and concurrent feed posts fail with "database is
+# locked", so every new SQLite connection gets the pragmas from the
+# SQLITE_PRAGMAS setting (WAL, synchronous, busy_timeout, mmap_size) applied
+
+
+def apply_pragmas(connection, pragmas):
+    """Run PRAGMA name = value for every pragma on a new SQLite connection"""
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
@@ -0,0 +1,111 @@
+# streaming responses under ASGI... the ASGIHandler of Django 3.1 iterates the
+# body of a StreamingHttpResponse right on the event loop, so a body that reads
+# the database while it's iterated (the feed export) fails there with
+# SynchronousOnlyOperation, and anything slow in it would stop every other
+# request of the process... StreamingASGIHandler (see profiles_project/asgi.py)
+# reads such a body in the thread Django runs the synchronous views in instead,
+# a batch of lines at a time
+#
+# a body that waits most of the time (the event stream of the feed) would hold
+# that thread though, so it's an AsyncStreamingHttpResponse over an async
+# iterator instead, which the handler iterates right on the event loop until
+# it ends or the client goes away
+import asyncio
+import contextvars
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIHandler
+from django.http import StreamingHttpResponse
+
+
+_receive = contextvars.ContextVar('receive')                                     # the receive channel of the request being handled
+
+
+def read_parts(iterator, size):
+    """Return the next parts of a response joined up to about size bytes, b'' at the end"""
+    parts = []
+    length = 0
+    for part in iterator:
+        parts.append(part)
+        length += len(part)
+        if length >= size:
+            break
+    return b''.join(parts)
+
+
+class AsyncStreamingHttpResponse(StreamingHttpResponse):
+    """Streaming response over an async iterator, only StreamingASGIHandler sends it"""
+
+    is_async = True
+
+    def __init__(self, streaming_content=(), *args, **kwargs):
+        super().__init__((), *args, **kwargs)                                   # Django 3.1 only iterates synchronously
+        self.async_streaming_content = streaming_content
+
+
+class StreamingASGIHandler(ASGIHandler):
+    """ASGI handler that never iterates a synchronous streaming body on the event loop"""
+
+    async def __call__(self, scope, receive, send):
+        _receive.set(receive)                                                   # send_response() listens on it for the client going away
+        await super().__call__(scope, receive, send)
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': self.response_headers(response),
+        })
+        if getattr(response, 'is_async', False):
+            finished = await self.send_async_body(response, send)
+        else:
+            finished = await self.send_body(response, send)
+        if finished:
+            await send({'type': 'http.response.body'})
+        await sync_to_async(response.close, thread_sensitive=True)()
+
+    async def send_body(self, response, send):
+        iterator = iter(response)
+        read = sync_to_async(read_parts, thread_sensitive=True)                 # the thread of the sync views, which holds the database connection
+        while True:
+            data = await read(iterator, self.chunk_size)
+            if not data:
+                return True
+            await send({'type': 'http.response.body', 'body': data, 'more_body': True})
+
+    async def send_async_body(self, response, send):
+        """Send the body until it ends (True) or the client goes away (False)"""
+        async def body():
+            async for part in response.async_streaming_content:
+                await send({'type': 'http.response.body', 'body': response.make_bytes(part), 'more_body': True})
+
+        async def disconnect():
+            receive = _receive.get()
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+
+        sending = asyncio.ensure_future(body())
+        listening = asyncio.ensure_future(disconnect())
+        await asyncio.wait((sending, listening), return_when=asyncio.FIRST_COMPLETED)
+        for task in (sending, listening):                                       # cancelling the body stops the iterator where it waits
+            task.cancel()
+        await asyncio.gather(sending, listening, return_exceptions=True)
+        if not sending.cancelled() and sending.exception() is not None:
+            raise sending.exception()
+        return not sending.cancelled()
+
+    def response_headers(self, response):
+        """Return the headers and cookies of the response as ASGI wants them"""
+        headers = []
+        for header, value in response.items():
+            if isinstance(header, str):
+                header = header.encode('ascii')
+            if isinstance(value, str):
+                value = value.encode('latin1')
+            headers.append((bytes(header), bytes(value)))
+        for cookie in response.cookies.values():
+            headers.append((b'Set-Cookie', cookie.output(header='').encode('ascii').strip()))
+        return headers
@@ -0,0 +1,109 @@
+# delta sync of the feed... instead of fetching the whole feed on every app
+# open a client keeps what it has and asks GET /api/feed/changes/?since=<cursor>
+# for what happened after it: the items created or edited since then (by
+# their updated_on) and the IDs of the items that left the live feed (the
+# DeletedFeedItem tombstones), both read in (time, id) order from their
+# indexes so a client that is up to date costs two empty range reads
+#
+# the tombstones are kept for FEED_TOMBSTONE_DAYS, a client whose cursor is
+# older than that can't be told everything that was deleted and gets a 410
+# asking it to fetch the whole feed again
+#
+# updated_on and deleted_on are stamped when the row is saved, before the
+# transaction waits for the write lock and commits, so a change can turn up
+# after changes stamped later than it... the cursor therefore never goes past
+# FEED_CHANGES_OVERLAP seconds ago (harakiri ends every request after 30) and
+# the next sync reads that window again, the client applies the changes it
+# already has by their ID once more
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from profiles_api import caching
+from profiles_api import models
+from profiles_api import pagination
+from profiles_api import serializers
+
+
+def last_modified():
+    """Return the time the live feed last changed
+
+    It's the version of the feed in the response cache, which every save,
+    delete and bulk insert of a feed item bumps to the current time, so it
+    costs no query. A version that was evicted starts again at now, which is
+    never too old.
+    """
+    version = caching.current_version(caching.model_version_key(models.ProfileFeedItem))
+    return datetime.fromtimestamp(version / 1e9, tz=timezone.utc)
+
+
+def tombstone_horizon():
+    """Return the time before which tombstones are purged, None keeps them all"""
+    days = getattr(settings, 'FEED_TOMBSTONE_DAYS', 0)
+    if not days:
+        return None
+    return timezone.now() - timedelta(days=days)
+
+
+def purge_tombstones():
+    """Delete the tombstones older than FEED_TOMBSTONE_DAYS, return how many"""
+    horizon = tombstone_horizon()
+    if horizon is None:
+        return 0
+    return models.DeletedFeedItem.objects.filter(deleted_on__lt=horizon).delete()[0]
+
+
+def parse_since(value):
+    """Return the (time, id) position of a sync cursor or of a plain ISO 8601 time"""
+    try:
+        since = parse_datetime(value)
+    except ValueError:
+        since = None
+    if since is not None:
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since, timezone.utc)
+        return since, 0                                                         # IDs start at 1, so this includes everything at that time
+    updated_on, pk, _ = pagination.decode_cursor(value)
+    return updated_on, pk
+
+
+def after(field, position):
+    time, pk = position
+    return Q(**{f'{field}__gt': time}) | Q(**{field: time, 'id__gt': pk})
+
+
+def changes(position=None, limit=500, overlap=30):
+    """Return the changes of the live feed after position, at most limit of them
+
+    Without a position every live item is a change, which is the first (full)
+    sync. The cursor of the result is the position of its last change, but
+    no later than overlap seconds ago.
+    """
+    settled = (timezone.now() - timedelta(seconds=overlap), 0)                  # what's stamped before this has committed by now
+    values_serializer = serializers.ValuesSerializer(serializers.ProfileFeedItemSerializer)
+    changed = models.ProfileFeedItem.objects.order_by('updated_on', 'id')
+    deleted = models.DeletedFeedItem.objects.none()                             # a client without a position has nothing to delete
+    if position is not None:
+        changed = changed.filter(after('updated_on', position))
+        deleted = models.DeletedFeedItem.objects.filter(after('deleted_on', position)).order_by('deleted_on', 'id')
+
+    merged = sorted(                                                            # the feed and the tombstones share the IDs, so (time, id) is a
+        [(row['updated_on'], row['id'], row) for row in changed.values(*values_serializer.columns, 'updated_on')[:limit + 1]]
+        + [(deleted_on, pk, None) for deleted_on, pk in deleted.values_list('deleted_on', 'id')[:limit + 1]],
+        key=lambda change: change[:2],                                          # single order over both of them
+    )
+    more = len(merged) > limit
+    merged = merged[:limit]
+    if merged:
+        position = merged[-1][:2]
+        if position > settled:                                                  # the rest comes again with the next sync, asking for
+            position, more = settled, False                                     # more right away would return the same page
+    return {
+        'changed': values_serializer.serialize([row for _, _, row in merged if row is not None]),
+        'deleted': [pk for _, pk, row in merged if row is None],
+        'cursor': pagination.encode_cursor(*position) if position is not None else None,
+        'more': more,
+    }
@@ -1,3 +1,1062 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth.hashers import check_password, get_hasher, make_password
+from django.core.cache import caches
+from django.core.signals import request_finished, request_started
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import DatabaseError, close_old_connections, connection, connections
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import exceptions
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from profiles_api import authentication
+from profiles_api import benchmarks
+from profiles_api import factories
+from profiles_api import metrics
+from profiles_api import models
+from profiles_api import pubsub
+from profiles_api import renderers
+from profiles_api import retention
+from profiles_api import routers
+from profiles_api import search
+from profiles_api import serializers
+from profiles_api import throttling
+from profiles_api import tokens
+from profiles_api import writequeue
+from profiles_api.middleware import AdmissionControlMiddleware, ReplicaRoutingMiddleware
+from profiles_api.streaming import StreamingASGIHandler
+
+
+
+def clear_caches():
+    caches['default'].clear()                                                   # the rolled back rows of the last test are still cached under
+    authentication.token_cache.clear()                                          # the versions they had
+    tokens.revocations.clear()
+    throttling.local_store.clear()
+    pubsub._broker = None
+
+
+class APITestCase(TestCase):
+    """Start every test with empty caches and rate limit buckets"""
+
+    databases = '__all__'                                                       # with DB_REPLICAS set the reads go to the replicas, which mirror
+                                                                                # the test database
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.replica_connections = {
+            alias: connections[alias] for alias in connections
+            if connections[alias].settings_dict['TEST']['MIRROR']
+        }
+        for alias, connection in cls.replica_connections.items():               # a second connection to the in-memory test database can't
+            connections[alias] = connections[connection.settings_dict['TEST']['MIRROR']]   # see inside the test's transaction, the same one can
+
+    @classmethod
+    def tearDownClass(cls):
+        for alias, connection in cls.replica_connections.items():
+            connections[alias] = connection
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        clear_caches()
+
+    def asgi_get(self, path, headers=(), handler_class=StreamingASGIHandler, until=None):
+        """GET path through the ASGI handler and return the status and the body
+
+        The client goes away once until(body) is true, for streams that never end.
+        """
+        path, _, query = path.partition('?')
+        scope = {
+            'type': 'http', 'method': 'GET', 'path': path, 'query_string': query.encode(),
+            'headers': [(name.encode(), value.encode()) for name, value in [('host', 'testserver'), *headers]],
+        }
+        messages = []
+        requests = [{'type': 'http.request', 'body': b''}]
+
+        async def receive():
+            if requests:
+                return requests.pop()
+            while until is None or not until(b''.join(message.get('body', b'') for message in messages[1:])):
+                await asyncio.sleep(0.01)
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            messages.append(message)
+
+        for signal in (request_started, request_finished):                      # like the test client, closing the connection would end the
+            signal.disconnect(close_old_connections)                            # transaction of the test
+        try:
+            async_to_sync(handler_class())(scope, receive, send)
+        finally:
+            for signal in (request_started, request_finished):
+                signal.connect(close_old_connections)
+        return messages[0]['status'], b''.join(message.get('body', b'') for message in messages[1:])
+
+
+class FeedQueryCountTests(APITestCase):
+    """The feed must not issue more queries as the page grows"""
+
+    MAX_QUERIES = 2
+
+    def setUp(self):
+        super().setUp()
+        self.user = models.UserProfile.objects.create_user('test@example.com', 'Test', 'password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_items(self, count):
+        start = models.ProfileFeedItem.objects.count()
+        for number in range(start, start + count):
+            author = models.UserProfile.objects.create_user(f'author{number}@example.com', 'Author', 'password')
+            models.ProfileFeedItem.objects.create(user_profile=author, status_text=f'status {number}')
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context)
+
+    def test_list_query_count_is_constant(self):
+        """A bigger page of items from different authors costs the same"""
+        self.create_items(3)
+        small_page = self.count_queries('/api/feed/?page_size=3')
+
+        self.create_items(30)
+        big_page = self.count_queries('/api/feed/?page_size=30')
+
+        self.assertEqual(small_page, big_page)
+        self.assertLessEqual(big_page, self.MAX_QUERIES)
+
+    def test_update_own_status_does_not_load_user(self):
+        """The object permission compares the foreign key without a join"""
+        item = models.ProfileFeedItem.objects.create(user_profile=self.user, status_text='old')
+        with self.assertNumQueries(3):                                          # load the item, update it and the last status of the profile
+            response = self.client.patch(f'/api/feed/{item.id}/', {'status_text': 'new'})
+        self.assertEqual(response.status_code, 200)
+
+
+class FeedPaginationTests(APITestCase):
+    """The cursor pages walk the feed newest first without skipping or repeating"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = models.UserProfile.objects.create_user('test@example.com', 'Test', 'password')
+        self.items = [
+            models.ProfileFeedItem.objects.create(user_profile=self.user, status_text=f'status {number}')
+            for number in range(5)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def ids(self, response):
+        return [item['id'] for item in response.data['results']]
+
+    def test_next_and_previous_pages(self):
+        first = self.client.get('/api/feed/?page_size=2')
+        self.assertEqual(self.ids(first), [self.items[4].id, self.items[3].id])
+        self.assertIsNone(first.data['previous'])
+
+        models.ProfileFeedItem.objects.create(user_profile=self.user, status_text='newer')   # doesn't shift the pages behind the cursor
+        second = self.client.get(first.data['next'])
+        self.assertEqual(self.ids(second), [self.items[2].id, self.items[1].id])
+        last = self.client.get(second.data['next'])
+        self.assertEqual(self.ids(last), [self.items[0].id])
+        self.assertIsNone(last.data['next'])
+
+        self.assertEqual(self.ids(self.client.get(last.data['previous'])), self.ids(second))
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/api/feed/?cursor=garbage').status_code, 404)
+
+
+class TokenCacheTests(APITestCase):
+    """Token lookups are cached and dropped when the token or its user changes"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = models.UserProfile.objects.create_user('test@example.com', 'Test', 'password')
+        self.token = Token.objects.create(user=self.user)
+        self.backend = authentication.CachedTokenAuthentication()
+
+    def test_lru_is_bounded_and_expires(self):
+        cache = authentication.TokenCache(max_size=2, ttl=10)
+        for key in ('a', 'b', 'c'):
+            cache.set(key, self.user, None)
+        self.assertIsNone(cache.get('a'))
+        with mock.patch('time.monotonic', return_value=time.monotonic() + 11):
+            self.assertIsNone(cache.get('c'))
+
+    def test_warm_lookup_and_deleted_token(self):
+        self.backend.authenticate_credentials(self.token.key)
+        with self.assertNumQueries(0):
+            self.backend.authenticate_credentials(self.token.key)
+        self.token.delete()
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.backend.authenticate_credentials(self.token.key)
+
+    @override_settings(TOKEN_CACHE_ALIAS='default', TOKEN_CACHE_LOCAL_TTL=5)
+    def test_other_process_drops_deactivated_user(self):
+        self.backend.authenticate_credentials(self.token.key)
+        stale = authentication.token_cache.get(self.token.key)
+        self.user.is_active = False
+        self.user.save()                                                        # the signal only clears this process' LRU and the shared cache
+        authentication.token_cache.set(self.token.key, *stale, ttl=5)           # what the LRU of another worker still holds
+        with mock.patch('time.monotonic', return_value=time.monotonic() + 6):
+            with self.assertRaises(exceptions.AuthenticationFailed):
+                self.backend.authenticate_credentials(self.token.key)
+
+
+class ProfileSearchTests(APITestCase):
+    """The search index follows every save and delete of a profile"""
+
+    def setUp(self):
+        super().setUp()
+        self.ada = models.UserProfile.objects.create_user('ada@example.com', 'Ada Lovelace', 'password')
+        self.alan = models.UserProfile.objects.create_user('alan@example.com', 'Alan Turing', 'password')
+        self.client = APIClient()
+
+    def names(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [profile['name'] for profile in response.data]
+
+    def test_search_and_autocomplete(self):
+        self.assertEqual(self.names('/api/profile/?search=turing'), ['Alan Turing'])
+        self.assertEqual(self.names('/api/profile/?search=lovelace ada'), ['Ada Lovelace'])
+        self.assertEqual(sorted(self.names('/api/profile/autocomplete/?q=a')), ['Ada Lovelace', 'Alan Turing'])
+        self.assertEqual(self.names('/api/profile/?search="OR'), [])           # FTS5 syntax in the input is only text
+
+    def test_index_follows_writes(self):
+        self.alan.name = 'Grace Hopper'
+        self.alan.save()
+        self.assertEqual(self.names('/api/profile/?search=turing'), [])
+        self.assertEqual(self.names('/api/profile/?search=hopper'), ['Grace Hopper'])
+
+        self.ada.delete()
+        self.assertEqual(self.names('/api/profile/?search=lovelace'), [])
+
+        models.UserProfile.objects.bulk_create_users([{'email': 'edsger@example.com', 'name': 'Edsger Dijkstra', 'password': 'x'}], workers=1)
+        self.assertEqual(self.names('/api/profile/?search=dijkstra'), ['Edsger Dijkstra'])
+
+    def test_many_hits_on_old_sqlite(self):
+        connection.ensure_connection()
+        limit = sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER
+        self.addCleanup(connection.connection.setlimit, limit, connection.connection.setlimit(limit, 999))   # the limit before SQLite 3.32
+        objs = [models.UserProfile(email=f'smith{number}@example.com', name=f'Smith {number}', password='!') for number in range(1200)]
+        models.UserProfile.objects.bulk_create(objs)
+        models.bulk_created.send(sender=models.UserProfile, objs=objs)
+
+        names = self.names('/api/profile/?search=smith')
+        self.assertEqual(len(names), search.SearchBackend.max_results)
+        self.assertEqual(len(self.names('/api/profile/autocomplete/?q=smith')), 10)
+
+
+class FeedBulkCreateTests(APITestCase):
+    """POST /api/feed/bulk/ saves a list of items at once or none of them"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = models.UserProfile.objects.create_user('test@example.com', 'Test', 'password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_bulk_create(self):
+        self.assertEqual(self.client.get('/api/feed/').data['results'], [])    # cached until bulk_created drops it
+        received = []
+
+        def collect(sender, objs, **kwargs):
+            received.extend(objs)
+        models.bulk_created.connect(collect, sender=models.ProfileFeedItem)
+        self.addCleanup(models.bulk_created.disconnect, collect, sender=models.ProfileFeedItem)
+
+        response = self.client.post('/api/feed/bulk/', [{'status_text': 'one'}, {'status_text': 'two'}], format='json')
+        self.assertEqual(response.status_code, 201)
+        saved = list(models.ProfileFeedItem.objects.order_by('id').values_list('id', 'status_text'))
+        self.assertEqual([(item['id'], item['status_text']) for item in response.data], saved)
+        self.assertEqual([obj.pk for obj in received], [pk for pk, _ in saved])
+        self.assertEqual(len(self.client.get('/api/feed/').data['results']), 2)
+
+    @override_settings(FEED_BULK_MAX_ITEMS=2)
+    def test_invalid_lists_save_nothing(self):
+        response = self.client.post('/api/feed/bulk/', [{'status_text': 'ok'}, {'status_text': ''}], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['errors'][0], {})
+        self.assertIn('status_text', response.data['errors'][1])
+        self.assertEqual(self.client.post('/api/feed/bulk/', [{'status_text': 'x'}] * 3, format='json').status_code, 400)
+        self.assertEqual(self.client.post('/api/feed/bulk/', {'status_text': 'x'}, format='json').status_code, 400)
+        self.assertFalse(models.ProfileFeedItem.objects.exists())
+
+
+class ImportUsersTests(APITestCase):
+    """import_users reports the users it really created and stops or skips on taken emails"""
+
+    def setUp(self):
+        super().setUp()
+        models.UserProfile.objects.create_user('taken@example.com', 'Taken', 'password')
+        rows = [
+            {'email': 'one@example.com', 'name': 'One', 'password': 'password'},
+            {'email': 'two@example.com', 'name': 'Two', 'password': 'password'},
+            {'email': 'taken@example.com', 'name': 'Again', 'password': 'password'},
+            {'email': 'three@example.com', 'name': 'Three', 'password': 'password'},
+        ]
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'users.jsonl')
+        with open(self.path, 'w') as stream:
+            stream.writelines(json.dumps(row) + '\n' for row in rows)
+
+    def import_users(self, *args):
+        output = io.StringIO()
+        call_command('import_users', self.path, '--batch-size', '2', '--workers', '1', *args, stdout=output)
+        return output.getvalue()
+
+    def test_conflict_stops_the_import(self):
+        with self.assertRaisesRegex(CommandError, '2 users were imported before it'):
+            self.import_users()
+        self.assertEqual(models.UserProfile.objects.count(), 3)
+        self.assertFalse(models.UserProfile.objects.filter(email='three@example.com').exists())
+
+    def test_ignore_conflicts_skips_taken_emails(self):
+        output = self.import_users('--ignore-conflicts')
+        self.assertIn('Imported 3 users', output)
+        self.assertIn('skipped 1 that already exist', output)
+        self.assertEqual(models.UserProfile.objects.get(email='taken@example.com').name, 'Taken')
+        self.assertTrue(models.UserProfile.objects.get(email='three@example.com').check_password('password'))
+
+
+class ResponseCacheTests(APITestCase):
+    """Cached responses are dropped on every write, whatever URL they were read under"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = models.UserProfile.objects.create_user('test@example.com', 'Test', 'password')
+        self.item = models.ProfileFeedItem.objects.create(user_profile=self.user, status_text='old')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def status_text(self, url):
+        return json.loads(self.client.get(url).content)['status_text']         # a cached response is a plain HttpResponse
+
+    def test_update_and_delete_invalidate(self):
+        urls = [f'/api/feed/{self.item.id}/', f'/api/feed/0{self.item.id}/']
+        for url in urls:
+            self.assertEqual(self.status_text(url), 'old')
+            self.assertEqual(self.status_text(url), 'old')                      # now from the cache
+
+        self.client.patch(urls[0], {'status_text': 'new'})
+        self.assertEqual([self.status_text(url) for url in urls], ['new', 'new'])
+        self.client.delete(urls[0])
+        self.assertEqual([self.client.get(url).status_code for url in urls], [404, 404])
+
+    def test_etag(self):
+        response = self.client.get('/api/feed/')
+        self.assertEqual(self.client.get('/api/feed/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.client.post('/api/feed/', {'status_text': 'newer'})
+        self.assertEqual(self.client.get('/api/feed/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+
+class FeedExportTests(APITestCase):
+    """The export streams the feed and answers its errors in the export format"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = models.UserProfile.objects.create_user('test@example.com', 'Test', 'password')
+        self.items = [
+            models.ProfileFeedItem.objects.create(user_profile=self.user, status_text=text)
+            for text in ('first', 'second, with a comma')
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_ndjson_and_csv(self):
+        response = self.client.get('/api/feed/export/')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([(line['id'], line['status_text']) for line in lines], [(item.id, item.status_text) for item in self.items])
+
+        response = self.client.get('/api/feed/export/?format=csv')
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows[0], ['id', 'user_profile', 'status_text', 'created_on'])
+        self.assertEqual(rows[2][2], 'second, with a comma')
+
+    def test_unauthenticated(self):
+        response = APIClient().get('/api/feed/export/')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(json.loads(response.content), {'detail': 'Authentication credentials were not provided.'})
+
+    def test_asgi(self):
+        token = Token.objects.create(user=self.user)
+        status, body = self.asgi_get('/api/feed/export/?format=csv', [('authorization', f'Token {token.key}')])
+        self.assertEqual(status, 200)
+        self.assertEqual(len(body.decode().splitlines()), 3)
+
+    def test_not_acceptable(self):
+        response = self.client.get('/api/feed/export/', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 406)
+        self.assertEqual(response.content.count(b'\n'), 1)
+
+
+class TimelineTests(APITestCase):
+    """The timelines list the posts of one user newest first"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = models.UserProfile.objects.create_user('test@example.com', 'Test', 'password')
+        self.other = models.UserProfile.objects.create_user('other@example.com', 'Other', 'password')
+        self.own = [models.ProfileFeedItem.objects.create(user_profile=self.user, status_text=f'own {number}') for number in range(3)]
+        models.ProfileFeedItem.objects.create(user_profile=self.other, status_text='not mine')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_mine_and_profile_feed(self):
+        expected = [item.id for item in reversed(self.own)]
+        mine = self.client.get('/api/feed/mine/?page_size=2')
+        self.assertEqual([item['id'] for item in mine.data['results']], expected[:2])
+        self.assertEqual([item['id'] for item in self.client.get(mine.data['next']).data['results']], expected[2:])
+
+        response = self.client.get(f'/api/profile/{self.user.id}/feed/')
+        self.assertEqual([item['id'] for item in response.data['results']], expected)
+        self.assertEqual(self.client.get('/api/profile/999/feed/').data['results'], [])
+
+    def test_query_uses_user_index(self):
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(f'/api/profile/{self.user.id}/feed/')
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {context.captured_queries[-1]["sql"]}')
+            plan = ' '.join(str(row[-1]) for row in cursor.fetchall())
+        self.assertIn('feed_user_created_on_id_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+
+class SignedTokenTests(APITestCase):
+    """Signed tokens are checked without queries, expire and can be revoked"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = models.UserProfile.objects.create_user('test@example.com', 'Test', 'password')
+        response = APIClient().post('/api/login/', {'username': 'test@example.com', 'password': 'password'})
+        self.assertEqual(response.status_code, 200)
+        self.token = response.data['signed_token']
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+    def test_warm_token_needs_no_queries(self):
+        backend = authentication.SignedTokenAuthentication()
+        backend.authenticate_credentials(self.token)
+        with self.assertNumQueries(0):
+            user, payload = backend.authenticate_credentials(self.token)
+        self.assertEqual(user.pk, self.user.pk)
+
+    def test_expired_token_is_rejected(self):
+        later = time.time() + tokens.token_ttl() + 1
+        with mock.patch('django.core.signing.time.time', return_value=later):
+            response = self.client.get('/api/feed/')
+        self.assertEqual(response.status_code, 401)
+
+    def test_old_token_is_refreshed(self):
+        later = time.time() + tokens.token_ttl() * 0.75
+        with mock.patch('time.time', return_value=later):
+            response = self.client.get('/api/feed/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('X-Refreshed-Token', response)
+
+    def test_logout_revokes_token(self):
+        self.assertEqual(self.client.get('/api/feed/').status_code, 200)
+        self.assertEqual(self.client.post('/api/logout/').status_code, 204)
+        self.assertEqual(self.client.get('/api/feed/').status_code, 401)
+        self.assertTrue(models.RevokedToken.objects.exists())
+
+    def login(self):
+        response = APIClient().post('/api/login/', {'username': 'test@example.com', 'password': 'password'})
+        bearer, token = APIClient(), APIClient()
+        bearer.credentials(HTTP_AUTHORIZATION=f'Bearer {response.data["signed_token"]}')
+        token.credentials(HTTP_AUTHORIZATION=f'Token {response.data["token"]}')
+        return bearer, token
+
+    def test_logout_everywhere(self):
+        other_device, database_token = self.login()
+        self.assertEqual(other_device.get('/api/feed/').status_code, 200)
+        self.assertEqual(database_token.get('/api/feed/').status_code, 200)
+
+        self.assertEqual(self.client.post('/api/logout/?all=1').status_code, 204)
+        for client in (self.client, other_device, database_token):
+            self.assertEqual(client.get('/api/feed/').status_code, 401)
+        self.assertEqual(self.login()[0].get('/api/feed/').status_code, 200)
+
+    def test_new_password_logs_out(self):
+        response = self.client.patch(f'/api/profile/{self.user.pk}/', {'password': 'new password'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get('/api/feed/').status_code, 401)
+
+
+class ScryptHasherTests(APITestCase):
+    """Passwords hash with scrypt and move to it on the next login"""
+
+    def test_round_trip(self):
+        encoded = make_password('password', hasher='scrypt')
+        self.assertTrue(encoded.startswith('scrypt$16384$'))
+        self.assertTrue(check_password('password', encoded))
+        self.assertFalse(check_password('wrong', encoded))
+
+        hasher = get_hasher('scrypt')
+        self.assertEqual(hasher.safe_summary(encoded)['work factor'], 2 ** 14)
+        self.assertFalse(hasher.must_update(encoded))
+        self.assertTrue(hasher.must_update(hasher.encode('password', hasher.salt(), n=2 ** 10)))
+
+    @override_settings(PASSWORD_HASHERS=['profiles_api.hashers.ScryptPasswordHasher', 'django.contrib.auth.hashers.PBKDF2PasswordHasher'])
+    def test_login_rehashes(self):
+        user = models.UserProfile.objects.create_user('test@example.com', 'Test', 'password')
+        user.password = make_password('password', hasher='pbkdf2_sha256')
+        user.save(update_fields=['password'])
+
+        response = APIClient().post('/api/login/', {'username': 'test@example.com', 'password': 'password'})
+        self.assertEqual(response.status_code, 200)
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith('scrypt$'))
+        self.assertTrue(user.check_password('password'))
+
+
+class SparseFieldsetTests(APITestCase):
+    """?fields= trims the output and the values() list matches the serializer"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = models.UserProfile.objects.create_user('test@example.com', 'Test', 'password')
+        self.item = models.ProfileFeedItem.objects.create(user_profile=self.user, status_text='hello')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_values_list_matches_model_serializer(self):
+        response = self.client.get('/api/feed/')
+        self.assertEqual(response.data['results'], [serializers.ProfileFeedItemSerializer(self.item).data])
+
+    def test_fields_limit_list_and_retrieve(self):
+        response = self.client.get('/api/feed/?fields=id,status_text')
+        self.assertEqual(response.data['results'], [{'id': self.item.id, 'status_text': 'hello'}])
+        response = self.client.get(f'/api/profile/{self.user.id}/?fields=name')
+        self.assertEqual(response.data, {'name': 'Test'})
+
+    def test_unknown_field_is_rejected(self):
+        self.assertEqual(self.client.get('/api/profile/?fields=password').status_code, 400)
+
+
+class RendererTests(APITestCase):
+    """The fast renderers give the same data as the rest framework's JSON"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = models.UserProfile.objects.create_user('test@example.com', 'Tést', 'password')
+        models.ProfileFeedItem.objects.create(user_profile=self.user, status_text='hello ✓')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_orjson_matches_json_renderer(self):
+        response = self.client.get('/api/feed/', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.content, JSONRenderer().render(response.data))
+
+    @unittest.skipUnless(renderers.msgpack, 'msgpack is not installed')
+    def test_msgpack_round_trip(self):
+        body = renderers.msgpack.packb({'status_text': 'packed'})
+        response = self.client.post('/api/feed/', body, content_type='application/msgpack', HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(renderers.msgpack.unpackb(response.content)['status_text'], 'packed')
+
+
+class FeedPushTests(APITestCase):
+    """New feed items reach the long-poll and the event stream"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = models.UserProfile.objects.create_user('test@example.com', 'Test', 'password')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.item = models.ProfileFeedItem.objects.create(user_profile=self.user, status_text='first')
+        self.broker = pubsub.get_broker()
+
+    def publish(self, status_text):
+        item = models.ProfileFeedItem.objects.create(user_profile=self.user, status_text=status_text)
+        self.broker.publish(item.id, dict(serializers.ProfileFeedItemSerializer(item).data))   # the signal only publishes on commit
+        return item
+
+    def test_poll(self):
+        response = self.client.get('/api/feed/poll/')
+        self.assertEqual(response.data, {'results': [], 'last_id': self.item.id})
+
+        response = self.client.get(f'/api/feed/poll/?since={self.item.id - 1}&timeout=0')  # a new broker can't tell, the database can
+        self.assertEqual([item['status_text'] for item in response.data['results']], ['first'])
+        response = self.client.get(f'/api/feed/poll/?since={self.item.id}&timeout=0')
+        self.assertEqual(response.data, {'results': [], 'last_id': self.item.id})
+
+        second = self.publish('second')
+        with self.assertNumQueries(0):
+            response = self.client.get(f'/api/feed/poll/?since={self.item.id}&timeout=1')
+        self.assertEqual(response.data['last_id'], second.id)
+        self.assertEqual(self.client.get('/api/feed/poll/?since=x').status_code, 400)
+
+    def test_poll_under_wsgi_returns_at_once(self):
+        self.broker.cover(self.item.id)
+        started = time.monotonic()
+        response = self.client.get(f'/api/feed/poll/?since={self.item.id}&timeout=25')
+        self.assertLess(time.monotonic() - started, 5)                          # no worker thread waits for new items
+        self.assertEqual(response.data, {'results': [], 'last_id': self.item.id})
+
+    def test_poll_under_asgi_waits(self):
+        self.broker.cover(self.item.id)
+        payload = {'id': self.item.id + 1, 'status_text': 'second'}
+        timer = threading.Timer(0.2, self.broker.publish, (payload['id'], payload))
+        timer.start()
+        try:
+            status_code, body = self.asgi_get(
+                f'/api/feed/poll/?since={self.item.id}&timeout=5', [('authorization', f'Token {self.token.key}')],
+            )
+        finally:
+            timer.join()
+        self.assertEqual(status_code, 200)
+        self.assertEqual(json.loads(body), {'results': [payload], 'last_id': payload['id']})
+
+    def test_stream_under_wsgi_ends(self):
+        second = self.publish('second')
+        self.broker.cover(self.item.id)
+        response = self.client.get('/api/feed/stream/', HTTP_LAST_EVENT_ID=str(self.item.id))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = response.content.decode()
+        self.assertTrue(body.startswith(f'retry: 3000\nid: {self.item.id}\n\n'))
+        self.assertIn(f'id: {second.id}\nevent: feed_item\n', body)
+
+    def test_stream_under_asgi_pushes(self):
+        self.broker.cover(self.item.id)
+        second = self.publish('second')
+        status_code, body = self.asgi_get(
+            f'/api/feed/stream/?since={self.item.id}', [('authorization', f'Token {self.token.key}')],
+            until=lambda body: b'event: feed_item' in body,
+        )
+        self.assertEqual(status_code, 200)
+        self.assertIn(f'id: {second.id}\nevent: feed_item\ndata: '.encode(), body)
+
+    def test_stream_errors(self):
+        status_code, body = self.asgi_get('/api/feed/stream/')
+        self.assertEqual(status_code, 401)
+        self.assertTrue(body.startswith(b'event: error\ndata: {"detail": '))
+
+    def test_cache_broker(self):
+        publisher, waiter = pubsub.CacheBroker(), pubsub.CacheBroker()          # two processes
+        self.assertIsNone(waiter.wait(0, 0))
+        waiter.cover(0)
+        self.assertEqual(waiter.wait(0, 0), [])
+        publisher.publish(1, {'id': 1})
+        publisher.publish(3, {'id': 3})
+        self.assertIsNone(waiter.wait(0, 0))                                    # 2 isn't there, the database has to tell
+        waiter.cover(1)
+        self.assertEqual(waiter.wait(0, 0), [{'id': 1}, {'id': 3}])
+        publisher.publish(4, {'id': 4})
+        self.assertEqual(async_to_sync(waiter.wait_async)(3, 1), [{'id': 4}])
+        self.assertEqual(waiter.last_id(), 4)
+
+
+class FeedArchiveTests(APITestCase):
+    """Old feed items move to the archive and stay readable with ?archived=1"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = models.UserProfile.objects.create_user('test@example.com', 'Test', 'password')
+        self.old = models.ProfileFeedItem.objects.create(user_profile=self.user, status_text='old')
+        models.ProfileFeedItem.objects.filter(pk=self.old.pk).update(created_on=timezone.now() - timedelta(days=400))
+        self.new = models.ProfileFeedItem.objects.create(user_profile=self.user, status_text='new')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_archive_moves_old_items(self):
+        self.assertEqual(len(self.client.get('/api/feed/').data['results']), 2)    # the cached page must be dropped by the archive
+        call_command('archive_feed', days=365, chunk_size=1, stdout=io.StringIO())
+
+        live = self.client.get('/api/feed/').data['results']
+        self.assertEqual([item['id'] for item in live], [self.new.id])
+        archived = self.client.get('/api/feed/?archived=1').data['results']
+        self.assertEqual([item['id'] for item in archived], [self.old.id])
+        self.assertEqual(self.client.get(f'/api/feed/{self.old.id}/?archived=1').data['status_text'], 'old')
+
+
+class AsyncViewTests(TransactionTestCase):
+    """The async views answer like their rest framework twins"""
+
+    def setUp(self):
+        super().setUp()
+        clear_caches()                                                          # the views query from their own threads, which can't see
+        self.user = models.UserProfile.objects.create_user('test@example.com', 'Test', 'password')   # inside a test transaction
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.user).key}')
+
+    def test_post_and_list_feed(self):
+        response = self.client.post('/api/async/feed/', {'status_text': 'hello'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['status_text'], 'hello')
+        with override_settings(FEED_WRITE_QUEUE=True):
+            self.assertEqual(self.client.post('/api/async/feed/', {'status_text': 'queued'}, format='json').status_code, 201)
+
+        response = self.client.get('/api/async/feed/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['status_text'] for item in response.json()['results']], ['queued', 'hello'])
+        self.assertEqual(models.UserProfile.objects.get().feed_count, 2)
+
+    def test_errors(self):
+        self.assertEqual(self.client.post('/api/async/feed/', {}, format='json').status_code, 400)
+        self.assertEqual(self.client.put('/api/async/feed/').status_code, 405)
+        self.assertEqual(self.client.get('/api/async/feed/?cursor=bad').status_code, 404)
+        self.client.credentials(HTTP_AUTHORIZATION='Token wrong')
+        self.assertEqual(self.client.get('/api/async/feed/').status_code, 401)
+        self.client.credentials()
+        self.assertEqual(self.client.get('/api/async/feed/').status_code, 401)
+
+    def test_profile_detail(self):
+        response = self.client.get(f'/api/async/profile/{self.user.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['email'], 'test@example.com')
+        self.assertEqual(self.client.get(f'/api/async/profile/{self.user.pk + 1}/').status_code, 404)
+
+
+class WriteQueueTests(TransactionTestCase):
+    """The writer thread outlives a failing batch"""
+
+    def test_queue_survives_failing_job(self):
+        user = models.UserProfile.objects.create_user('test@example.com', 'Test', 'password')
+        write_queue = writequeue.FeedWriteQueue()
+        with mock.patch.object(writequeue, 'close_old_connections', side_effect=[DatabaseError('gone'), None]):
+            with self.assertRaises(DatabaseError):
+                write_queue.submit(user, status_text='lost').result(timeout=5)
+            item = write_queue.submit(user, status_text='saved').result(timeout=5)
+        self.assertEqual(models.ProfileFeedItem.objects.get().pk, item.pk)
+
+
+class FeedArchiveFileTests(TransactionTestCase):
+    """The archive files only get their names once the chunk is committed"""
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        user = models.UserProfile.objects.create_user('test@example.com', 'Test', 'password')
+        self.old = models.ProfileFeedItem.objects.create(user_profile=user, status_text='old')
+        models.ProfileFeedItem.objects.filter(pk=self.old.pk).update(created_on=timezone.now() - timedelta(days=400))
+
+    def archive(self):
+        call_command('archive_feed', days=365, to='files', output_dir=self.directory, stdout=io.StringIO())
+
+    def test_archive_to_files(self):
+        self.archive()
+        bucket = retention.month_bucket(timezone.now() - timedelta(days=400))
+        self.assertEqual(os.listdir(self.directory), [f'feed-{bucket}.{self.old.id:010d}.ndjson.gz'])
+        with gzip.open(os.path.join(self.directory, os.listdir(self.directory)[0]), 'rt') as stream:
+            self.assertIn('"old"', stream.read())
+        self.assertFalse(models.ProfileFeedItem.objects.exists())
+
+    def test_rolled_back_chunk_leaves_no_file(self):
+        with mock.patch.object(models.DeletedFeedItem.objects, 'record', side_effect=DatabaseError('locked')):
+            with self.assertRaises(DatabaseError):
+                self.archive()
+        self.assertEqual(os.listdir(self.directory), [])
+        self.assertTrue(models.ProfileFeedItem.objects.filter(pk=self.old.pk).exists())
+
+
+class PerformanceMiddlewareTests(APITestCase):
+    """Every response is timed and the timings show up at /metrics"""
+
+    def test_server_timing_and_metrics(self):
+        user = models.UserProfile.objects.create_user('test@example.com', 'Test', 'password')
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.get('/api/feed/')
+        self.assertRegex(response['Server-Timing'], r'^app;dur=[\d.]+, db;dur=[\d.]+;desc="\d+ queries", render;dur=[\d.]+$')
+
+        body = client.get('/metrics').content.decode()
+        self.assertIn('profiles_api_request_seconds_count{view="UserProfileFeedViewSet.list"}', body)
+        self.assertIn('profiles_api_requests_total{status="2xx",view="UserProfileFeedViewSet.list"}', body)
+
+
+class MetricsSnapshotTests(APITestCase):
+    """With METRICS_DIR /metrics adds up the snapshots of every worker"""
+
+    def test_workers_add_up(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        metrics.counter('snapshot_test').inc(2)
+        metrics.histogram('snapshot_test_seconds').observe(1.0)
+        other_worker = os.path.join(directory, '1-1.json')
+        with open(other_worker, 'w') as stream:
+            json.dump({
+                'counters': [['snapshot_test', [], 3]],
+                'histograms': [['snapshot_test_seconds', [], 1, 3.0, [3.0]]],
+            }, stream)
+
+        with mock.patch.object(metrics, '_snapshot_path', os.path.join(directory, f'{os.getpid()}-2.json')):
+            body = metrics.render_prometheus()
+            self.assertEqual(len(os.listdir(directory)), 2)                     # our own snapshot is written first
+            self.assertIn('profiles_api_snapshot_test_total 5\n', body)
+            self.assertIn('profiles_api_snapshot_test_seconds_sum 4.0\n', body)
+            self.assertIn('profiles_api_snapshot_test_seconds{quantile="0.99"} 3.0\n', body)
+
+            os.utime(other_worker, (0, 0))                                      # a worker that's long gone
+            body = metrics.render_prometheus()
+            self.assertIn('profiles_api_snapshot_test_seconds_count 2\n', body)
+            self.assertIn('profiles_api_snapshot_test_seconds{quantile="0.99"} 1.0\n', body)
+
+    def test_dead_workers_are_retired(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.addCleanup(metrics._retired.clear)
+        metrics.counter('retire_test').inc(2)
+        for number in range(3):                                                 # restarted workers, no pid is that high
+            with open(os.path.join(directory, f'{2 ** 22 + 1 + number}-1.json'), 'w') as stream:
+                json.dump({
+                    'counters': [['retire_test', [], 3]],
+                    'histograms': [['retire_test_seconds', [], 1, 3.0, [3.0]]],
+                }, stream)
+
+        own = os.path.join(directory, f'{os.getpid()}-2.json')
+        with mock.patch.object(metrics, '_snapshot_path', own):
+            for _ in range(2):                                                  # the second scrape must not count them again
+                body = metrics.render_prometheus()
+                self.assertEqual(os.listdir(directory), [os.path.basename(own)])
+                self.assertIn('profiles_api_retire_test_total 11\n', body)
+                self.assertIn('profiles_api_retire_test_seconds_count 3\n', body)
+
+
+class BenchmarkCompareTests(APITestCase):
+    """Only results slower than the threshold count as regressions"""
+
+    def test_compare(self):
+        baseline = {'results': {'feed': {'value': 1.0}, 'login': {'value': 2.0}, 'gone': {'value': 1.0}}}
+        current = {'results': {'feed': {'value': 1.5}, 'login': {'value': 2.2}, 'new': {'value': 9.0}}}
+        regressions = benchmarks.compare(baseline, current, threshold=0.2)
+        self.assertEqual([(name, change) for name, old, new, change in regressions], [('feed', 0.5)])
+
+    def test_errors_fail_the_comparison(self):
+        baseline = {'results': {'feed': {'value': 1.0, 'errors': 0}, 'login': {'value': 2.0, 'errors': 3}}}
+        current = {'results': {'feed': {'value': 0.5, 'errors': 10}, 'login': {'value': 2.0, 'errors': 0}, 'micro': {'value': 1.0}}}
+        self.assertEqual(benchmarks.compare_errors(baseline, current), [('feed', 0, 10), ('login', 3, 0)])
+        self.assertEqual(benchmarks.compare_errors(current, baseline), [('feed', 10, 0), ('login', 0, 3)])
+
+    def test_factories_are_deterministic(self):
+        self.assertEqual(list(factories.user_rows(5, seed=1)), list(factories.user_rows(5, seed=1)))
+
+
+class ThrottleTests(APITestCase):
+    """An empty bucket answers 429 and a saturated process 503"""
+
+    @override_settings(THROTTLE_BUCKETS={'user': (1, 2), 'anon': (1, 2), 'login': (1, 2)})
+    def test_user_bucket(self):
+        user = models.UserProfile.objects.create_user('test@example.com', 'Test', 'password')
+        client = APIClient()
+        client.force_authenticate(user)
+        self.assertEqual([client.get('/api/feed/').status_code for _ in range(3)], [200, 200, 429])
+        self.assertIn('Retry-After', client.get('/api/feed/'))
+
+    def test_shared_buckets_are_atomic(self):
+        store = throttling.CacheBucketStore('default')
+        results = []
+        with mock.patch.object(throttling.time, 'time', return_value=1000.0):  # all in one window
+            workers = [
+                threading.Thread(target=lambda: results.append(store.take('user:1', rate=0.01, burst=5)))
+                for _ in range(20)
+            ]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        self.assertEqual(sorted(allowed for allowed, wait in results), [False] * 15 + [True] * 5)
+        self.assertEqual(max(wait for allowed, wait in results), 500.0)
+
+    @override_settings(ADMISSION_MAX_CONCURRENCY=1, ADMISSION_MAX_QUEUE=0)
+    def test_admission_control(self):
+        middleware = AdmissionControlMiddleware(lambda request: middleware(request))   # a request that arrives while the first still runs
+        self.assertEqual(middleware(RequestFactory().get('/api/feed/')).status_code, 503)
+
+
+class FeedCounterTests(APITestCase):
+    """Every write of the feed keeps the counters of the profile in step"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = models.UserProfile.objects.create_user('test@example.com', 'Test', 'password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def counters(self):
+        self.user.refresh_from_db()
+        return self.user.feed_count, self.user.last_status
+
+    def test_create_bulk_and_delete(self):
+        first = self.client.post('/api/feed/', {'status_text': 'first'}).data
+        self.client.post('/api/feed/bulk/', [{'status_text': 'second'}, {'status_text': 'third'}], format='json')
+        self.assertEqual(self.counters(), (3, 'third'))
+
+        latest = models.ProfileFeedItem.objects.order_by('-id').first()
+        self.client.delete(f'/api/feed/{latest.id}/')
+        self.assertEqual(self.counters(), (2, 'second'))
+        self.client.delete(f'/api/feed/{first["id"]}/')
+        self.assertEqual(self.counters(), (1, 'second'))
+
+        response = self.client.get(f'/api/profile/{self.user.id}/')
+        self.assertEqual(response.data['feed_count'], 1)
+        self.assertEqual(response.data['last_status'], 'second')
+
+    def test_repair(self):
+        models.ProfileFeedItem.objects.create(user_profile=self.user, status_text='missed')   # saved around the counters
+        self.assertEqual(models.UserProfile.objects.repair_feed_counters(), 1)
+        self.assertEqual(self.counters(), (1, 'missed'))
+        self.assertEqual(models.UserProfile.objects.repair_feed_counters(), 0)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'], REPLICA_STICKY_SECONDS=5)
+class ReplicaRoutingTests(APITestCase):
+    """Safe requests read from a replica until their client writes"""
+
+    def setUp(self):
+        super().setUp()
+        routers.pin_cache().clear()
+        self.router = routers.ReplicaRouter()
+        self.seen = []
+        self.middleware = ReplicaRoutingMiddleware(self.read_alias)
+
+    def read_alias(self, request):
+        self.seen.append(self.router.db_for_read(models.UserProfile))
+        if request.method == 'POST':
+            self.router.db_for_write(models.UserProfile)
+            self.seen.append(self.router.db_for_read(models.UserProfile))      # reads after a write in the same request
+        return HttpResponse()
+
+    def test_read_your_writes(self):
+        factory = RequestFactory()
+        self.middleware(factory.get('/api/profile/', HTTP_AUTHORIZATION='Token a', REMOTE_ADDR='10.0.0.1'))
+        self.middleware(factory.post('/api/feed/', HTTP_AUTHORIZATION='Token a', REMOTE_ADDR='10.0.0.1'))
+        self.middleware(factory.get('/api/feed/', HTTP_AUTHORIZATION='Token a', REMOTE_ADDR='10.0.0.1'))
+        self.middleware(factory.get('/api/feed/', HTTP_AUTHORIZATION='Token b', REMOTE_ADDR='10.0.0.2'))
+        self.assertEqual(self.seen, ['replica1', 'default', 'default', 'default', 'replica1'])
+        self.assertEqual(self.router.db_for_read(models.UserProfile), 'default')   # outside of a request
+
+
+@override_settings(
+    DATABASE_REPLICAS=['replica1'], DATABASE_ROUTERS=['profiles_api.routers.ReplicaRouter'], REPLICA_STICKY_SECONDS=5,
+)
+class ReplicaResponseCacheTests(TransactionTestCase):
+    """A page read from a lagging replica is never cached under a new version"""
+
+    def setUp(self):
+        super().setUp()
+        clear_caches()
+        self.writer = models.UserProfile.objects.create_user('writer@example.com', 'Writer', 'password')
+        self.reader = models.UserProfile.objects.create_user('reader@example.com', 'Reader', 'password')
+        models.ProfileFeedItem.objects.create(user_profile=self.writer, status_text='first')
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        replica = sqlite3.connect(os.path.join(directory, 'replica.sqlite3'))
+        connection.ensure_connection()
+        connection.connection.backup(replica)                                   # a replica that stops here, it never sees what comes next
+        replica.close()
+        connections.databases['replica1'] = {**connections.databases['default'], 'NAME': os.path.join(directory, 'replica.sqlite3')}
+        self.addCleanup(connections.databases.pop, 'replica1')
+        self.addCleanup(lambda: connections['replica1'].close())
+
+    def client_for(self, user, address):
+        client = APIClient(REMOTE_ADDR=address)
+        client.force_authenticate(user)
+        return client
+
+    def test_writer_reads_its_write(self):
+        writer = self.client_for(self.writer, '10.0.0.1')
+        reader = self.client_for(self.reader, '10.0.0.2')
+        self.assertEqual(writer.post('/api/feed/', {'status_text': 'second'}).status_code, 201)
+
+        stale = reader.get('/api/feed/').json()['results']                     # from the replica, which lags
+        self.assertEqual([item['status_text'] for item in stale], ['first'])
+        fresh = writer.get('/api/feed/').json()['results']                      # pinned to the primary, the stale page wasn't cached
+        self.assertEqual([item['status_text'] for item in fresh], ['second', 'first'])
+
+
+class DeltaSyncTests(APITestCase):
+    """Clients fetch only what changed in the feed and hear about deletions"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = models.UserProfile.objects.create_user('test@example.com', 'Test', 'password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    @override_settings(FEED_CHANGES_OVERLAP=0)
+    def test_changes_after_cursor(self):
+        kept = self.client.post('/api/feed/', {'status_text': 'kept'}).data
+        gone = self.client.post('/api/feed/', {'status_text': 'gone'}).data
+        first = self.client.get('/api/feed/changes/').data
+        self.assertEqual([item['id'] for item in first['changed']], [kept['id'], gone['id']])
+
+        up_to_date = self.client.get('/api/feed/changes/', {'since': first['cursor']}).data
+        self.assertEqual((up_to_date['changed'], up_to_date['deleted']), ([], []))
+
+        self.client.patch(f'/api/feed/{kept["id"]}/', {'status_text': 'edited'})
+        self.client.delete(f'/api/feed/{gone["id"]}/')
+        delta = self.client.get('/api/feed/changes/', {'since': first['cursor']}).data
+        self.assertEqual([item['status_text'] for item in delta['changed']], ['edited'])
+        self.assertEqual(delta['deleted'], [gone['id']])
+
+    def test_late_commit_is_not_skipped(self):
+        early = models.ProfileFeedItem.objects.create(user_profile=self.user, status_text='early')
+        first = self.client.get('/api/feed/changes/').data
+        self.assertEqual([item['id'] for item in first['changed']], [early.id])
+
+        late = models.ProfileFeedItem.objects.create(user_profile=self.user, status_text='late')
+        stamped = early.updated_on - timedelta(milliseconds=1)                  # stamped before the early one, committed after it
+        models.ProfileFeedItem.objects.filter(pk=late.pk).update(updated_on=stamped)
+        delta = self.client.get('/api/feed/changes/', {'since': first['cursor']}).data
+        self.assertEqual([item['id'] for item in delta['changed']], [late.id, early.id])   # the client already has early, it just applies it again
+        self.assertFalse(delta['more'])
+
+    @override_settings(FEED_TOMBSTONE_DAYS=1)
+    def test_old_cursor_is_gone(self):
+        since = (timezone.now() - timedelta(days=2)).isoformat()
+        self.assertEqual(self.client.get('/api/feed/changes/', {'since': since}).status_code, 410)
+
+    def test_if_modified_since(self):
+        now = time.time()
+        self.client.post('/api/feed/', {'status_text': 'first'})
+        with mock.patch('time.time', return_value=now + 2):                     # Last-Modified is only sent once its second is over
+            response = self.client.get('/api/feed/')
+            self.assertEqual(self.client.get('/api/feed/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+        with mock.patch('time.time_ns', return_value=int((now + 3) * 1e9)):
+            self.client.post('/api/feed/', {'status_text': 'second'})
+        self.assertEqual(self.client.get('/api/feed/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 200)
+
+
+class ImportTimeTests(unittest.TestCase):
+    """The import profile runs in a fresh interpreter and covers every new module"""
+
+    def test_profile_module(self):
+        output = io.StringIO()
+        call_command('importtime', '--module', 'profiles_api.metrics', '--json', stdout=output)
+        profile = json.loads(output.getvalue())
+        modules = {module['name']: module for module in profile['modules']}
+        self.assertIn('profiles_api.metrics', modules)
+        self.assertGreaterEqual(modules['profiles_api.metrics']['seconds'], modules['profiles_api.metrics']['self_seconds'])
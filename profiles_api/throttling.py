@@ -0,0 +1,164 @@
+# rate limiting with token buckets... every client (a user, or an IP address
+# for anonymous requests and the login) has a bucket that refills at a steady
+# rate up to a burst size, a request takes one token and when the bucket is
+# empty the request gets a 429 with Retry-After
+#
+# the buckets live in a plain dictionary of the process: a bucket is one tuple
+# that is read, worked out and written back without a lock, two threads
+# racing on the same bucket can at worst let one extra request through, which
+# is a fair price for never making a request wait on a lock... with more than
+# one process THROTTLE_CACHE_ALIAS names a shared cache instead, where a read
+# and a write would let every process take the same token, so there the
+# buckets become fixed windows counted with the atomic incr() of the cache
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import BaseThrottle
+
+
+class LocalBucketStore:
+    """Token buckets in a dictionary of this process"""
+
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self._buckets = {}                                                      # key -> (tokens, updated at, full at)
+
+    def take(self, key, rate, burst):
+        """Take a token from the bucket, return (allowed, seconds until the next token)
+
+        The bucket holds (tokens, updated at, full at) so a full bucket can be
+        recognised and dropped without working out its tokens.
+        """
+        now = time.time()
+        bucket = self.get(key)
+        if bucket is None:
+            tokens = burst
+        else:
+            tokens, updated_at, full_at = bucket
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+
+        if tokens < 1:
+            return False, (1 - tokens) / rate
+        tokens -= 1
+        refill = (burst - tokens) / rate
+        self.set(key, (tokens, now, now + refill), timeout=int(refill) + 1)
+        return True, 0
+
+    def get(self, key):
+        return self._buckets.get(key)
+
+    def set(self, key, bucket, timeout):
+        if len(self._buckets) >= self.max_size and key not in self._buckets:   # forget the buckets that have filled up again, they're the
+            self.prune()                                                        # same as a new one, and if that's not enough the oldest
+            if len(self._buckets) >= self.max_size:
+                self._buckets.pop(next(iter(self._buckets)), None)
+        self._buckets[key] = bucket
+
+    def prune(self):
+        now = time.time()
+        for key, (tokens, updated_at, full_at) in list(self._buckets.items()):
+            if full_at <= now:
+                self._buckets.pop(key, None)
+
+    def clear(self):
+        self._buckets = {}
+
+
+class CacheBucketStore:
+    """Buckets in a cache shared by the processes, as fixed windows
+
+    A window lasts burst / rate seconds and lets burst requests through, the
+    same average rate as the bucket (a client can get up to two bursts in a
+    row at the edge of a window). add() starts the count of a window and
+    incr() is atomic in memcached, so no two processes get the same request.
+    """
+
+    def __init__(self, alias):
+        self.cache = caches[alias]
+
+    def take(self, key, rate, burst):
+        """Count a request in the current window, return (allowed, seconds until the window ends)"""
+        window = burst / rate
+        now = time.time()                                                       # wall clock, the shared cache is read by other machines too
+        number = int(now // window)
+        cache_key = f'profiles_api:throttle:{key}:{number}'
+        timeout = int(window) + 1
+        if self.cache.add(cache_key, 1, timeout):
+            count = 1
+        else:
+            try:
+                count = self.cache.incr(cache_key)
+            except ValueError:                                                  # it expired in between, the window is over
+                self.cache.add(cache_key, 1, timeout)
+                count = 1
+        if count > burst:
+            return False, (number + 1) * window - now
+        return True, 0
+
+
+local_store = LocalBucketStore()
+
+
+def bucket_store():
+    alias = getattr(settings, 'THROTTLE_CACHE_ALIAS', None)
+    return CacheBucketStore(alias) if alias else local_store
+
+
+def check(scope, key):
+    """Take a token from the client's bucket of the scope, return None or the seconds to wait"""
+    if not getattr(settings, 'THROTTLE_ENABLED', True):
+        return None
+    rate, burst = settings.THROTTLE_BUCKETS[scope]
+    if not rate:
+        return None
+    allowed, wait = bucket_store().take(f'{scope}:{key}', rate, burst)
+    return None if allowed else wait
+
+
+class BucketThrottle(BaseThrottle):
+    """Token bucket throttle, the rate and burst of its scope come from THROTTLE_BUCKETS"""
+
+    scope = None
+
+    def get_cache_key(self, request, view):
+        """Return the key of the client's bucket or None to let the request through"""
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        key = self.get_cache_key(request, view)
+        if key is None:
+            return True
+        self.retry_after = check(self.scope, key)
+        return self.retry_after is None
+
+    def wait(self):
+        return self.retry_after
+
+
+class UserBucketThrottle(BucketThrottle):
+    """One bucket per logged in user"""
+    scope = 'user'
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return request.user.pk
+        return None
+
+
+class IPBucketThrottle(BucketThrottle):
+    """One bucket per IP address for anonymous requests"""
+    scope = 'anon'
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return None
+        return self.get_ident(request)
+
+
+class LoginBucketThrottle(BucketThrottle):
+    """A small bucket per IP address for the login, which costs a password hash"""
+    scope = 'login'
+
+    def get_cache_key(self, request, view):
+        return self.get_ident(request)
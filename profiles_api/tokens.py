@@ -0,0 +1,123 @@
+# signed, self-verifying access tokens... the token carries the user ID, a
+# random token ID and the time it was issued, and it's signed with the
+# SECRET_KEY, so checking it is an HMAC and a clock check instead of a query
+#
+# revoked tokens are kept in the RevokedToken table until they'd expire and in
+# a compact set of token IDs in memory, which picks up rows added by other
+# processes every REVOCATION_REFRESH seconds... to log a user out everywhere
+# revoke_user() bumps the token generation of the user instead, every token
+# carries the generation it was issued in and older ones are turned away
+import secrets
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core import signing
+from django.db.models import F
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from profiles_api import models
+
+
+SALT = 'profiles_api.tokens'
+
+
+def token_ttl():
+    return getattr(settings, 'SIGNED_TOKEN_TTL', 3600)
+
+
+def issue_token(user):
+    """Return a new signed token for the user"""
+    payload = {
+        'u': user.pk,
+        'j': secrets.token_urlsafe(12),
+        'i': int(time.time()),
+        'g': user.token_generation,
+    }
+    return signing.dumps(payload, salt=SALT)
+
+
+def read_token(token):
+    """Return the payload of a valid, unexpired and unrevoked token
+
+    Raises signing.BadSignature (or its subclass SignatureExpired) otherwise.
+    """
+    payload = signing.loads(token, salt=SALT, max_age=token_ttl())
+    if revocations.is_revoked(payload['j']):
+        raise signing.BadSignature('Token has been revoked')
+    return payload
+
+
+def should_refresh(payload):
+    """Whether the token is old enough to be swapped for a fresh one"""
+    age = time.time() - payload['i']
+    return age > token_ttl() * getattr(settings, 'SIGNED_TOKEN_REFRESH_AFTER', 0.5)
+
+
+def revoke(payload):
+    """Revoke the token the payload came from"""
+    expires_on = timezone.now() + timedelta(seconds=token_ttl() - (time.time() - payload['i']))
+    models.RevokedToken.objects.get_or_create(jti=payload['j'], defaults={'expires_on': expires_on})
+    revocations.add(payload['j'], expires_on.timestamp())
+
+
+def is_current(payload, user):
+    """Whether the token was issued after the last revoke_user() of its user"""
+    return payload.get('g', 0) == user.token_generation                         # the tokens from before the generations count as 0
+
+
+def revoke_user(user):
+    """Revoke every token of the user, signed and database ones"""
+    user.token_generation = F('token_generation') + 1
+    user.save(update_fields=['token_generation'])                               # the post_save signal drops the cached user in every tier
+    user.refresh_from_db(fields=['token_generation'])
+    Token.objects.filter(user=user).delete()
+
+
+class RevocationList:
+    """Token IDs that were revoked, refreshed from the database now and then"""
+
+    def __init__(self):
+        self._ids = {}                                                          # token ID -> when it would have expired (epoch seconds)
+        self._last_pk = 0
+        self._refreshed_at = None
+        self._lock = threading.Lock()
+
+    def add(self, jti, expires_at):
+        with self._lock:
+            self._ids[jti] = expires_at
+
+    def is_revoked(self, jti):
+        refresh_every = getattr(settings, 'REVOCATION_REFRESH', 30)
+        if self._refreshed_at is None or time.monotonic() - self._refreshed_at > refresh_every:
+            self.refresh()
+        return jti in self._ids
+
+    def refresh(self):
+        """Load the revocations added since the last refresh"""
+        rows = list(
+            models.RevokedToken.objects.filter(pk__gt=self._last_pk, expires_on__gt=timezone.now())
+            .order_by('pk')
+            .values_list('pk', 'jti', 'expires_on')
+        )
+        now = time.time()
+        with self._lock:
+            for pk, jti, expires_on in rows:
+                self._ids[jti] = expires_on.timestamp()
+                self._last_pk = pk
+            self._ids = {                                                       # expired tokens fail the signature check anyway
+                jti: expires_at for jti, expires_at in self._ids.items() if expires_at > now
+            }
+            self._refreshed_at = time.monotonic()
+
+    def clear(self):
+        """Forget everything, the next check loads the list again"""
+        with self._lock:
+            self._ids = {}
+            self._last_pk = 0
+            self._refreshed_at = None
+
+
+revocations = RevocationList()
@@ -2,6 +2,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from profiles_api import views
+from profiles_api import async_views
 
 router = DefaultRouter()                                                        # we assign the router to a variable
 router.register('hello-viewset', views.HelloViewSet, basename='hello-viewset')  # then we register specific view sets with our router
@@ -16,6 +17,10 @@ router.register('feed', views.UserProfileFeedViewSet)
 urlpatterns = [
     path('hello-view/',views.HelloApiView.as_view()),
     path('login/', views.UserLoginApiView.as_view()),
+    path('logout/', views.LogoutApiView.as_view()),                             # revokes the token the request was sent with (?all=1 every token)
+    path('login/stats/', views.LoginStatsApiView.as_view()),                     # login latency percentiles of the process (staff only)
+    path('async/feed/', async_views.feed),                                      # async versions of the feed list/create and profile retrieve handlers,
+    path('async/profile/<int:pk>/', async_views.profile_detail),                # best served through ASGI (profiles_project/asgi.py)
     path('', include(router.urls)),                                             # as we register new routes with our router it generates a list of URLs that
 ]                                                                               # are associated for our view set...                                                                               # it figures out the URLs that are required
                                                                                 # for all of the functions that we add to our view set and then it
@@ -2,32 +2,113 @@ from rest_framework.views import APIView
 from rest_framework.response import Response                                    # Response object returns responses from APIView so when we call the APIView we expect the standard Response object to be returned
 from rest_framework import status                                               # the status object from rest framework is a list of handy HTTP codes that we can use when returning responses from our API... we use them in POST handler
 from rest_framework import viewsets
-from rest_framework import filters                                              # we can use it to add filtering to a view set by in the user profile view set below the permissions classes list
-                                                                                # we add a new class variable called filter_backends
-
-from rest_framework.authentication import TokenAuthentication                   # the token authentication is going to be the type of
-                                                                                # authentication we use for users to authenticate themselves with our API it
-                                                                                # works by generating a random token string when the user logs in and then
-                                                                                # every request we make to their API that we need to authenticate we add this
-                                                                                # token string to the request and that's effectively a password to check that
-                                                                                # every request made is authenticated correctly
 
 from rest_framework.authtoken.views import ObtainAuthToken                      # we're going to use token authentication it works by generating a token which is like a
                                                                                 # random string when we log in and then every request we make to the API that
                                                                                 # we wish to authenticate we include this token in the headers
 from rest_framework.settings import api_settings
-from rest_framework.permissions import IsAuthenticated
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
+from django.db import transaction
+from django.db.models import Max
+import json
+import time
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
+from rest_framework.authtoken.models import Token
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 
 
 from profiles_api import serializers                                             # serializers is the module that we created in our profiles API project... by this we're going to tell our API view what data to expect when making post, put and patch requests
 from profiles_api import models
 from profiles_api import permissions
+from profiles_api import pagination
+from profiles_api import search
+from profiles_api import sync
+from profiles_api import caching
+from profiles_api import fieldsets
+from profiles_api import renderers
+from profiles_api import pubsub
+from profiles_api import async_views
+from profiles_api import metrics
+from profiles_api import throttling
+from profiles_api import tokens
+from profiles_api.exceptions import ServiceUnavailable
+from profiles_api import authentication                                         # the token authentication is going to be the type of
+                                                                                # authentication we use for users to authenticate themselves with our API it
+                                                                                # works by generating a random token string when the user logs in and then
+                                                                                # every request we make to their API that we need to authenticate we add this
+                                                                                # token string to the request and that's effectively a password to check that
+                                                                                # every request made is authenticated correctly... our CachedTokenAuthentication
+                                                                                # remembers recent token lookups so we don't hit the database every request
 
 
 # now we create the APIView class:
 # each view expects a function for the different HTTP requests that can be made
 # for the view
 
+def timeline_response(view, request, user_profile_id):
+    """Return a page of the feed items of one user, newest first"""
+    values_serializer = serializers.ValuesSerializer(serializers.ProfileFeedItemSerializer)
+    queryset = models.ProfileFeedItem.objects.filter(                           # this is a range read on the (user_profile, created_on, id) index
+        user_profile_id=user_profile_id
+    ).values(*values_serializer.columns)
+    paginator = pagination.FeedCursorPagination()
+    page = paginator.paginate_queryset(queryset, request, view)
+    return paginator.get_paginated_response(values_serializer.serialize(page))
+
+
+def read_feed_items(broker, since, limit):
+    """Read the feed items newer than since from the database"""
+    items = models.ProfileFeedItem.objects.filter(id__gt=since).order_by('id')
+    items = items.only(*serializers.ProfileFeedItemSerializer.Meta.fields)[:limit]
+    payloads = serializers.ProfileFeedItemSerializer(items, many=True).data
+    if not payloads:
+        broker.cover(since)                                                     # from now on the broker can tell
+    return payloads
+
+
+def new_feed_items(since, timeout, limit=100):
+    """Wait up to timeout for feed items newer than since and return them"""
+    broker = pubsub.get_broker()
+    payloads = broker.wait(since, timeout)                                      # normally we just wait on the broker without touching the database
+    if payloads is None:                                                        # but when the broker can't tell what happened after since (the
+        payloads = read_feed_items(broker, since, limit)                        # process just started or since is too old) we read the database once
+        if not payloads:
+            payloads = broker.wait(since, timeout) or []
+    return payloads[:limit]
+
+
+async def new_feed_items_async(since, timeout, limit=100):
+    """new_feed_items() for the event loop, the database is read in the pool of the async views"""
+    broker = pubsub.get_broker()
+    payloads = await broker.wait_async(since, timeout)
+    if payloads is None:
+        payloads = await async_views.run_db(read_feed_items, broker, since, limit)
+        if not payloads:
+            payloads = await broker.wait_async(since, timeout) or []
+    return payloads[:limit]
+
+
+def poll_data(since, results):
+    """Return the long-poll answer for the feed items newer than since"""
+    return {'results': results, 'last_id': results[-1]['id'] if results else since}
+
+
+def feed_event(payload):
+    """Return a feed item as a server-sent event"""
+    return f'id: {payload["id"]}\nevent: feed_item\ndata: {json.dumps(payload)}\n\n'
+
+
+def latest_feed_item_id():
+    """Return the ID of the newest feed item (0 when there are none)"""
+    last_id = pubsub.get_broker().last_id()
+    if last_id is None:
+        last_id = models.ProfileFeedItem.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+    return last_id
+
+
 class HelloApiView(APIView):                                                    # this creates class based on APIView class that django rest framework provides
     """Test API View"""                                                         # and it allows us to define the application logic for our endpoint that we're gonna assign to this view
                                                                                 # the way it works is we define a URL which is our endpoint and we assing to this view and the django handles it
@@ -189,10 +270,11 @@ class HelloViewSet(viewsets.ViewSet):
 # update function that we defined
 
 
-class UserProfileViewSet(viewsets.ModelViewSet):                                # the model view set is very similar to a standard view set
-    """Handle creating and updating profiles"""                                 # except it's specifically designed for managing models through
-                                                                                # our API so it has a lot of the functionality that we
-                                                                                # need for managing models built into it
+class UserProfileViewSet(caching.CachedResponseMixin, fieldsets.SparseFieldsetMixin, viewsets.ModelViewSet):  # the model view set is very similar
+    """Handle creating and updating profiles"""                                 # to a standard view set except it's specifically designed for managing models
+                                                                                # through our API so it has a lot of the functionality that we
+                                                                                # need for managing models built into it... the SparseFieldsetMixin
+                                                                                # adds ?fields= and lists the profiles straight from values()
     serializer_class = serializers.UserProfileSerializer
     queryset = models.UserProfile.objects.all()                                 # we're provideing the query set then Django rest framework can figure out the name from the model that's assigned to it
 
@@ -201,10 +283,11 @@ class UserProfileViewSet(viewsets.ModelViewSet):
 # set to the model view set so it knows which objects in the database are going
 # to be managed through this view set
 
-    authentication_classes = (TokenAuthentication,)                             # we can configure one or more types of
-                                                                                # authentication with a particular view set in the Django rest framework the way
-                                                                                # it works is we just add all the authentication classes to this
-                                                                                # authentication classes class variable
+    authentication_classes = (                                                  # we can configure one or more types of
+        authentication.SignedTokenAuthentication,                               # authentication with a particular view set in the Django rest framework the way
+        authentication.CachedTokenAuthentication,                               # it works is we just add all the authentication classes to this
+    )                                                                           # authentication classes class variable... "Bearer <signed token>" is
+                                                                                # checked without a query, "Token <key>" is the older database token
 
     permission_classes = (permissions.UpdateOwnProfile,)
 
@@ -216,10 +299,28 @@ class UserProfileViewSet(viewsets.ModelViewSet):
 # and it checks "has-object-permissions" function to see whether the
 # user has permissions to perform the action they're trying to perform
 
-    filter_backends = (filters.SearchFilter,)                                   # it will add a filter back end and we can add one or more filter back ends to a particular
+    filter_backends = (search.ProfileSearchFilter,)                             # it will add a filter back end and we can add one or more filter back ends to a particular
     search_fields = ('name', 'email',)                                          # view set we're going to add a filter back end for the search filter
                                                                                 # then we'll specify the search fields name and email this will mean that the Django rest framework will
                                                                                 # allow us to search for items in this view set by the name or email field
+                                                                                # the ProfileSearchFilter is the rest framework's SearchFilter running on a
+                                                                                # search index (FTS5 on SQLite, trigrams on Postgres) so results are ranked
+                                                                                # and we don't scan the whole table with LIKE '%x%'
+
+    @action(detail=True, permission_classes=(IsAuthenticated,))
+    def feed(self, request, pk=None):
+        """Return the latest feed items of the profile"""
+        return timeline_response(self, request, pk)                             # we don't load the profile itself, an unknown ID just has an empty timeline
+
+    @action(detail=False)
+    def autocomplete(self, request):
+        """Return the best profiles whose name or email starts with ?q="""
+        prefix = request.query_params.get('q', '').strip()
+        if not prefix:
+            return Response([])
+        profiles = search.get_backend().autocomplete(self.get_queryset(), prefix)
+        serializer = self.get_serializer(profiles, many=True)
+        return Response(serializer.data)
 
 class UserLoginApiView(ObtainAuthToken):
     """Handling creating user authentication tokens"""
@@ -233,13 +334,86 @@ class UserLoginApiView(ObtainAuthToken):
 
     renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES                    # it adds the renderer classes to our obtain auth token view
                                                                                 # which will enable it in the Django admin
-
-
-class UserProfileFeedViewSet(viewsets.ModelViewSet):
-    """Handles creating, reading and updating profile feed items"""
-    authentication_classes = (TokenAuthentication,)
+    serializer_class = serializers.LoginSerializer                              # checks the password in the bounded login pool (see hashing.py)
+    throttle_classes = (throttling.LoginBucketThrottle,)                        # a few logins per address, every one of them hashes a password
+
+    def post(self, request, *args, **kwargs):
+        """Log the user in and return their token, timing every attempt"""
+        started = time.perf_counter()
+        outcome = 'error'
+        try:
+            serializer = self.get_serializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            user = serializer.validated_data['user']
+            token, created = Token.objects.get_or_create(user=user)             # the database token ("Token <key>") is still handed out for
+            if not created and authentication.token_expired(token):             # older clients, a user gets the one they have back unless it's
+                token.delete()                                                  # older than AUTH_TOKEN_TTL, then it's swapped for a new one
+                token = Token.objects.create(user=user)
+            outcome = 'success'
+            return Response({
+                'token': token.key,
+                'signed_token': tokens.issue_token(user),                       # send it as "Authorization: Bearer <signed_token>"
+                'expires_in': tokens.token_ttl(),
+            })
+        except ValidationError:
+            outcome = 'invalid'
+            raise
+        except ServiceUnavailable:
+            outcome = 'rejected'
+            raise
+        finally:
+            metrics.histogram('login_seconds').observe(time.perf_counter() - started)
+            metrics.counter(f'login_{outcome}').inc()
+
+
+class LogoutApiView(APIView):
+    """Revoke the token the request was authenticated with, or with ?all=1 every token of the user"""
+    authentication_classes = (authentication.SignedTokenAuthentication, authentication.CachedTokenAuthentication)
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request, format=None):
+        if request.query_params.get('all') == '1':
+            tokens.revoke_user(request.user)
+        elif isinstance(request.auth, Token):
+            request.auth.delete()                                               # the post_delete signal drops it from the token caches
+        else:
+            tokens.revoke(request.auth)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class LoginStatsApiView(APIView):
+    """Report the login latency percentiles of this process"""
+    authentication_classes = (authentication.SignedTokenAuthentication, authentication.CachedTokenAuthentication)
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request, format=None):
+        latency = metrics.histogram('login_seconds')
+        percentiles = latency.percentiles(0.5, 0.95, 0.99)
+        return Response({
+            'count': latency.count,
+            'p50_ms': None if percentiles[0.5] is None else round(percentiles[0.5] * 1000, 2),
+            'p95_ms': None if percentiles[0.95] is None else round(percentiles[0.95] * 1000, 2),
+            'p99_ms': None if percentiles[0.99] is None else round(percentiles[0.99] * 1000, 2),
+            'outcomes': {
+                outcome: metrics.counter(f'login_{outcome}').value
+                for outcome in ('success', 'invalid', 'rejected', 'error')
+            },
+        })
+
+
+def prometheus_metrics(request):
+    """Serve the metrics of this process in the Prometheus text format"""
+    return HttpResponse(metrics.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class UserProfileFeedViewSet(caching.CachedResponseMixin, fieldsets.SparseFieldsetMixin, viewsets.ModelViewSet):  # the CachedResponseMixin
+    """Handles creating, reading and updating profile feed items"""              # keeps the rendered list and retrieve responses in the cache until a
+                                                                                # feed item is saved or deleted, the SparseFieldsetMixin adds ?fields=
+    authentication_classes = (authentication.SignedTokenAuthentication, authentication.CachedTokenAuthentication)
     serializer_class = serializers.ProfileFeedItemSerializer
     queryset = models.ProfileFeedItem.objects.all()
+    pagination_class = pagination.FeedCursorPagination                          # the feed is paginated with a cursor on (created_on, id) so a list call
+                                                                                # never serializes the whole table and never uses OFFSET to skip rows
     permission_classes = (
         permissions.UpdateOwnStatud,                                            # this will make sure that a
         IsAuthenticated                                                         # user must be authenticated to perform any request that is not a read request
@@ -249,6 +423,50 @@ class UserProfileFeedViewSet(viewsets.ModelViewSet):
                                                                                 # only update statuses where the user profile is assigned to their user which
                                                                                 # will stop users being able to update the statuses of other users in the system
 
+    always_load = ('id', 'created_on')                                          # the cursor of the pagination is built from these
+    stream_retry = 3000                                                         # milliseconds before the browser opens the event stream again
+
+    def get_queryset(self):
+        """Read the archive instead of the live feed with ?archived=1"""
+        params = self.request.query_params
+        if self.action in self.sparse_actions and params.get('archived') == '1':   # the archive is read only, it's filled by manage.py archive_feed
+            self.queryset = models.ArchivedFeedItem.objects.all()
+            if params.get('month'):                                             # ?month=2021-03 reads a single month of the archive
+                self.queryset = self.queryset.filter(bucket=params['month'])
+        return super().get_queryset()
+
+    def list(self, request, *args, **kwargs):
+        """Answer 304 when the live feed didn't change since If-Modified-Since"""
+        if request.query_params.get('archived') == '1':
+            return super().list(request, *args, **kwargs)
+        last_modified = sync.last_modified()                                    # taken before the page is read, so it's never newer than the page
+        if not caching.modified_since(request, last_modified):
+            return caching.not_modified(last_modified)
+        response = super().list(request, *args, **kwargs)
+        caching.set_last_modified(response, last_modified)
+        return response
+
+    @action(detail=False)
+    def changes(self, request):
+        """Return the feed items changed and the IDs deleted after ?since=<cursor or time>"""
+        since = request.query_params.get('since') or request.query_params.get('updated_after')
+        last_modified = sync.last_modified()
+        if not caching.modified_since(request, last_modified):
+            return caching.not_modified(last_modified)
+
+        position = sync.parse_since(since) if since else None
+        horizon = sync.tombstone_horizon()
+        if position is not None and horizon is not None and position[0] < horizon:
+            return Response(                                                    # the tombstones of that time are gone, so we can't tell
+                {'detail': 'The cursor is too old, fetch the whole feed again.'},   # the client everything that was deleted
+                status=status.HTTP_410_GONE
+            )
+        response = Response(sync.changes(
+            position, getattr(settings, 'FEED_CHANGES_LIMIT', 500), getattr(settings, 'FEED_CHANGES_OVERLAP', 30),
+        ))
+        caching.set_last_modified(response, last_modified)
+        return response
+
     def perform_create(self,serializer):
         """Sets the user profile to the logged in user"""
 
@@ -257,6 +475,160 @@ class UserProfileFeedViewSet(viewsets.ModelViewSet):
         # Model View set so when a request gets made to our view set it gets passed into
         # our serializer class and validated
 
-        serializer.save(user_profile=self.request.user)                         # when a new object is created Django
+        if getattr(settings, 'FEED_WRITE_QUEUE', False):                        # with the write queue on, the item is saved by the single writer thread
+            from profiles_api import writequeue                                 # only imported when it's switched on
+            future = writequeue.get_write_queue().submit(                      # together with whatever other posts came in at the same time
+                self.request.user, **serializer.validated_data
+            )
+            serializer.instance = future.result(timeout=30)
+            return
+
+        with transaction.atomic():                                              # the item and the counters of the profile are saved together
+            item = serializer.save(user_profile=self.request.user)              # when a new object is created Django
                                                                                 # rest framework calls perform create and it passes in the serializer that we're
                                                                                 # using to create the object
+            models.UserProfile.objects.add_posts(item.user_profile_id, [item])
+
+    def perform_update(self, serializer):
+        """Keep the last status of the profile in step when it's the one edited"""
+        item = serializer.save()
+        profiles = models.UserProfile.objects.filter(                           # a single conditional UPDATE, no transaction needed around it
+            pk=item.user_profile_id, last_posted_on=item.created_on
+        )
+        if profiles.update(last_status=item.status_text):
+            models.feed_counters_changed.send(sender=models.UserProfile, pks=[item.user_profile_id])
+
+    def perform_destroy(self, instance):
+        """Delete the item and uncount it on the profile"""
+        models.ProfileFeedItem.objects.delete_item(instance)
+
+    @action(detail=False)
+    def mine(self, request):
+        """Return the latest feed items of the logged in user"""
+        return timeline_response(self, request, request.user.id)
+
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk(self, request):
+        """Create a list of feed items for the logged in user at once"""
+        max_items = getattr(settings, 'FEED_BULK_MAX_ITEMS', 100)
+        if not isinstance(request.data, list):
+            return Response(
+                {'detail': 'Expected a list of feed items.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(request.data) > max_items:
+            return Response(
+                {'detail': f'No more than {max_items} feed items can be created at once.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        serializer = self.get_serializer(data=request.data, many=True)
+        if not serializer.is_valid():                                           # the errors are a list with one entry per item we got, the valid
+            return Response(                                                    # items have an empty entry so the client knows which ones to fix
+                {'errors': serializer.errors},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        items = models.ProfileFeedItem.objects.bulk_create_for_user(            # the items are written with one bulk insert in one transaction
+            self.request.user,                                                  # instead of one request, one insert and one commit per status update
+            serializer.validated_data,
+        )
+        return Response(
+            self.get_serializer(items, many=True).data,
+            status=status.HTTP_201_CREATED
+        )
+
+    @action(
+        detail=False,
+        renderer_classes=(renderers.NDJSONRenderer, renderers.CSVRenderer),
+    )
+    def export(self, request):
+        """Stream every feed item as NDJSON (default) or CSV"""
+        from profiles_api import export                                         # the csv module and the export are rarely needed, so
+                                                                                # only the process that serves an export imports them
+        output_format = request.accepted_renderer.format                        # picked by the Accept header or by ?format=
+        response = StreamingHttpResponse(                                       # the rows are written while they're read so the whole table is
+            export.export_lines(output_format),                                 # never held in memory
+            content_type=request.accepted_renderer.media_type,
+        )
+        response['Content-Disposition'] = f'attachment; filename="feed.{output_format}"'
+        return response
+
+    def get_since(self, request):
+        """Read the ID of the last feed item the client has seen"""
+        since = request.query_params.get('since', request.META.get('HTTP_LAST_EVENT_ID'))
+        if since is None:
+            return None
+        try:
+            return int(since)
+        except ValueError:
+            raise ValidationError({'since': 'A feed item ID is required.'})
+
+    @action(detail=False)
+    def poll(self, request):
+        """Long-poll for feed items newer than ?since=<id>
+
+        Like the event stream, only under ASGI does the request wait (on the
+        event loop) for new items. Under WSGI the wait would hold a worker
+        thread, so the response comes right away with the items already there.
+        """
+        since = self.get_since(request)
+        if since is None:                                                       # a new client first learns where the feed is now
+            return Response({'results': [], 'last_id': latest_feed_item_id()})
+
+        renderer = request.accepted_renderer
+        if not isinstance(request._request, ASGIRequest) or renderer.format == 'api':   # the browsable API renders with the request,
+            return Response(poll_data(since, new_feed_items(since, 0)))                 # it can't wait on the event loop
+
+        max_timeout = getattr(settings, 'FEED_POLL_TIMEOUT', 25)
+        try:
+            timeout = min(float(request.query_params.get('timeout', max_timeout)), max_timeout)
+        except ValueError:
+            timeout = max_timeout
+
+        async def body():
+            results = await new_feed_items_async(since, max(timeout, 0))
+            yield renderer.render(poll_data(since, results))                   # the waiting is done, the status can't change any more
+
+        from profiles_api import streaming                                      # only imported under ASGI, uWSGI never needs it
+        response = streaming.AsyncStreamingHttpResponse(body(), content_type=renderer.media_type)
+        response['Cache-Control'] = 'no-cache'
+        return response
+
+    @action(detail=False, renderer_classes=(renderers.EventStreamRenderer,))
+    def stream(self, request):
+        """Stream new feed items as server-sent events
+
+        Under ASGI the stream stays open and waits for new items on the event
+        loop. Under WSGI every open stream would hold a worker thread, so the
+        response ends after the items that are already there and the browser
+        comes back after the retry time with the last ID it saw.
+        """
+        since = self.get_since(request)
+        if since is None:
+            since = latest_feed_item_id()
+        start = f'retry: {self.stream_retry}\nid: {since}\n\n'                  # an ID without data tells the browser where to continue
+
+        if not isinstance(request._request, ASGIRequest):
+            events = [feed_event(payload) for payload in new_feed_items(since, 0)]
+            response = HttpResponse(start + ''.join(events), content_type='text/event-stream')
+            response['Cache-Control'] = 'no-cache'
+            return response
+
+        heartbeat = getattr(settings, 'FEED_POLL_TIMEOUT', 25)
+
+        async def events(since):
+            yield start
+            while True:
+                payloads = await new_feed_items_async(since, heartbeat)
+                if not payloads:
+                    yield ': keep-alive\n\n'                                   # a comment line keeps proxies from closing the idle stream
+                for payload in payloads:
+                    since = payload['id']
+                    yield feed_event(payload)
+
+        from profiles_api import streaming                                      # only imported under ASGI, uWSGI never needs it
+        response = streaming.AsyncStreamingHttpResponse(events(since), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'                                    # tell nginx not to buffer the stream
+        return response
@@ -0,0 +1,96 @@
+# optional single writer for feed posts... instead of every request thread
+# fighting for the SQLite write lock and committing (and syncing) on its own,
+# the request threads hand their feed items to one writer thread which saves
+# whatever has queued up in one transaction and hands the items back
+import queue
+import threading
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from profiles_api import models
+
+
+class FeedWriteQueue:
+    """One background thread that saves queued feed items in batches"""
+
+    def __init__(self, max_batch=100, max_wait=0):
+        self.max_batch = max_batch
+        self.max_wait = max_wait                                                # how long to wait for more items once the first one is in
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, user_profile, **fields):
+        """Queue a feed item for saving, the returned future resolves to it"""
+        self._start()
+        future = Future()
+        self._queue.put((models.ProfileFeedItem(user_profile=user_profile, **fields), future))
+        return future
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='feed-writer', daemon=True)
+                self._thread.start()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]                                             # block until there is something to write
+        try:
+            while len(batch) < self.max_batch:
+                batch.append(self._queue.get(timeout=self.max_wait))
+        except queue.Empty:
+            pass
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                close_old_connections()                                         # a failure here too must not end the thread, or every later
+                self._write(batch)                                              # post would wait for its future forever
+            except Exception as error:
+                for item, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+
+    def _write(self, batch):
+        try:
+            with transaction.atomic():                                          # one transaction (one commit) for the whole batch
+                by_user = {}
+                for item, _ in batch:
+                    item.save()
+                    by_user.setdefault(item.user_profile_id, []).append(item)
+                for user_profile_id, items in by_user.items():                 # one counter update per user, not per item
+                    models.UserProfile.objects.add_posts(user_profile_id, items)
+        except Exception:
+            for item, future in batch:                                          # if the batch fails we save the items one by one
+                item.pk = None                                                  # so a single bad item doesn't fail the others
+                try:
+                    with transaction.atomic():
+                        item.save()
+                        models.UserProfile.objects.add_posts(item.user_profile_id, [item])
+                except Exception as error:
+                    future.set_exception(error)
+                else:
+                    future.set_result(item)
+        else:
+            for item, future in batch:
+                future.set_result(item)
+
+
+_write_queue = None
+
+
+def get_write_queue():
+    """Return the process wide feed write queue"""
+    global _write_queue
+    if _write_queue is None:
+        _write_queue = FeedWriteQueue(
+            max_batch=getattr(settings, 'FEED_WRITE_QUEUE_BATCH', 100),
+            max_wait=getattr(settings, 'FEED_WRITE_QUEUE_WAIT', 0),
+        )
+    return _write_queue
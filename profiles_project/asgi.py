@@ -9,8 +9,19 @@ https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+from django.urls import get_resolver
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'profiles_project.settings')
 
-application = get_asgi_application()
+django.setup(set_prefix=False)                                                  # what get_asgi_application() does, with our handler instead
+
+from profiles_api import metrics                                                # noqa: E402
+from profiles_api.streaming import StreamingASGIHandler                         # noqa: E402
+
+application = StreamingASGIHandler()                                            # streams the export without reading the database on the event loop
+metrics.clear_snapshots()                                                       # the metrics of the workers of the last run
+
+# import the URLconf now, gunicorn --preload loads this module before it forks
+# the workers, so they share the views instead of each importing them
+get_resolver().url_patterns
@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.1/ref/settings/
 """
 
+import importlib.util
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -39,10 +41,13 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'rest_framework',
     'rest_framework.authtoken',
-    'profiles_api',
+    'profiles_api.apps.ProfilesApiConfig',
 ]
 
 MIDDLEWARE = [
+    'profiles_api.middleware.PerformanceMiddleware',                            # first, so it times everything below it
+    'profiles_api.middleware.AdmissionControlMiddleware',                       # sheds load before sessions, authentication and views run
+    'profiles_api.middleware.ReplicaRoutingMiddleware',                         # only active with DB_REPLICAS, before anything reads the database
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -50,6 +55,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'profiles_api.middleware.RefreshedTokenMiddleware',
 ]
 
 ROOT_URLCONF = 'profiles_project.urls'
@@ -80,9 +86,98 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 0)),             # seconds to keep a connection open between requests (0 closes it every time)
+        'OPTIONS': {
+            'timeout': 20,                                                      # seconds to wait for a lock before "database is locked"
+        },
     }
 }
 
+# pragmas applied to every new SQLite connection (see profiles_api/sqlite.py),
+# WAL lets readers carry on while somebody writes and synchronous=NORMAL only
+# syncs at checkpoints which is safe with WAL, set SQLITE_TUNING=0 to get the
+# plain SQLite defaults back
+
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 20000,
+    'mmap_size': 268435456,
+    'temp_store': 'MEMORY',
+} if bool(int(os.environ.get('SQLITE_TUNING', 1))) else {}
+
+
+# Read replicas
+# DB_REPLICAS is a comma separated list of SQLite files that are copies of the
+# primary database (replicated, or copied with "python manage.py sync_replicas"
+# to try it locally), the reads of GET requests go to one of them (see
+# profiles_api/routers.py) and a client that wrote reads from the primary for
+# REPLICA_STICKY_SECONDS... the pins live in REPLICA_PIN_CACHE_ALIAS, which has
+# to be shared when the API runs in more than one process
+
+DATABASE_REPLICAS = []
+for _number, _name in enumerate(filter(None, os.environ.get('DB_REPLICAS', '').split(',')), 1):
+    DATABASES[f'replica{_number}'] = {
+        **DATABASES['default'],
+        'NAME': _name.strip(),
+        'TEST': {'MIRROR': 'default'},                                          # the tests read the test database through the replicas
+    }
+    DATABASE_REPLICAS.append(f'replica{_number}')
+
+DATABASE_ROUTERS = ['profiles_api.routers.ReplicaRouter'] if DATABASE_REPLICAS else []
+REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS', 5))       # longer than the replication lag
+REPLICA_PIN_CACHE_ALIAS = os.environ.get('REPLICA_PIN_CACHE_ALIAS', 'default')
+
+
+# Cache
+# the default local memory cache only lives inside one process, when the API
+# runs with more than one worker CACHE_BACKEND and CACHE_LOCATION must point
+# to a cache that all of them share (memcached...)... the local memory and
+# file based caches forget a random third of their entries once they hold
+# CACHE_MAX_ENTRIES (300 by default), which also resets throttle buckets, replica pins and
+# feed updates, so a file based cache needs a CACHE_MAX_ENTRIES well above
+# the number of clients (the file based one lists its whole directory on
+# every set, it's fine for a small site only)
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    }
+}
+if os.environ.get('CACHE_MAX_ENTRIES'):                                         # memcached takes no such option, it has its own memory limit
+    CACHES['default']['OPTIONS'] = {'MAX_ENTRIES': int(os.environ['CACHE_MAX_ENTRIES'])}
+
+
+# Password hashing
+# PASSWORD_HASHER picks the hasher new passwords are stored with, the others
+# stay in the list so the existing hashes keep working and are rehashed with
+# the preferred one the next time their user logs in ('argon2' needs the
+# argon2-cffi package)
+
+PASSWORD_HASHER = os.environ.get('PASSWORD_HASHER', 'pbkdf2')
+
+_PASSWORD_HASHERS = {
+    'pbkdf2': 'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'argon2': 'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'scrypt': 'profiles_api.hashers.ScryptPasswordHasher',
+}
+
+PASSWORD_HASHERS = [_PASSWORD_HASHERS[PASSWORD_HASHER]] + [
+    hasher for name, hasher in _PASSWORD_HASHERS.items() if name != PASSWORD_HASHER
+] + [
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+]
+
+# the login checks passwords in a pool of LOGIN_HASH_WORKERS threads (one per
+# core by default) with room for LOGIN_HASH_QUEUE waiting logins, when that is
+# full a login gets a 503 with Retry-After straight away
+
+LOGIN_HASH_WORKERS = int(os.environ.get('LOGIN_HASH_WORKERS', 0)) or None
+LOGIN_HASH_QUEUE = int(os.environ.get('LOGIN_HASH_QUEUE', 32))
+LOGIN_HASH_TIMEOUT = int(os.environ.get('LOGIN_HASH_TIMEOUT', 10))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
@@ -130,3 +225,167 @@ AUTH_USER_MODEL = 'profiles_api.UserProfile'
 
 
 STATIC_ROOT = 'static/'
+
+
+# Token authentication cache
+# profiles_api.authentication.CachedTokenAuthentication keeps token -> user
+# lookups in a bounded LRU for TOKEN_CACHE_TTL seconds, set TOKEN_CACHE_ALIAS
+# to the name of one of the CACHES to share the lookups between processes...
+# a deleted token or user is only dropped from the LRU of the process that
+# deleted it, so with more than one process the shared cache is a must and the
+# LRU then keeps a lookup for TOKEN_CACHE_LOCAL_TTL seconds only
+
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 10000))
+TOKEN_CACHE_TTL = int(os.environ.get('TOKEN_CACHE_TTL', 60))
+TOKEN_CACHE_ALIAS = os.environ.get('TOKEN_CACHE_ALIAS') or None
+TOKEN_CACHE_LOCAL_TTL = int(os.environ.get('TOKEN_CACHE_LOCAL_TTL', 5))        # how long another process may still accept a deleted token
+
+
+# Profile search
+# dotted path of the profiles_api.search backend, when it's not set the backend
+# is picked from the database engine (FTS5 on SQLite, trigrams on Postgres)
+
+PROFILE_SEARCH_BACKEND = os.environ.get('PROFILE_SEARCH_BACKEND') or None
+
+
+# Feed
+
+FEED_BULK_MAX_ITEMS = int(os.environ.get('FEED_BULK_MAX_ITEMS', 100))          # how many feed items one POST /api/feed/bulk/ may create
+FEED_WRITE_QUEUE = bool(int(os.environ.get('FEED_WRITE_QUEUE', 0)))            # save feed posts through one writer thread in batched transactions
+FEED_WRITE_QUEUE_BATCH = int(os.environ.get('FEED_WRITE_QUEUE_BATCH', 100))    # most feed posts saved in one transaction
+FEED_WRITE_QUEUE_WAIT = float(os.environ.get('FEED_WRITE_QUEUE_WAIT', 0))      # seconds the writer waits for more posts before it commits
+FEED_CHANGES_LIMIT = int(os.environ.get('FEED_CHANGES_LIMIT', 500))           # most changes one GET /api/feed/changes/ returns
+FEED_TOMBSTONE_DAYS = int(os.environ.get('FEED_TOMBSTONE_DAYS', 30))            # days deletions are remembered for the delta sync (0 forever)
+FEED_CHANGES_OVERLAP = int(os.environ.get('FEED_CHANGES_OVERLAP', 30))          # seconds a sync cursor stays behind now, longer than any write transaction
+
+
+# Response cache
+# the rendered list and retrieve responses of the profile and feed view sets
+# are cached in RESPONSE_CACHE_ALIAS, when the API runs in more than one
+# process this has to be a cache that is shared between them
+
+RESPONSE_CACHE_ENABLED = bool(int(os.environ.get('RESPONSE_CACHE_ENABLED', 1)))
+RESPONSE_CACHE_ALIAS = os.environ.get('RESPONSE_CACHE_ALIAS', 'default')
+RESPONSE_CACHE_TIMEOUT = int(os.environ.get('RESPONSE_CACHE_TIMEOUT', 300))
+
+
+# Async views
+# threads the async views of profiles_api/async_views.py use for database
+# calls, this bounds how many database queries one process runs at a time
+
+ASYNC_DB_WORKERS = int(os.environ.get('ASYNC_DB_WORKERS', 8))
+
+
+# Feed push
+# FEED_PUBSUB_BROKER is the dotted path of a profiles_api.pubsub.Broker shared
+# between processes, by default every process has its own in-process broker...
+# profiles_api.pubsub.CacheBroker shares the new items through the cache named
+# by FEED_PUBSUB_CACHE_ALIAS for FEED_PUBSUB_CACHE_TIMEOUT seconds
+
+FEED_PUBSUB_BROKER = os.environ.get('FEED_PUBSUB_BROKER') or None
+FEED_PUBSUB_CACHE_ALIAS = os.environ.get('FEED_PUBSUB_CACHE_ALIAS', 'default')
+FEED_PUBSUB_CACHE_TIMEOUT = int(os.environ.get('FEED_PUBSUB_CACHE_TIMEOUT', 3600))
+FEED_POLL_TIMEOUT = int(os.environ.get('FEED_POLL_TIMEOUT', 25))                # longest long-poll and time between keep-alives of the event stream
+
+
+# Token expiry
+# the login hands out a signed token ("Authorization: Bearer ...") that is
+# checked without a query and expires after SIGNED_TOKEN_TTL seconds, past
+# SIGNED_TOKEN_REFRESH_AFTER of its lifetime every response carries a fresh one
+# in X-Refreshed-Token... the database tokens ("Authorization: Token ...")
+# expire after AUTH_TOKEN_TTL seconds (0 never), clean both up with
+# "python manage.py purge_tokens"... turning AUTH_TOKEN_TTL on or shortening it
+# ends every database token that is already older at once, their clients have
+# to log in again
+
+SIGNED_TOKEN_TTL = int(os.environ.get('SIGNED_TOKEN_TTL', 3600))
+SIGNED_TOKEN_REFRESH_AFTER = float(os.environ.get('SIGNED_TOKEN_REFRESH_AFTER', 0.5))
+REVOCATION_REFRESH = int(os.environ.get('REVOCATION_REFRESH', 30))             # seconds between reads of revocations made by other processes
+AUTH_TOKEN_TTL = int(os.environ.get('AUTH_TOKEN_TTL', 30 * 24 * 3600))
+
+
+# Rest framework
+# responses are encoded with orjson (and MessagePack for clients that send
+# "Accept: application/msgpack") when those packages are installed, see
+# profiles_api/renderers.py... the browsable API renders a whole HTML page
+# around every response so it's only on with DEBUG unless BROWSABLE_API=1
+
+BROWSABLE_API = bool(int(os.environ.get('BROWSABLE_API', int(DEBUG))))
+_MSGPACK_AVAILABLE = importlib.util.find_spec('msgpack') is not None
+
+_RENDERER_CLASSES = ['profiles_api.renderers.ORJSONRenderer']
+_PARSER_CLASSES = ['profiles_api.renderers.ORJSONParser']
+if _MSGPACK_AVAILABLE:
+    _RENDERER_CLASSES.append('profiles_api.renderers.MessagePackRenderer')
+    _PARSER_CLASSES.append('profiles_api.renderers.MessagePackParser')
+if BROWSABLE_API:
+    _RENDERER_CLASSES.append('rest_framework.renderers.BrowsableAPIRenderer')
+
+REST_FRAMEWORK = {
+    'DEFAULT_THROTTLE_CLASSES': [                                               # token buckets, see the Rate limiting section below
+        'profiles_api.throttling.UserBucketThrottle',
+        'profiles_api.throttling.IPBucketThrottle',
+    ],
+    'NUM_PROXIES': int(os.environ.get('NUM_PROXIES', 1)),                      # nginx sets X-Forwarded-For, so the client address is its last entry
+    'DEFAULT_RENDERER_CLASSES': _RENDERER_CLASSES,
+    'DEFAULT_PARSER_CLASSES': _PARSER_CLASSES + [
+        'rest_framework.parsers.FormParser',                                    # the login form and the browsable API post forms
+        'rest_framework.parsers.MultiPartParser',
+    ],
+}
+
+
+# Feed retention
+# "python manage.py archive_feed" (run it from cron) moves feed items older
+# than FEED_RETENTION_DAYS (0 keeps everything) out of the live feed into the
+# archive table, readable with /api/feed/?archived=1, or into compressed NDJSON
+# files in FEED_ARCHIVE_DIR (feed-<month>.<first ID>.ndjson.gz)
+
+FEED_RETENTION_DAYS = int(os.environ.get('FEED_RETENTION_DAYS', 0))
+FEED_ARCHIVE_TARGET = os.environ.get('FEED_ARCHIVE_TARGET', 'table')           # 'table' or 'files'
+FEED_ARCHIVE_DIR = os.environ.get('FEED_ARCHIVE_DIR', str(BASE_DIR / 'archive'))
+
+
+# Performance metrics
+# every response gets a Server-Timing header (total, database and rendering
+# time) and the timings are kept per view, /metrics serves them in the
+# Prometheus format... they are kept per process, with more than one worker
+# set METRICS_DIR to a directory every worker writes its snapshot to, /metrics
+# then reports all of them together (the percentiles from the samples of the
+# last METRICS_SAMPLE_MAX_AGE seconds)
+
+PERFORMANCE_METRICS = bool(int(os.environ.get('PERFORMANCE_METRICS', 1)))
+METRICS_DIR = os.environ.get('METRICS_DIR') or None
+METRICS_SNAPSHOT_INTERVAL = int(os.environ.get('METRICS_SNAPSHOT_INTERVAL', 5))
+METRICS_SAMPLE_MAX_AGE = int(os.environ.get('METRICS_SAMPLE_MAX_AGE', 300))
+SERVER_TIMING = bool(int(os.environ.get('SERVER_TIMING', 1)))
+
+
+# Rate limiting
+# every logged in user, every anonymous IP address and every IP address that
+# logs in has a token bucket that refills at the rate (requests per second) up
+# to the burst, an empty bucket answers 429 with Retry-After... the buckets
+# live in the process unless THROTTLE_CACHE_ALIAS names a shared cache (see
+# profiles_api/throttling.py for how they work there)
+
+THROTTLE_ENABLED = bool(int(os.environ.get('THROTTLE_ENABLED', 1)))
+THROTTLE_CACHE_ALIAS = os.environ.get('THROTTLE_CACHE_ALIAS') or None
+THROTTLE_BUCKETS = {                                                            # scope: (rate, burst)
+    'user': (float(os.environ.get('THROTTLE_USER_RATE', 20)), int(os.environ.get('THROTTLE_USER_BURST', 100))),
+    'anon': (float(os.environ.get('THROTTLE_ANON_RATE', 10)), int(os.environ.get('THROTTLE_ANON_BURST', 100))),
+    'login': (float(os.environ.get('THROTTLE_LOGIN_RATE', 0.2)), int(os.environ.get('THROTTLE_LOGIN_BURST', 10))),
+}
+
+# admission control: at most ADMISSION_MAX_CONCURRENCY requests of a process
+# run at once and ADMISSION_MAX_QUEUE wait up to ADMISSION_QUEUE_TIMEOUT
+# seconds for a turn, the rest get a 503 straight away (0 switches it off)...
+# it's meant for ASGI, where every request is a task on the event loop and
+# nothing else limits them... a uWSGI worker never hands the middleware more
+# requests than its UWSGI_THREADS, the others wait in the listen queue of
+# uWSGI, so under uWSGI it's off and the short listen queue in
+# deploy/uwsgi_profiles_api.ini turns the excess away instead
+
+ADMISSION_MAX_CONCURRENCY = int(os.environ.get('ADMISSION_MAX_CONCURRENCY') or (0 if os.environ.get('UWSGI_THREADS') else 64))
+ADMISSION_MAX_QUEUE = int(os.environ.get('ADMISSION_MAX_QUEUE', 64))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 2))
+ADMISSION_EXEMPT_PATHS = ('/metrics',)
@@ -0,0 +1,66 @@
+"""
+Production settings for profiles_project.
+
+They start from settings.py and leave out what only the admin and the
+browsable API use, so a worker imports and holds less. Select them with
+DJANGO_SETTINGS_MODULE=profiles_project.settings_production (see
+deploy/supervisor_profiles_api.conf) and compare the two with
+"python manage.py importtime".
+"""
+
+import os
+
+os.environ.setdefault('DEBUG', '0')                                             # read by settings.py, so it has to be set before the import
+
+from profiles_project.settings import *                                         # noqa: E402,F401,F403
+from profiles_project.settings import INSTALLED_APPS, MIDDLEWARE, TEMPLATES, REST_FRAMEWORK   # noqa: E402
+
+
+# Caches
+# the API runs in several worker processes (see deploy/), so what has to be the
+# same in all of them lives in the shared 'default' cache (CACHE_BACKEND)
+
+TOKEN_CACHE_ALIAS = os.environ.get('TOKEN_CACHE_ALIAS', 'default')              # or a deleted token keeps working in the other workers
+FEED_PUBSUB_BROKER = os.environ.get('FEED_PUBSUB_BROKER', 'profiles_api.pubsub.CacheBroker')   # or the feed streams miss the posts of the other workers
+THROTTLE_CACHE_ALIAS = os.environ.get('THROTTLE_CACHE_ALIAS', 'default')        # or every worker has buckets of its own and lets the full rate through
+
+
+# Application definition
+# no admin, so no sessions, messages or static files either... the API
+# authenticates every request with a token and never renders a page
+
+UNUSED_APPS = (
+    'django.contrib.admin',
+    'django.contrib.sessions',
+    'django.contrib.messages',
+    'django.contrib.staticfiles',
+)
+
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in UNUSED_APPS]
+
+UNUSED_MIDDLEWARE = (
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',                                # the rest framework views are csrf exempt anyway
+    'django.contrib.auth.middleware.AuthenticationMiddleware',                  # needs the sessions, the views authenticate themselves
+    'django.contrib.messages.middleware.MessageMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',                   # JSON isn't framed
+)
+
+MIDDLEWARE = [middleware for middleware in MIDDLEWARE if middleware not in UNUSED_MIDDLEWARE]
+
+TEMPLATES = [{
+    **TEMPLATES[0],
+    'OPTIONS': {
+        'context_processors': [],                                               # only the error pages are ever rendered
+    },
+}]
+
+
+# Django REST framework
+# without sessions the session authentication never finds a user, so the
+# views without their own authentication_classes only take basic auth
+
+REST_FRAMEWORK = {
+    **REST_FRAMEWORK,
+    'DEFAULT_AUTHENTICATION_CLASSES': ['rest_framework.authentication.BasicAuthentication'],
+}
@@ -13,10 +13,16 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.contrib import admin
+from django.apps import apps
 from django.urls import path, include
 
+from profiles_api import views as profiles_api_views
+
 urlpatterns = [
-    path('admin/', admin.site.urls),
-    path('api/', include('profiles_api.urls'))                                  # here we are adding a url path using include module where we are passing a path to our URLs storage
+    path('metrics', profiles_api_views.prometheus_metrics),                     # Prometheus scrapes the request timings of profiles_api here
+    path('api/', include('profiles_api.urls')),                                 # here we are adding a url path using include module where we are passing a path to our URLs storage
 ]
+
+if apps.is_installed('django.contrib.admin'):                                   # settings_production.py leaves the admin out, then it's never imported
+    from django.contrib import admin
+    urlpatterns.insert(0, path('admin/', admin.site.urls))
@@ -10,7 +10,17 @@ https://docs.djangoproject.com/en/3.1/howto/deployment/wsgi/
 import os
 
 from django.core.wsgi import get_wsgi_application
+from django.urls import get_resolver
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'profiles_project.settings')
 
 application = get_wsgi_application()
+
+from profiles_api import metrics                                                # noqa: E402
+
+metrics.clear_snapshots()                                                       # the metrics of the workers of the last run
+
+# import the URLconf, and with it the views and the rest framework, now instead
+# of on the first request... uWSGI loads this module once in its master process
+# and the forked workers share what it imported instead of each importing it
+get_resolver().url_patterns